@@ -1,6 +1,127 @@
 #!/usr/bin/env python3
 import io
 from ppci.api import cc, link, asm
+from ppci.arch.riscv.instructions import isa, make_mext, RiscvInstruction, RiscvIToken
+from ppci.arch.riscv.tokens import RiscvcToken
+from ppci.arch.riscv.rvc_relocations import BcImm11Relocation, BcImm8Relocation
+from ppci.arch.riscv.registers import RiscvRegister
+from ppci.arch.encoding import Instruction, Operand, Syntax
+
+# ppci assembler lacks upper half multiplications of RV32M, defining instruction class registers it.
+make_mext("mulh", 0b001)
+make_mext("mulhsu", 0b010)
+make_mext("mulhu", 0b011)
+
+# nor has it generic CSR instructions - CSR is given by number, e.g. 'csrrs x1, 0xc00, x0'.
+def make_csr(mnemonic, funct3, immediate):
+    rd = Operand("rd", RiscvRegister, write=True)
+    csr = Operand("csr", int)
+    src = Operand("src", int) if immediate else Operand("src", RiscvRegister, read=True)
+    members = {
+        "syntax": Syntax([mnemonic, " ", rd, ",", " ", csr, ",", " ", src]),
+        "tokens": [RiscvIToken],
+        "patterns": {"opcode": 0b1110011, "rd": rd, "funct3": funct3, "rs1": src, "imm": csr},
+        "rd": rd,
+        "csr": csr,
+        "src": src,
+    }
+    return type(mnemonic + "_ins", (RiscvInstruction,), members)
+
+make_csr("csrrw", 0b001, immediate=False)
+make_csr("csrrs", 0b010, immediate=False)
+make_csr("csrrc", 0b011, immediate=False)
+make_csr("csrrwi", 0b101, immediate=True)
+make_csr("csrrsi", 0b110, immediate=True)
+make_csr("csrrci", 0b111, immediate=True)
+
+# RV32C instructions ('c.addi x10, 1' etc.) - ones of 'riscv:rvc' target get some immediates wrong,
+# and that target also silently compresses regular instructions. 'encoding' gets operands in order of
+# syntax and returns 16-bit instruction, label offset of 'c.j'/'c.beqz' etc. is filled by relocation.
+isa.register_relocation(BcImm11Relocation)
+isa.register_relocation(BcImm8Relocation)
+
+def bits(value, hi, lo, at):
+    """value[hi:lo] (inclusive), placed at bit 'at'."""
+    return (value >> lo & (1 << (hi - lo + 1)) - 1) << at
+
+def creg(reg):
+    """3-bit register field of x8..x15."""
+    assert 8 <= reg.num < 16, f"register {reg} is not accessible by compressed instruction"
+    return reg.num - 8
+
+def make_rvc(mnemonic, syntax, encoding, relocation=None):
+    operands = [x for x in syntax if isinstance(x, Operand)]
+    def encode(self):
+        tokens = self.get_tokens()
+        tokens[0][0:16] = encoding(*[getattr(self, op._name) for op in operands])
+        return tokens[0].encode()
+    members = {
+        "syntax": Syntax(["c", ".", mnemonic] + ([" "] if syntax else []) + syntax),
+        "tokens": [RiscvcToken],
+        "isa": isa,
+        "encode": encode,
+        **{op._name: op for op in operands},
+    }
+    if relocation is not None:
+        members["relocations"] = lambda self: [relocation(self.target)]
+    return type("c" + mnemonic + "_ins", (Instruction,), members)
+
+# CI format, 'imm' sign-extended.
+def ci(funct3, rd, imm, op=0b01):
+    return op | bits(imm, 4, 0, 2) | rd << 7 | bits(imm, 5, 5, 12) | funct3 << 13
+
+# CA format.
+def ca(funct2, rd, rs2):
+    return 0b01 | creg(rs2) << 2 | funct2 << 5 | creg(rd) << 7 | 0b100011 << 10
+
+# CR format.
+def cr(funct4, rd, rs2):
+    return 0b10 | rs2.num << 2 | rd.num << 7 | funct4 << 12
+
+# CL/CS formats of 'c.lw'/'c.sw'.
+def cls(funct3, rd, imm, rs1):
+    return 0b00 | creg(rd) << 2 | bits(imm, 6, 6, 5) | bits(imm, 2, 2, 6) | creg(rs1) << 7 \
+        | bits(imm, 5, 3, 10) | funct3 << 13
+
+rd = Operand("rd", RiscvRegister, write=True)
+rs1 = Operand("rs1", RiscvRegister, read=True)
+rs2 = Operand("rs2", RiscvRegister, read=True)
+imm = Operand("imm", int)
+target = Operand("target", str)
+make_rvc("addi4spn", [rd, ",", " ", "x2", ",", " ", imm], lambda rd, imm:
+    creg(rd) << 2 | bits(imm, 3, 3, 5) | bits(imm, 2, 2, 6) | bits(imm, 9, 6, 7) | bits(imm, 5, 4, 11))
+make_rvc("lw", [rd, ",", " ", imm, "(", rs1, ")"], lambda rd, imm, rs1: cls(0b010, rd, imm, rs1))
+make_rvc("sw", [rs2, ",", " ", imm, "(", rs1, ")"], lambda rs2, imm, rs1: cls(0b110, rs2, imm, rs1))
+make_rvc("nop", [], lambda: ci(0b000, 0, 0))
+make_rvc("addi", [rd, ",", " ", imm], lambda rd, imm: ci(0b000, rd.num, imm))
+make_rvc("jal", [target], lambda target: 0b01 | 0b001 << 13, relocation=BcImm11Relocation)
+make_rvc("li", [rd, ",", " ", imm], lambda rd, imm: ci(0b010, rd.num, imm))
+make_rvc("addi16sp", ["x2", ",", " ", imm], lambda imm:
+    0b01 | bits(imm, 5, 5, 2) | bits(imm, 8, 7, 3) | bits(imm, 6, 6, 5) | bits(imm, 4, 4, 6)
+    | 2 << 7 | bits(imm, 9, 9, 12) | 0b011 << 13)
+make_rvc("lui", [rd, ",", " ", imm], lambda rd, imm: ci(0b011, rd.num, imm))
+make_rvc("srli", [rd, ",", " ", imm], lambda rd, imm: ci(0b100, creg(rd) | 0b00 << 3, imm))
+make_rvc("srai", [rd, ",", " ", imm], lambda rd, imm: ci(0b100, creg(rd) | 0b01 << 3, imm))
+make_rvc("andi", [rd, ",", " ", imm], lambda rd, imm: ci(0b100, creg(rd) | 0b10 << 3, imm))
+make_rvc("sub", [rd, ",", " ", rs2], lambda rd, rs2: ca(0b00, rd, rs2))
+make_rvc("xor", [rd, ",", " ", rs2], lambda rd, rs2: ca(0b01, rd, rs2))
+make_rvc("or", [rd, ",", " ", rs2], lambda rd, rs2: ca(0b10, rd, rs2))
+make_rvc("and", [rd, ",", " ", rs2], lambda rd, rs2: ca(0b11, rd, rs2))
+make_rvc("j", [target], lambda target: 0b01 | 0b101 << 13, relocation=BcImm11Relocation)
+make_rvc("beqz", [rs1, ",", " ", target], lambda rs1, target: 0b01 | creg(rs1) << 7 | 0b110 << 13,
+    relocation=BcImm8Relocation)
+make_rvc("bnez", [rs1, ",", " ", target], lambda rs1, target: 0b01 | creg(rs1) << 7 | 0b111 << 13,
+    relocation=BcImm8Relocation)
+make_rvc("slli", [rd, ",", " ", imm], lambda rd, imm: ci(0b000, rd.num, imm, op=0b10))
+make_rvc("lwsp", [rd, ",", " ", imm, "(", "x2", ")"], lambda rd, imm:
+    0b10 | bits(imm, 7, 6, 2) | bits(imm, 4, 2, 4) | rd.num << 7 | bits(imm, 5, 5, 12) | 0b010 << 13)
+make_rvc("jr", [rs1], lambda rs1: 0b10 | rs1.num << 7 | 0b1000 << 12)
+make_rvc("mv", [rd, ",", " ", rs2], lambda rd, rs2: cr(0b1000, rd, rs2))
+make_rvc("ebreak", [], lambda: 0b10 | 0b1001 << 12)
+make_rvc("jalr", [rs1], lambda rs1: 0b10 | rs1.num << 7 | 0b1001 << 12)
+make_rvc("add", [rd, ",", " ", rs2], lambda rd, rs2: cr(0b1001, rd, rs2))
+make_rvc("swsp", [rs2, ",", " ", imm, "(", "x2", ")"], lambda rs2, imm:
+    0b10 | rs2.num << 2 | bits(imm, 7, 6, 7) | bits(imm, 5, 2, 9) | 0b110 << 13)
 
 
 source_file = io.StringIO(
@@ -70,7 +191,9 @@ def dump_asm(string, verbose=False):
     code = obj.get_section('code').data
     code = bytes_to_u32_arr(code)
     dump_instrs(code)
-    dump_asm_to_S_file(code, verbose=verbose)
+    # writes 'asm.S' to working directory - only on demand, as tests running in parallel would race on it.
+    if verbose:
+        dump_asm_to_S_file(code, verbose=verbose)
     return code
 
 
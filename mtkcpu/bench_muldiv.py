@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+from argparse import ArgumentParser
+from itertools import count
+
+from common import START_ADDR
+from test_cycles import run_program, instr_cycles
+
+
+# Cycles per operation of multiply-heavy kernels (zero wait-state memory, see 'test_cycles.run_program'),
+# for each RV32M implementation, and for software shift-add multiplication on core without RV32M.
+parser = ArgumentParser()
+parser.add_argument('--pipelined', action='store_const', const=True, default=False, required=False, help="Use 5-stage pipelined core.")
+parser.add_argument('-n', metavar='<elements>', type=int, default=8, required=False, help="Dot product length.")
+
+CONFIGS = {
+    "software":             None,
+    "single_cycle, radix 2": dict(multiplier="single_cycle", divider_radix=2),
+    "single_cycle, radix 4": dict(multiplier="single_cycle", divider_radix=4),
+    "two_cycle, radix 2":    dict(multiplier="two_cycle", divider_radix=2),
+    "two_cycle, radix 4":    dict(multiplier="two_cycle", divider_radix=4),
+}
+
+A_ADDR = 0x2000
+B_ADDR = 0x3000
+
+# x10 += x8 * x9 (x8, x9 are clobbered).
+MUL_ACC = ["mul x8, x8, x9", "add x10, x10, x8"]
+SOFT_MUL_ACC = [
+    "mul_loop{i}:",
+    "andi x12, x9, 1",
+    "beq x12, x0, mul_skip{i}",
+    "add x10, x10, x8",
+    "mul_skip{i}:",
+    "slli x8, x8, 1",
+    "srli x9, x9, 1",
+    "bne x9, x0, mul_loop{i}",
+]
+
+
+def dot_product(n, mul_acc):
+    lines = [
+        f"addi x5, x0, {n}",
+        f"lui x6, {A_ADDR >> 12}",
+        f"lui x7, {B_ADDR >> 12}",
+        "loop:",
+        "lw x8, 0(x6)",
+        "lw x9, 0(x7)",
+        *[l.format(i=0) for l in mul_acc],
+        "addi x6, x6, 4",
+        "addi x7, x7, 4",
+        "addi x5, x5, -1",
+        "bne x5, x0, loop",
+        "addi x31, x0, 1",
+    ]
+    # 8-bit elements, so that shift-add loop takes 8 iterations.
+    mem_init = {}
+    for i, addr in zip(range(n), count(A_ADDR, 4)):
+        mem_init[addr] = 0x80 + i
+    for i, addr in zip(range(n), count(B_ADDR, 4)):
+        mem_init[addr] = 0xc0 + i
+    return lines, mem_init
+
+
+def dot_product_cycles(n, mul_acc, cpu_kwargs):
+    def run(k):
+        lines, mem_init = dot_product(k, mul_acc)
+        return run_program(lines, cpu_kwargs, mem_init=mem_init, timeout=500 * (k + 1))
+    return (run(n) - run(1)) / (n - 1)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"{'config':24}{'mul':>8}{'mulh':>8}{'div':>8}{'rem':>8}{'dot product (per element)':>28}")
+    for name, config in CONFIGS.items():
+        cpu_kwargs = dict(pipelined=args.pipelined)
+        if config is None:
+            ops = ["-"] * 4
+            dot = dot_product_cycles(args.n, SOFT_MUL_ACC, cpu_kwargs)
+        else:
+            cpu_kwargs.update(with_muldiv=True, **config)
+            ops = [instr_cycles(instr, cpu_kwargs) for instr in ["mul x2, x2, x3", "mulh x2, x2, x3", "div x2, x2, x3", "rem x2, x2, x3"]]
+            dot = dot_product_cycles(args.n, MUL_ACC, cpu_kwargs)
+        print(f"{name:24}" + "".join(f"{op:>8}" for op in ops) + f"{dot:>28.1f}")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+from argparse import ArgumentParser
+
+from nmigen import Fragment
+from test_cycles import instr_cycles
+from synth_report import synth_report
+from units.shifter import ShifterUnit
+
+
+# Cycles per shift instruction (zero wait-state memory, see 'test_cycles.run_program') for each
+# shifter implementation, and LUT count, flip-flop count and logic depth of 'ShifterUnit' alone (needs yosys).
+parser = ArgumentParser()
+parser.add_argument('--pipelined', action='store_const', const=True, default=False, required=False, help="Use 5-stage pipelined core.")
+parser.add_argument('--yosys', metavar='<path>', type=str, default="yosys", required=False, help="yosys executable.")
+
+CONFIGS = {
+    "barrel":       dict(implementation="barrel"),
+    "pipelined":    dict(implementation="pipelined"),
+    "iterative 1":  dict(implementation="iterative", bits_per_cycle=1),
+    "iterative 4":  dict(implementation="iterative", bits_per_cycle=4),
+}
+
+AMOUNTS = [1, 4, 5, 16, 31]
+
+
+def shifter_synth(config, yosys):
+    dut = ShifterUnit(**config)
+    fragment = Fragment.get(dut, platform=None)
+    ports = [dut.en, dut.ready, dut.src1, dut.shift, dut.funct3, dut.arithmetic, dut.res, dut.ack]
+    try:
+        return synth_report(fragment, ports, yosys=yosys)
+    except RuntimeError:
+        return {"luts": "-", "ffs": "-", "depth": "-"}
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"{'config':16}" + "".join(f"{'shift ' + str(s):>10}" for s in AMOUNTS) + f"{'LUTs':>8}{'FFs':>8}{'depth':>8}")
+    for name, config in CONFIGS.items():
+        cpu_kwargs = dict(pipelined=args.pipelined, shifter=config["implementation"], shifter_bits_per_cycle=config.get("bits_per_cycle", 1))
+        cycles = [instr_cycles(f"slli x2, x2, {s}", cpu_kwargs) for s in AMOUNTS]
+        report = shifter_synth(config, args.yosys)
+        print(f"{name:16}" + "".join(f"{c:>10.0f}" for c in cycles) + f"{report['luts']:>8}{report['ffs']:>8}{report['depth']:>8}")
@@ -2,8 +2,6 @@
 from nmigen import *
 from enum import Enum
 from nmigen.hdl.rec import * # Record, Layout
-from operator import or_
-from functools import reduce
 from common import START_ADDR
 
 MEM_WORDS = 10
@@ -14,56 +12,40 @@ class Error(Enum):
     MISALIGNED_INSTR = 2
 
 from isa import *
-from units.loadstore import LoadStoreUnit, MemoryUnit, MemoryArbiter, match_load, match_loadstore_unit
-from units.logic import LogicUnit, match_logic_unit
-from units.adder import AdderUnit, match_adder_unit
-from units.shifter import ShifterUnit, match_shifter_unit
-from units.compare import CompareUnit, match_compare_unit
-from units.upper import match_lui, match_auipc
+from units.loadstore import LoadStoreUnit, MemoryUnit, MemoryArbiter
+from units.logic import LogicUnit
+from units.adder import AdderUnit
+from units.shifter import ShifterUnit
+from units.compare import CompareUnit
+from units.branch import BranchUnit
+from units.muldiv import MulDivUnit
+from units.csr import CsrUnit
+from units.rvc import CompressedExpander
+from units.decoder import InstructionDecoder, ActiveUnit
 from units.rvficon import RVFIController, rvfi_layout
+from units.icache import InstructionCache
+from units.dcache import DataCache
+from units.prefetch import PrefetchUnit
+from units.upper import FusionDetector
+from units.bpu import BranchPredictor, BranchKind, is_link
+from units.crossbar import Crossbar, Decoder
+from units.tcm import TightlyCoupledMemory
 
-from common import matcher
-
-match_jal = matcher([
-    (InstrType.JAL, ),
-])
-
-match_jalr = matcher([
-    (InstrType.JALR, Funct3.JALR),
-])
-
-match_branch = matcher([
-    (InstrType.BRANCH, Funct3.BEQ),
-    (InstrType.BRANCH, Funct3.BNE),
-    (InstrType.BRANCH, Funct3.BLT),
-    (InstrType.BRANCH, Funct3.BGE),
-    (InstrType.BRANCH, Funct3.BLTU),
-    (InstrType.BRANCH, Funct3.BGEU),
-])
-
-
-class ActiveUnitLayout(Layout):
-    def __init__(self):
-        super().__init__([
-            ("logic", 1),
-            ("adder", 1),
-            ("shifter", 1),
-            ("mem_unit", 1),
-            ("compare", 1),
-            ("lui", 1),
-            ("auipc", 1),
-            ("jal", 1),
-            ("jalr", 1),
-            ("branch", 1),
-        ])
-
-class ActiveUnit(Record):
-    def __init__(self):
-        super().__init__(ActiveUnitLayout(), name="active_unit")
+def branch_kind(unit, rd, rs1):
+    return Mux(unit.branch, BranchKind.BRANCH,
+        Mux(unit.jalr & (rd == 0) & is_link(rs1), BranchKind.RETURN,
+            Mux(is_link(rd), BranchKind.CALL, BranchKind.JUMP)))
 
 
 class MtkCpu(Elaboratable):
-    def __init__(self, reg_init=[0 for _ in range(32)], with_rvfi=False):
+    def __init__(self, reg_init=[0 for _ in range(32)], with_rvfi=False, pipelined=False, forwarding=True,
+            with_icache=False, icache_nways=1, icache_nlines=32, icache_nwords=4, icache_replacement="lru",
+            with_dcache=False, dcache_nways=1, dcache_nlines=32, dcache_nwords=4, dcache_replacement="lru",
+            prefetch_depth=0, branch_predictor=None, btb_entries=32, pht_entries=128, ras_depth=4,
+            arbiter_scheme="priority", ibus_weight=1, dbus_weight=1, memory_map=None,
+            tcm_size=0, tcm_base=START_ADDR, tcm_init=None, store_buffer_depth=0,
+            with_muldiv=False, multiplier="single_cycle", divider_radix=2, shifter="barrel", shifter_bits_per_cycle=1,
+            hpm_counters=4, with_rvc=False, pending_loads=0, fusion=False):
 
         if len(reg_init) > 32:
             raise ValueError(f"Register init length (={len(reg_init)}) exceedes 32!")
@@ -72,8 +54,105 @@ class MtkCpu(Elaboratable):
             print(f"WARNING, register x0 set to value {reg_init[0]}, however it will be overriden with zero..")
         reg_init[0] = 0
 
+        if pipelined and prefetch_depth:
+            raise ValueError("Prefetch queue is used only by multi-cycle core, pipelined core always fetches ahead.")
+        if branch_predictor is not None and not (pipelined or prefetch_depth):
+            raise ValueError("Branch predictor requires fetching ahead, use either pipelined core or prefetch queue.")
+        if with_rvc and (pipelined or prefetch_depth):
+            raise ValueError("Compressed instructions are supported only by multi-cycle core without prefetch queue.")
+        if fusion and prefetch_depth < 2:
+            raise ValueError("Macro-op fusion requires prefetch queue of depth at least 2.")
+        if pending_loads and pipelined:
+            raise ValueError("Non-blocking loads are supported only by multi-cycle core.")
+        if pending_loads and store_buffer_depth:
+            raise ValueError("Store buffer cannot be used together with non-blocking loads.")
+
         self.with_rvfi = with_rvfi
 
+        # when set, classic 5-stage pipeline (IF/ID/EX/MEM/WB) is used instead of multi-cycle FSM.
+        self.pipelined = pipelined
+        # pipelined core only - bypass results from EX/MEM stages instead of waiting for WB.
+        self.forwarding = forwarding
+
+        # Instruction cache, sits between instruction fetch and memory arbiter.
+        self.with_icache = with_icache
+        self.icache_params = dict(
+            nways=icache_nways,
+            nlines=icache_nlines,
+            nwords=icache_nwords,
+            replacement=icache_replacement,
+        )
+
+        # Write-back data cache, sits between memory unit and memory arbiter.
+        self.with_dcache = with_dcache
+        self.dcache_params = dict(
+            nways=dcache_nways,
+            nlines=dcache_nlines,
+            nwords=dcache_nwords,
+            replacement=dcache_replacement,
+        )
+
+        # multi-cycle core only - when non-zero, instructions are fetched ahead into queue of given depth.
+        self.prefetch_depth = prefetch_depth
+
+        # Branch predictor ("bimodal" or "gshare"), that steers fetching ahead. None means always 'pc + 4'.
+        self.branch_predictor = branch_predictor
+        self.bp_params = dict(
+            predictor=branch_predictor,
+            btb_entries=btb_entries,
+            pht_entries=pht_entries,
+            ras_depth=ras_depth,
+        )
+
+        # How memory arbiter chooses between instruction fetch and data ports ("priority" - data port first,
+        # "round_robin" or "weighted" - port keeps bus for up to 'ibus_weight'/'dbus_weight' consecutive tenures).
+        self.arbiter_scheme = arbiter_scheme
+        self.ibus_weight = ibus_weight
+        self.dbus_weight = dbus_weight
+
+        # When set (list of (name, base, size), see 'Crossbar'), masters reach address-decoded slave buses
+        # through crossbar interconnect, instead of sharing single bus.
+        self.memory_map = memory_map
+
+        # When 'tcm_size' is non-zero, tightly-coupled memory (initialized from 'tcm_init' - dict, ELF or hex image path)
+        # is mapped at 'tcm_base', reachable by both instruction fetch and data ports without going through arbiter.
+        if tcm_size:
+            self.tcm = TightlyCoupledMemory(base=tcm_base, size=tcm_size, image=tcm_init)
+        else:
+            self.tcm = None
+
+        # When non-zero, stores retire as soon as they are put in store buffer of given depth (see 'MemoryUnit').
+        self.store_buffer_depth = store_buffer_depth
+
+        # multi-cycle core only - when non-zero, loads retire as soon as they are issued, and up to 'pending_loads'
+        # of them complete in background. Instruction that reads or writes register of load in flight waits.
+        self.pending_loads = pending_loads
+
+        # multi-cycle core with prefetch queue only - pairs of instructions recognized by 'FusionDetector'
+        # are popped from the queue together, and executed as the second one.
+        self.fusion = fusion
+
+        # "barrel", "pipelined" or "iterative" (shifting by 'shifter_bits_per_cycle' per cycle), see 'ShifterUnit'.
+        self.shifter_params = dict(
+            implementation=shifter,
+            bits_per_cycle=shifter_bits_per_cycle,
+        )
+
+        # Number of programmable 'mhpmcounter<k>' CSRs, see 'CsrUnit' for events they can count.
+        self.hpm_counters = hpm_counters
+
+        # RV32M extension, see 'MulDivUnit' for 'multiplier' and 'divider_radix' choices.
+        self.with_muldiv = with_muldiv
+        self.muldiv_params = dict(
+            multiplier=multiplier,
+            divider_radix=divider_radix,
+        )
+
+        # RV32C extension - 16-bit instructions are expanded (see 'CompressedExpander') before decoding,
+        # fetched words are kept in fetch buffer, so that fetching next instruction from the same word
+        # takes no memory access.
+        self.with_rvc = with_rvc
+
         # 0xDE for debugging (uninitialized data magic byte)
         self.reg_init = reg_init + [0x0]  * (len(reg_init) - 32)
 
@@ -89,7 +168,14 @@ class MtkCpu(Elaboratable):
 
         self.err = Signal(Error, reset=Error.OK)
 
-        self.DEBUG_CTR = Signal(32)
+        # Performance counters (name -> Signal), filled during elaboration, readable from simulator.
+        self.counters = {}
+
+    # Simulation only - writes register file with 'values' (x<i> = values[i], rest is zeroed), so that
+    # simulation of already elaborated CPU can be reused with other registers state. x0 stays zero.
+    def sim_load_regs(self, values):
+        for i in range(1, 32):
+            yield self.regs[i].eq(values[i] if i < len(values) else 0)
 
     def elaborate(self, platform):
         m = Module()
@@ -102,19 +188,80 @@ class MtkCpu(Elaboratable):
             self.rvfi = Record(rvfi_layout)
 
 
-        sync += self.DEBUG_CTR.eq(self.DEBUG_CTR + 1)
+        # Memory interface. 'buses' maps name of each bus to be connected to memory (slave) to it's Record.
+        if self.memory_map is None:
+            arbiter = self.arbiter = m.submodules.arbiter = MemoryArbiter(scheme=self.arbiter_scheme)
+            self.buses = { "mem": arbiter.bus }
+        else:
+            arbiter = self.arbiter = m.submodules.crossbar = Crossbar(self.memory_map, scheme=self.arbiter_scheme)
+            self.buses = arbiter.slaves
+        ibus_port = arbiter.port(priority=1, weight=self.ibus_weight, name="ibus")
+        dbus = arbiter.port(priority=0, weight=self.dbus_weight, name="dbus")
+        self.counters.update(arbiter.ctrs)
+
+        if self.tcm is not None:
+            m.submodules.tcm = self.tcm
+            tcm_map = [("tcm", self.tcm.base, self.tcm.size), ("bus", 0x0, None)]
+            ibus_dec = m.submodules.ibus_dec = Decoder(tcm_map, { "tcm": self.tcm.port(writable=False), "bus": ibus_port })
+            dbus_dec = m.submodules.dbus_dec = Decoder(tcm_map, { "tcm": self.tcm.port(writable=True), "bus": dbus })
+            ibus_port, dbus = ibus_dec.bus, dbus_dec.bus
 
-        # Memory interface.
-        arbiter = self.arbiter = m.submodules.arbiter = MemoryArbiter()
+        if self.with_icache:
+            ibus = self.ibus = m.submodules.ibus = InstructionCache(mem_port=ibus_port, **self.icache_params)
+            self.counters["icache_hit"] = ibus.hit_ctr
+            self.counters["icache_miss"] = ibus.miss_ctr
+        else:
+            ibus = self.ibus = m.submodules.ibus = LoadStoreUnit(mem_port=ibus_port)
 
-        ibus = self.ibus = m.submodules.ibus = LoadStoreUnit(mem_port=arbiter.port(priority=1))
+        if self.branch_predictor is not None:
+            bp = self.bp = m.submodules.bp = BranchPredictor(**self.bp_params)
+            self.counters.update(bp.ctrs)
+            # cycles lost on refetch after misprediction.
+            self.bp_penalty_ctr = self.counters["bp_penalty"] = Signal(32, name="BP_PENALTY_CTR")
+        else:
+            bp = self.bp = None
 
         # CPU units used.
         logic = m.submodules.logic = LogicUnit()
         adder = m.submodules.adder = AdderUnit()
-        shifter = m.submodules.shifter = ShifterUnit()
-        mem_unit = m.submodules.mem_unit = MemoryUnit(mem_port=arbiter.port(priority=0))
+        shifter = m.submodules.shifter = ShifterUnit(**self.shifter_params)
+        if self.with_dcache:
+            dcache = self.dcache = DataCache(mem_port=dbus, **self.dcache_params)
+            self.counters["dcache_hit"] = dcache.hit_ctr
+            self.counters["dcache_miss"] = dcache.miss_ctr
+            self.counters["dcache_writeback"] = dcache.writeback_ctr
+        else:
+            dcache = self.dcache = None
+        mem_unit = m.submodules.mem_unit = MemoryUnit(mem_port=dbus, dcache=dcache,
+            store_buffer_depth=self.store_buffer_depth, pending_loads=self.pending_loads)
+        self.mem_unit = mem_unit
+        if self.store_buffer_depth:
+            self.counters["store_buffer_merge"] = mem_unit.merge_ctr
+            self.counters["store_buffer_forward"] = mem_unit.forward_ctr
+            self.counters["store_buffer_full"] = mem_unit.full_ctr
         compare = m.submodules.compare = CompareUnit()
+        branch = m.submodules.branch = BranchUnit()
+        if self.with_muldiv:
+            muldiv = m.submodules.muldiv = MulDivUnit(**self.muldiv_params)
+        else:
+            muldiv = None
+        csr = self.csr = m.submodules.csr = CsrUnit(hpm_counters=self.hpm_counters)
+        self.counters["cycles"] = csr.cycle
+        self.counters["instret"] = csr.instret
+        if self.with_icache:
+            comb += [
+                csr.events.icache_hit.eq(ibus.hit),
+                csr.events.icache_miss.eq(ibus.miss),
+            ]
+        if self.with_dcache:
+            comb += [
+                csr.events.dcache_hit.eq(dcache.hit),
+                csr.events.dcache_miss.eq(dcache.miss),
+            ]
+
+        if self.pipelined:
+            self.elaborate_pipeline(m, logic, adder, shifter, mem_unit, compare, branch, muldiv, csr)
+            return m
 
         # Current decoding state signals.
         instr = Signal(32)
@@ -126,20 +273,23 @@ class MtkCpu(Elaboratable):
         rs1val = Signal(32)
         rs2val = Signal(32)
         rdval = Signal(32) # calculated by unit, stored to register file
-        imm = Signal(signed(12))
-        uimm = Signal(20)
         opcode = Signal(InstrType)
 
+        # Control vector of instruction being executed, registered by decoder.
+        decoder = m.submodules.decoder = InstructionDecoder(with_muldiv=self.with_muldiv)
+        ctrl = decoder.ctrl
+        imm = ctrl.imm
+
         # Register file. Contains two read ports (for rs1, rs2) and one write port. 
-        regs = Memory(width=32, depth=32, init=self.reg_init)
+        regs = self.regs = Memory(width=32, depth=32, init=self.reg_init)
         reg_read_port1 = m.submodules.reg_read_port1 = regs.read_port()
         reg_read_port2 = m.submodules.reg_read_port2 = regs.read_port()
         reg_write_port = self.reg_write_port = m.submodules.reg_write_port = regs.write_port()
         
         comb += [
-            reg_read_port1.addr.eq(rs1),
+            # 'lui' needs rd, that will be available in next cycle in rs1val.
+            reg_read_port1.addr.eq(Mux(decoder.dec.src1_rd, rd, rs1)),
             reg_read_port2.addr.eq(rs2),
-            rs1val.eq(reg_read_port1.data),
             rs2val.eq(reg_read_port2.data),
 
             reg_write_port.addr.eq(rd),
@@ -147,16 +297,58 @@ class MtkCpu(Elaboratable):
             # reg_write_port.en set later
         ]
         # Additional register - program counter.
-        pc = Signal(32, reset=START_ADDR)
+        pc = self.pc = Signal(32, reset=START_ADDR, name="pc")
 
         # assert ( popcount(active_unit) in [0, 1] )
-        active_unit = ActiveUnit()
+        if self.pending_loads:
+            # registers to be written by loads in flight (x0 is never marked).
+            scoreboard = Signal(32)
+            # instruction waits (with no unit active) until result of load in flight it depends on is written.
+            hazard = Signal()
+            comb += hazard.eq(
+                (ctrl.src1_used & scoreboard.bit_select(reg_read_port1.addr, 1))
+                | (ctrl.src2_used & scoreboard.bit_select(rs2, 1))
+                | (ctrl.write_rd & scoreboard.bit_select(rd, 1)))
+            active_unit = ActiveUnit()
+            comb += active_unit.eq(Mux(hazard, 0, ctrl.unit))
+            self.load_use_stall_ctr = self.counters["load_use_stall"] = Signal(32, name="LOAD_USE_STALL_CTR")
+            sync += self.load_use_stall_ctr.eq(self.load_use_stall_ctr + hazard)
+        else:
+            active_unit = ctrl.unit
 
-        # this is not true for all instrutions, but in specific cases will be overwritten later
-        comb += [
-            imm.eq(instr[20:32]),
-            uimm.eq(instr[12:]),
-        ]
+        if self.prefetch_depth:
+            prefetch = self.prefetch = m.submodules.prefetch = PrefetchUnit(ibus, depth=self.prefetch_depth, bp=bp)
+            self.counters["prefetch_occupancy"] = prefetch.occupancy_ctr
+            self.counters["prefetch_flush"] = prefetch.flush_ctr
+            # address of instruction that was fetched after current one, and branch predictor state.
+            pred_next = Signal(32)
+            pred_index = Signal(prefetch.index_bits)
+            # set after flush, until next instruction arrives.
+            penalty = Signal()
+            # new requests would be served before 'fence.i' writes back data cache.
+            comb += prefetch.hold.eq(active_unit.fence_i)
+
+        if self.fusion:
+            fuser = m.submodules.fuser = FusionDetector()
+            self.fused_ctr = self.counters["fused"] = Signal(32, name="FUSED_CTR")
+            # set when instruction being executed is the second one of fused pair - 'pc' points to it already,
+            # and 'rs1' value is the one that the first instruction would write ('fused_imm' is it's immediate,
+            # with 'pc' added for 'auipc').
+            fused = Signal()
+            fused_lui = Signal()
+            fused_imm = Signal(32)
+            comb += [
+                fuser.first.eq(prefetch.instr),
+                fuser.second.eq(prefetch.instr2),
+                # 'lui' keeps lowest 12 bits of 'rd' (which is the 'rs1' read).
+                rs1val.eq(Mux(fused,
+                    Mux(fused_lui, (reg_read_port1.data & 0x0000_0FFF) | fused_imm, fused_imm),
+                    reg_read_port1.data)),
+            ]
+        else:
+            comb += rs1val.eq(reg_read_port1.data)
+
+        comb += adder.sub.eq(ctrl.sub)
 
         # drive input signals of actually used unit.
         with m.If(active_unit.logic):
@@ -164,7 +356,7 @@ class MtkCpu(Elaboratable):
                 logic.funct3.eq(funct3),
                 logic.src1.eq(rs1val),
                 logic.src2.eq(Mux(
-                    opcode == InstrType.OP_IMM,
+                    ctrl.src2_imm,
                     imm,
                     rs2val
                 )),
@@ -173,19 +365,21 @@ class MtkCpu(Elaboratable):
             comb += [
                 adder.src1.eq(rs1val),
                 adder.src2.eq(Mux(
-                    opcode == InstrType.OP_IMM,
+                    ctrl.src2_imm,
                     imm,
                     rs2val
                 )),
             ]
         with m.Elif(active_unit.shifter):
             comb += [
+                shifter.en.eq(1),
                 shifter.funct3.eq(funct3),
+                shifter.arithmetic.eq(funct7[5]),
                 shifter.src1.eq(rs1val),
                 shifter.shift.eq(Mux(
-                    opcode == InstrType.OP_IMM, 
+                    ctrl.src2_imm,
                     imm[0:5],
-                    rs2val[0:5]) # TODO check semantics
+                    rs2val[0:5])
                 ),
             ]
         with m.Elif(active_unit.mem_unit):
@@ -194,12 +388,31 @@ class MtkCpu(Elaboratable):
                 mem_unit.funct3.eq(funct3),
                 mem_unit.src1.eq(rs1val),
                 mem_unit.src2.eq(rs2val),
-                mem_unit.store.eq(opcode == InstrType.STORE),
-                mem_unit.offset.eq(Mux(
-                    opcode == InstrType.LOAD,
-                    imm,
-                    Cat(rd, imm[5:12])
-                )),
+                mem_unit.store.eq(ctrl.store),
+                mem_unit.offset.eq(imm),
+                mem_unit.rd.eq(rd),
+            ]
+        with m.Elif(active_unit.fence_i):
+            # dirty data has to reach memory before instructions are fetched again.
+            comb += [
+                mem_unit.en.eq(1),
+                mem_unit.fence.eq(1),
+            ]
+        if muldiv is not None:
+            with m.Elif(active_unit.muldiv):
+                comb += [
+                    muldiv.en.eq(1),
+                    muldiv.funct3.eq(funct3),
+                    muldiv.src1.eq(rs1val),
+                    muldiv.src2.eq(rs2val),
+                ]
+        with m.Elif(active_unit.csr):
+            comb += [
+                csr.en.eq(1),
+                csr.funct3.eq(funct3),
+                csr.addr.eq(instr[20:32]),
+                csr.rs1.eq(rs1),
+                csr.src1.eq(Mux(funct3[2], rs1, rs1val)),
             ]
         with m.Elif(active_unit.compare):
             comb += [
@@ -208,23 +421,13 @@ class MtkCpu(Elaboratable):
                 # Compare Unit uses Adder for carry and overflow flags. 
                 adder.src1.eq(rs1val),
                 adder.src2.eq(Mux(
-                    opcode == InstrType.OP_IMM, 
+                    ctrl.src2_imm,
                     imm,
                     rs2val)
                 ),
                 # adder.sub set somewhere below
             ]
 
-        with m.Elif(active_unit.branch):
-            comb += [
-                compare.funct3.eq(funct3),
-                
-                # Compare Unit uses Adder for carry and overflow flags. 
-                adder.src1.eq(rs1val),
-                adder.src2.eq(rs2val),
-                # adder.sub set somewhere below
-            ]
-
         comb += [
             compare.negative.eq(adder.res[-1]),
             compare.overflow.eq(adder.overflow),
@@ -232,191 +435,326 @@ class MtkCpu(Elaboratable):
             compare.zero.eq(adder.res == 0),
         ]
 
-        # Decoding state (with redundancy - instr. type not known yet).     
-        # We use 'ibus.read_data' instead of 'instr' (that is driven by sync domain) for getting registers to save 1 cycle.           
+        # Decoding state (with redundancy - instr. type not known yet).
+        # Instruction is decoded in the same cycle it arrives (from 'ibus' or prefetch queue), thus 'dec_instr'
+        # is either just fetched instruction, or 'instr' (that is driven by sync domain) later on.
+        dec_instr = Signal(32)
+        decode = Signal()
         comb += [
-            opcode.eq(  instr[0:7]),
-            rd.eq(      instr[7:12]),
-            funct3.eq(  instr[12:15]),
-            rs1.eq(     instr[15:20]),
-            rs2.eq(     instr[20:25]),
-            funct7.eq(  instr[25:32]),
+            dec_instr.eq(instr),
+            decoder.instr.eq(dec_instr),
+            decoder.en.eq(decode),
+            opcode.eq(  dec_instr[0:7]),
+            rd.eq(      dec_instr[7:12]),
+            funct3.eq(  dec_instr[12:15]),
+            rs1.eq(     dec_instr[15:20]),
+            rs2.eq(     dec_instr[20:25]),
+            funct7.eq(  dec_instr[25:32]),
         ]
 
-        with m.FSM() as fsm:
-            with m.State("FETCH"):
-                with m.If(pc & 0b11):
-                    comb += self.err.eq(Error.MISALIGNED_INSTR)
-                    m.next = "FETCH" # loop
-                with m.Else():
-                    sync += [
-                        ibus.en.eq(1),
-                        ibus.store.eq(0),
-                        ibus.addr.eq(pc),
-                        ibus.mask.eq(0b1111),
-                    ]
-                    with m.If(ibus.en & ~ibus.busy):
-                        m.next = "WAIT_FETCH"
-                    with m.Else():
-                        m.next = "FETCH"
-            with m.State("WAIT_FETCH"):
-                with m.If(ibus.ack):
-                    sync += [
-                        instr.eq(ibus.read_data),
-                        ibus.en.eq(0),
-                    ]
-                    m.next = "DECODE"
-                with m.Else():
-                    m.next = "WAIT_FETCH"
-            with m.State("DECODE"):
-                # here, we have registers already fetched into rs1val, rs2val.
-                with m.If(instr & 0b11 != 0b11):
-                    comb += self.err.eq(Error.OP_CODE)
-                    m.next = "DECODE" # loop TODO
-
-                with m.If(match_logic_unit(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.logic.eq(1),
-                    ]
-                with m.Elif(match_adder_unit(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.adder.eq(1),
-                        adder.sub.eq((opcode == InstrType.ALU) & (funct7 == Funct7.SUB)),
-                    ]
-                with m.Elif(match_shifter_unit(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.shifter.eq(1),
-                    ]
-                with m.Elif(match_loadstore_unit(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.mem_unit.eq(1),
-                    ]
-                with m.Elif(match_compare_unit(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.compare.eq(1),
-                        adder.sub.eq(1),
+        # here, registers are being read - rs1val, rs2val will be available in EXECUTE.
+        with m.If(decode):
+            with m.If(dec_instr & 0b11 != 0b11):
+                comb += self.err.eq(Error.OP_CODE)
+
+            with m.If(decoder.dec.illegal):
+                comb += self.err.eq(Error.OP_CODE)
+
+        with m.If(csr.illegal):
+            comb += self.err.eq(Error.OP_CODE)
+
+        # Result of executed instruction, written back to register file in the last cycle of EXECUTE.
+        with m.If(active_unit.logic):
+            comb += rdval.eq(logic.res)
+        with m.Elif(active_unit.adder):
+            comb += rdval.eq(adder.res)
+        with m.Elif(active_unit.shifter):
+            comb += rdval.eq(shifter.res)
+        with m.Elif(active_unit.mem_unit):
+            comb += rdval.eq(mem_unit.res)
+        if muldiv is not None:
+            with m.Elif(active_unit.muldiv):
+                comb += rdval.eq(muldiv.res)
+        with m.Elif(active_unit.compare):
+            comb += rdval.eq(compare.condition_met)
+        with m.Elif(active_unit.csr):
+            comb += rdval.eq(csr.res)
+        with m.Elif(active_unit.lui):
+            comb += rdval.eq((rs1val & 0x0000_0FFF) | imm)
+        with m.Elif(active_unit.auipc):
+            comb += rdval.eq(pc + imm)
+        with m.Elif(active_unit.jal | active_unit.jalr):
+            comb += rdval.eq(branch.fall_through)
+
+        comb += [
+            branch.jal.eq(active_unit.jal),
+            branch.jalr.eq(active_unit.jalr),
+            branch.branch.eq(active_unit.branch),
+            branch.funct3.eq(funct3),
+            branch.src1.eq(rs1val),
+            branch.src2.eq(rs2val),
+            branch.pc.eq(pc),
+            branch.imm.eq(imm),
+        ]
+        taken = branch.taken
+        next_pc = branch.next_pc
+
+        def issue_fetch(addr):
+            m.d.comb += [
+                ibus.en.eq(1),
+                ibus.store.eq(0),
+                ibus.addr.eq(addr),
+                ibus.mask.eq(0b1111),
+            ]
+            with m.If(~ibus.busy):
+                m.next = "WAIT_FETCH"
+            with m.Else():
+                m.next = "FETCH"
+
+        if self.with_rvc:
+            rvc = m.submodules.rvc = CompressedExpander()
+            # last fetched word, with it's (word) address.
+            fbuf = Signal(32)
+            fbuf_addr = Signal(30)
+            fbuf_valid = Signal()
+            # set while lower half of 32-bit instruction crossing word boundary waits for the upper one.
+            straddle = Signal()
+            lower_half = Signal(16)
+            # instruction being executed is compressed one, 'pc' advances by 2.
+            compressed = Signal()
+            self.fbuf_hit_ctr = self.counters["fetch_buffer_hit"] = Signal(32, name="FETCH_BUFFER_HIT_CTR")
+
+            # word containing instruction at 'pc' (or it's upper half, when 'straddle' is set).
+            fetch_addr = Signal(30)
+            fbuf_hit = Signal()
+            fetch_word = Signal(32)
+            parcel = Signal(16)
+            comb += [
+                fetch_addr.eq((pc + Mux(straddle, 2, 0))[2:32]),
+                fbuf_hit.eq(fbuf_valid & (fbuf_addr == fetch_addr)),
+                parcel.eq(Mux(pc[1], fetch_word[16:32], fetch_word[0:16])),
+                rvc.instr.eq(parcel),
+                branch.compressed.eq(compressed),
+            ]
+
+            # decodes instruction at 'pc' from 'word' at 'fetch_addr' - if it's a 32-bit one that starts in
+            # upper half of the word, fetches the next word first.
+            def take(word):
+                m.d.comb += fetch_word.eq(word)
+                with m.If(straddle):
+                    m.d.comb += [
+                        dec_instr.eq(Cat(lower_half, word[0:16])),
+                        decode.eq(1),
                     ]
-                with m.Elif(match_lui(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.lui.eq(1),
+                    m.d.sync += [
+                        instr.eq(Cat(lower_half, word[0:16])),
+                        straddle.eq(0),
+                        compressed.eq(0),
                     ]
-                    comb += [
-                        reg_read_port1.addr.eq(rd),
-                        # rd will be available in next cycle in rs1val
+                    m.next = "EXECUTE"
+                with m.Elif(parcel[0:2] != 0b11):
+                    m.d.comb += [
+                        dec_instr.eq(rvc.res),
+                        decode.eq(1),
                     ]
-                with m.Elif(match_auipc(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.auipc.eq(1),
+                    m.d.sync += [
+                        instr.eq(rvc.res),
+                        compressed.eq(1),
                     ]
-                with m.Elif(match_jal(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.jal.eq(1),
+                    with m.If(rvc.illegal):
+                        m.d.comb += self.err.eq(Error.OP_CODE)
+                    m.next = "EXECUTE"
+                with m.Elif(~pc[1]):
+                    m.d.comb += [
+                        dec_instr.eq(word),
+                        decode.eq(1),
                     ]
-                with m.Elif(match_jalr(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.jalr.eq(1),
+                    m.d.sync += [
+                        instr.eq(word),
+                        compressed.eq(0),
                     ]
-                with m.Elif(match_branch(opcode, funct3, funct7)):
-                    sync += [
-                        active_unit.branch.eq(1),
-                        adder.sub.eq(1),
+                    m.next = "EXECUTE"
+                with m.Else():
+                    m.d.sync += [
+                        lower_half.eq(word[16:32]),
+                        straddle.eq(1),
                     ]
-                m.next = "EXECUTE"
+                    m.next = "FETCH"
+
+        write_rd = Signal()
+        if self.pending_loads:
+            # load writes 'rd' only when it's data arrives, see below.
+            comb += write_rd.eq(ctrl.write_rd & ~(active_unit.mem_unit & ~ctrl.store))
+        else:
+            comb += write_rd.eq(ctrl.write_rd)
+
+        with m.FSM() as fsm:
+            with m.State("FETCH"):
+                # instructions are aligned to 2 bytes with RV32C.
+                with m.If(pc & (0b01 if self.with_rvc else 0b11)):
+                    comb += self.err.eq(Error.MISALIGNED_INSTR)
+                    m.next = "FETCH" # loop
+                with m.Else():
+                    if self.prefetch_depth:
+                        with m.If(prefetch.valid):
+                            comb += [
+                                prefetch.pop.eq(1),
+                                dec_instr.eq(prefetch.instr),
+                                decode.eq(1),
+                            ]
+                            sync += [
+                                instr.eq(prefetch.instr),
+                                pred_next.eq(prefetch.pred_next),
+                                pred_index.eq(prefetch.pred_index),
+                                penalty.eq(0),
+                            ]
+                            if self.fusion:
+                                sync += fused.eq(0)
+                                # second instruction has to be the one following the first (not predicted jump target).
+                                with m.If(prefetch.valid2 & fuser.fuse & (prefetch.pred_next == pc + 4)):
+                                    comb += [
+                                        prefetch.pop2.eq(1),
+                                        dec_instr.eq(prefetch.instr2),
+                                    ]
+                                    sync += [
+                                        instr.eq(prefetch.instr2),
+                                        pred_next.eq(prefetch.pred_next2),
+                                        pred_index.eq(prefetch.pred_index2),
+                                        pc.eq(pc + 4),
+                                        fused.eq(1),
+                                        fused_lui.eq(fuser.lui),
+                                        fused_imm.eq(Mux(fuser.lui, 0, pc) + fuser.imm),
+                                        self.fused_ctr.eq(self.fused_ctr + 1),
+                                    ]
+                            m.next = "EXECUTE"
+                        if bp is not None:
+                            with m.Elif(penalty):
+                                sync += self.bp_penalty_ctr.eq(self.bp_penalty_ctr + 1)
+                    elif self.with_rvc:
+                        with m.If(fbuf_hit):
+                            take(fbuf)
+                            sync += self.fbuf_hit_ctr.eq(self.fbuf_hit_ctr + 1)
+                        with m.Else():
+                            issue_fetch(Cat(Const(0, 2), fetch_addr))
+                    else:
+                        issue_fetch(pc)
+            if not self.prefetch_depth:
+                with m.State("WAIT_FETCH"):
+                    with m.If(ibus.ack):
+                        if self.with_rvc:
+                            sync += [
+                                fbuf.eq(ibus.read_data),
+                                fbuf_addr.eq(fetch_addr),
+                                fbuf_valid.eq(1),
+                            ]
+                            take(ibus.read_data)
+                        else:
+                            comb += [
+                                dec_instr.eq(ibus.read_data),
+                                decode.eq(1),
+                            ]
+                            sync += [
+                                instr.eq(ibus.read_data),
+                            ]
+                            m.next = "EXECUTE"
+                    with m.Else():
+                        m.next = "WAIT_FETCH"
             with m.State("EXECUTE"):
-                with m.If(active_unit.logic):
-                    sync += [
-                        rdval.eq(logic.res),
-                    ]
-                with m.Elif(active_unit.adder):
-                    sync += [
-                        rdval.eq(adder.res),
-                    ]
+                if self.with_icache:
+                    # next FETCH will wait until all lines are invalidated.
+                    comb += ibus.flush.eq(active_unit.fence_i)
+
+                # all units not specified by default take 1 cycle.
+                done = Signal()
+                with m.If(active_unit.mem_unit | active_unit.fence_i):
+                    comb += done.eq(mem_unit.ack)
                 with m.Elif(active_unit.shifter):
-                    sync += [
-                        rdval.eq(shifter.res),
-                    ]
-                with m.Elif(active_unit.mem_unit):
-                    sync += [
-                        rdval.eq(mem_unit.res),
-                    ]
-                with m.Elif(active_unit.compare):
-                    sync += [
-                        rdval.eq(compare.condition_met),
-                    ]
-                with m.Elif(active_unit.lui):
-                    sync += [
-                        rdval.eq(
-                            (rs1val & 0x0000_0FFF) | Cat(Const(0, 12), uimm)
-                        ),
-                    ]
-                with m.Elif(active_unit.auipc):
-                    sync += [
-                        rdval.eq(
-                            pc + Cat(Const(0, 12), uimm)
-                        ),
-                    ]
-                with m.Elif(active_unit.jal | active_unit.jalr):
-                    sync += [
-                        rdval.eq(pc + 4),
-                    ]
-                # with m.Elif(active_unit.branch):
-                #     pass
+                    comb += done.eq(shifter.ack)
+                if muldiv is not None:
+                    with m.Elif(active_unit.muldiv):
+                        comb += done.eq(muldiv.ack)
+                with m.Else():
+                    comb += done.eq(1)
+                if self.pending_loads:
+                    with m.If(hazard):
+                        comb += done.eq(0)
 
-                with m.If(active_unit.mem_unit):
-                    with m.If(mem_unit.ack):
-                        m.next = "WRITEBACK"
-                        sync += active_unit.eq(0)
-                    with m.Else():
-                        m.next = "EXECUTE"
+                with m.If(done):
+                    # If neccessary, put rdval into register file.
+                    with m.If(write_rd):
+                        comb += reg_write_port.en.eq(True)
+                    comb += csr.retire.eq(1)
+                    if self.fusion:
+                        comb += csr.retire_fused.eq(fused)
+                    comb += decoder.clear.eq(1)
+                    sync += pc.eq(next_pc)
+                    if self.with_rvc:
+                        # fetch buffer might hold stale copy of modified code.
+                        with m.If(active_unit.fence_i):
+                            sync += fbuf_valid.eq(0)
+                    m.next = "FETCH"
                 with m.Else():
-                    # all units not specified by default take 1 cycle
-                    m.next = "WRITEBACK"
-                    sync += active_unit.eq(0)
-
-                pc_offset = Signal(signed(32))
-                comb += pc_offset.eq(Mux(
-                    active_unit.jal,
-                    Cat(Const(0, 1), instr[21:31], instr[20], instr[12:20], instr[31]),
-                    rs1val + imm, # jalr, TODO get rid of that DSP here
-                ))
-                pc_addend = Signal(signed(32))
-                sync += pc_addend.eq(Mux(
-                    active_unit.jal | active_unit.jalr,
-                    pc_offset,
-                    4
-                ))
-
-                branch_addend = Signal(signed(13))
-                comb += branch_addend.eq(
-                    Cat(Const(0, 1), instr[8:12], instr[25:31], instr[7], instr[31])
-                )
-
-                with m.If(active_unit.branch):
-                    with m.If(compare.condition_met):
-                        sync += pc_addend.eq(branch_addend)
-
-            with m.State("WRITEBACK"):
-
-                sync += pc.eq(pc + pc_addend)
-
-                # Here, rdval is already calculated. If neccessary, put it into register file.
-                should_write_rd = reduce(or_,
-                    [
-                        match_shifter_unit(opcode, funct3, funct7),
-                        match_adder_unit(opcode, funct3, funct7),
-                        match_logic_unit(opcode, funct3, funct7),
-                        match_load(opcode, funct3, funct7),
-                        match_compare_unit(opcode, funct3, funct7),
-                        match_lui(opcode, funct3, funct7),
-                        match_auipc(opcode, funct3, funct7),
-                        match_jal(opcode, funct3, funct7),
-                        match_jalr(opcode, funct3, funct7),
-                    ]
-                ) & (rd != 0)
+                    m.next = "EXECUTE"
 
-                with m.If(should_write_rd):
-                    comb += reg_write_port.en.eq(True)
-                m.next = "FETCH"
+                if self.prefetch_depth:
+                    mispredict = next_pc != pred_next
+                    with m.If(done):
+                        # instructions following 'fence.i' might be already fetched, refetch them.
+                        comb += [
+                            prefetch.flush.eq(mispredict | active_unit.fence_i),
+                            prefetch.flush_pc.eq(next_pc),
+                        ]
+                        sync += penalty.eq(mispredict | active_unit.fence_i)
+                    if bp is not None:
+                        comb += [
+                            bp.upd_valid.eq(active_unit.jal | active_unit.jalr | active_unit.branch),
+                            bp.upd_pc.eq(pc),
+                            bp.upd_index.eq(pred_index),
+                            bp.upd_kind.eq(branch_kind(active_unit, rd, rs1)),
+                            bp.upd_taken.eq(taken),
+                            bp.upd_target.eq(next_pc),
+                            bp.upd_miss.eq(mispredict),
+                        ]
+
+        if self.pending_loads:
+            # completed load is written back in cycle when register file port is not used by EXECUTE.
+            load_wb = Signal()
+            load_issue = Signal()
+            comb += [
+                load_wb.eq(mem_unit.load_valid & ~(fsm.ongoing("EXECUTE") & done & write_rd)),
+                load_issue.eq(fsm.ongoing("EXECUTE") & done & active_unit.mem_unit & ~ctrl.store & (rd != 0)),
+                mem_unit.load_pop.eq(load_wb),
+            ]
+            with m.If(load_wb):
+                comb += [
+                    # load into x0 is still performed (and popped), but not written back.
+                    reg_write_port.en.eq(mem_unit.load_rd != 0),
+                    reg_write_port.addr.eq(mem_unit.load_rd),
+                    reg_write_port.data.eq(mem_unit.load_res),
+                ]
+            sync += scoreboard.eq(
+                scoreboard & ~Mux(load_wb, Const(1, 32) << mem_unit.load_rd, 0)
+                | Mux(load_issue, Const(1, 32) << rd, 0))
+            comb += csr.events.load_use_stall.eq(hazard)
+
+        # events counted by 'mhpmcounter<k>', 'active_unit' is set only in EXECUTE.
+        comb += [
+            csr.events.fetch_stall.eq(~fsm.ongoing("EXECUTE") & ~decode),
+            csr.events.mem_wait.eq((active_unit.mem_unit | active_unit.fence_i) & ~mem_unit.ack),
+            csr.events.branch_taken.eq(active_unit.branch & taken),
+            csr.events.logic_busy.eq(active_unit.logic),
+            csr.events.adder_busy.eq(active_unit.adder),
+            csr.events.shifter_busy.eq(active_unit.shifter),
+            csr.events.mem_unit_busy.eq(active_unit.mem_unit),
+            csr.events.compare_busy.eq(active_unit.compare),
+            csr.events.branch_busy.eq(active_unit.jal | active_unit.jalr | active_unit.branch),
+            csr.events.muldiv_busy.eq(active_unit.muldiv),
+            csr.events.csr_busy.eq(active_unit.csr),
+        ]
+        if self.prefetch_depth:
+            # otherwise, next instruction is fetched only after 'pc' is resolved.
+            comb += csr.events.branch_miss.eq(
+                (active_unit.jal | active_unit.jalr | active_unit.branch) & (next_pc != pred_next))
 
         # TODO
         # That piece of code comes from minerva CPU, for now it's only copy-pasted.
@@ -455,3 +793,470 @@ class MtkCpu(Elaboratable):
         
         return m
 
+
+    def elaborate_pipeline(self, m, logic, adder, shifter, mem_unit, compare, branch, muldiv, csr):
+        comb = m.d.comb
+        sync = m.d.sync
+        ibus = self.ibus
+        bp = self.bp
+
+        # Register file. Read ports are asynchronous, so that operands are available in ID stage
+        # in the same cycle that instruction got there.
+        regs = self.regs = Memory(width=32, depth=32, init=self.reg_init)
+        reg_read_port1 = m.submodules.reg_read_port1 = regs.read_port(domain="comb")
+        reg_read_port2 = m.submodules.reg_read_port2 = regs.read_port(domain="comb")
+        reg_write_port = self.reg_write_port = m.submodules.reg_write_port = regs.write_port()
+
+        # Naming convention (same as minerva): 'f_' - IF, 'd_' - ID, 'e_' - EX, 'm_' - MEM, 'w_' - WB.
+        # Each of 'd_', 'e_', 'm_', 'w_' signal set is a pipeline register, that stage reads from.
+
+        # Program counter of next instruction to be fetched.
+        fetch_pc = Signal(32, reset=START_ADDR)
+        f_pc = Signal(32)   # address of in-flight fetch
+        f_kill = Signal()   # in-flight fetch was issued on wrong path, drop it's result
+        index_bits = 0 if bp is None else bp.pht_bits
+        # address fetched after each instruction, and branch predictor state (passed down to EX).
+        f_pred_next = Signal(32)
+        f_pred_index = Signal(index_bits)
+
+        d_valid = Signal()
+        d_pc = Signal(32)
+        d_instr = Signal(32)
+        d_pred_next = Signal(32)
+        d_pred_index = Signal(index_bits)
+
+        e_valid = Signal()
+        # 'pc' of instruction being executed (e.g. for waveform capture triggers) is the one in EX stage.
+        e_pc = self.pc = Signal(32, name="e_pc")
+        e_instr = Signal(32)
+        e_pred_next = Signal(32)
+        e_pred_index = Signal(index_bits)
+        # control vector of instruction in EX stage, registered by decoder in ID stage.
+        decoder = m.submodules.decoder = InstructionDecoder(with_muldiv=self.with_muldiv)
+        e_ctrl = decoder.ctrl
+        e_unit = e_ctrl.unit
+        e_write_rd = e_ctrl.write_rd
+        e_rs1val = Signal(32)
+        e_rs2val = Signal(32)
+        e_result = Signal(32)
+
+        m_valid = Signal()
+        m_mem_unit = Signal()
+        m_fence_i = Signal()
+        m_store = Signal()
+        m_funct3 = Signal(Funct3)
+        m_src1 = Signal(32)
+        m_src2 = Signal(32)
+        m_offset = Signal(signed(12))
+        m_rd = Signal(5)
+        m_write_rd = Signal()
+        m_result = Signal(32)
+        m_rdval = Signal(32)
+
+        w_valid = Signal()
+        w_rd = Signal(5)
+        w_write_rd = Signal()
+        w_rdval = Signal(32)
+
+        # Stall and flush signals.
+        m_stall = Signal()
+        e_stall = Signal()
+        d_stall = Signal()
+        hazard = Signal()
+        redirect = Signal()         # mispredicted jump/branch in EX, flushes younger instructions
+        redirect_pc = Signal(32)
+
+        comb += [
+            m_stall.eq(m_valid & (m_mem_unit | m_fence_i) & ~mem_unit.ack),
+            d_stall.eq(e_stall | hazard),
+        ]
+        # multi-cycle units (shifter other than "barrel", RV32M) hold EX stage, until result is acked.
+        e_wait = e_unit.shifter & ~shifter.ack
+        if muldiv is not None:
+            e_wait |= e_unit.muldiv & ~muldiv.ack
+        comb += e_stall.eq(m_stall | (e_valid & e_wait))
+
+        # IF stage.
+        d_ready = Signal() # ID will accept new instruction in next cycle
+        f_push = Signal()
+        comb += d_ready.eq((~d_valid | ~d_stall) & ~redirect)
+
+        # 'fence.i' in MEM stage - memory (and instruction cache) might not be up to date yet.
+        fetch_hold = Signal()
+        comb += fetch_hold.eq(m_valid & m_fence_i)
+
+        # issues fetch of 'fetch_pc' (if 'ibus' accepts it), otherwise goes back to FETCH.
+        def issue_fetch():
+            m.d.comb += [
+                ibus.en.eq(1),
+                ibus.store.eq(0),
+                ibus.addr.eq(fetch_pc),
+                ibus.mask.eq(0b1111),
+            ]
+            with m.If(~ibus.busy):
+                if bp is not None:
+                    m.d.comb += [
+                        bp.pc.eq(fetch_pc),
+                        bp.fetch.eq(~redirect),
+                    ]
+                    next_pc = Mux(bp.taken, bp.target, fetch_pc + 4)
+                    m.d.sync += f_pred_index.eq(bp.index)
+                else:
+                    next_pc = fetch_pc + 4
+                m.d.sync += [
+                    f_pc.eq(fetch_pc),
+                    f_kill.eq(redirect),
+                    fetch_pc.eq(next_pc),
+                    f_pred_next.eq(next_pc),
+                ]
+                m.next = "WAIT_FETCH"
+            with m.Else():
+                m.next = "FETCH"
+
+        with m.FSM(name="fetch"):
+            with m.State("FETCH"):
+                with m.If(fetch_pc & 0b11):
+                    comb += self.err.eq(Error.MISALIGNED_INSTR)
+                with m.Elif(~fetch_hold):
+                    # unlike multi-cycle core, drive 'ibus' combinationally to save one cycle per fetch.
+                    issue_fetch()
+            with m.State("WAIT_FETCH"):
+                with m.If(redirect):
+                    sync += f_kill.eq(1)
+                with m.If(ibus.ack):
+                    with m.If(f_kill | redirect):
+                        m.next = "FETCH"
+                    with m.Elif(d_ready):
+                        comb += f_push.eq(1)
+                        # next fetch is issued in the same cycle, so that 'ibus' gets one request per cycle.
+                        with m.If(~fetch_hold & ~(fetch_pc & 0b11).any()):
+                            issue_fetch()
+                        with m.Else():
+                            m.next = "FETCH"
+                    with m.Else():
+                        m.next = "HOLD"
+            with m.State("HOLD"):
+                # 'ibus.read_data' stays valid until next transaction.
+                with m.If(redirect):
+                    m.next = "FETCH"
+                with m.Elif(d_ready):
+                    comb += f_push.eq(1)
+                    m.next = "FETCH"
+
+        # overrides 'fetch_pc' assignment from the FSM above.
+        with m.If(redirect):
+            sync += fetch_pc.eq(redirect_pc)
+
+        with m.If(f_push):
+            sync += [
+                d_valid.eq(1),
+                d_pc.eq(f_pc),
+                d_instr.eq(ibus.read_data),
+                d_pred_next.eq(f_pred_next),
+                d_pred_index.eq(f_pred_index),
+            ]
+        with m.Elif(redirect | ~d_stall):
+            sync += d_valid.eq(0)
+
+        # ID stage.
+        d_rd = Signal(5)
+        d_rs1 = Signal(5)
+        d_rs2 = Signal(5)
+        d_rs1val = Signal(32)
+        d_rs2val = Signal(32)
+
+        comb += [
+            d_rd.eq(    d_instr[7:12]),
+            d_rs1.eq(   d_instr[15:20]),
+            d_rs2.eq(   d_instr[20:25]),
+        ]
+
+        comb += [
+            decoder.instr.eq(d_instr),
+            decoder.en.eq(~e_stall),
+        ]
+
+        # 'lui' keeps lowest 12 bits of 'rd', thus it reads 'rd' instead of 'rs1' (same as multi-cycle core).
+        d_src1 = Signal(5)
+        d_src1_used = Signal()
+        d_src2_used = Signal()
+        comb += [
+            d_src1.eq(Mux(decoder.dec.src1_rd, d_rd, d_rs1)),
+            d_src1_used.eq(decoder.dec.src1_used),
+            d_src2_used.eq(decoder.dec.src2_used),
+            reg_read_port1.addr.eq(d_src1),
+            reg_read_port2.addr.eq(d_rs2),
+        ]
+
+        # Register written in WB stage is not yet visible in register file - bypass it.
+        # With forwarding enabled, also results of EX and MEM stages are bypassed (younger first).
+        def read_reg(addr, port):
+            val = Mux(
+                reg_write_port.en & (reg_write_port.addr == addr),
+                reg_write_port.data,
+                port.data
+            )
+            if self.forwarding:
+                val = Mux(forward_m(addr), m_rdval, val)
+                val = Mux(forward_e(addr), e_result, val)
+            return val
+
+        def forward_e(addr):
+            return e_valid & e_write_rd & (e_instr[7:12] == addr)
+
+        def forward_m(addr):
+            return m_valid & m_write_rd & (m_rd == addr)
+
+        comb += [
+            d_rs1val.eq(read_reg(d_src1, reg_read_port1)),
+            d_rs2val.eq(read_reg(d_rs2, reg_read_port2)),
+        ]
+
+        # RAW hazard - source register is going to be written by instruction in EX or MEM stage,
+        # and it's value cannot be forwarded yet (load result is known no sooner than 'mem_unit.ack').
+        def pending_write(addr):
+            if self.forwarding:
+                return (forward_e(addr) & e_unit.mem_unit) \
+                    | (forward_m(addr) & m_mem_unit & ~mem_unit.ack)
+            return forward_e(addr) | forward_m(addr)
+
+        comb += hazard.eq(d_valid & (
+            (d_src1_used & (d_src1 != 0) & pending_write(d_src1))
+            | (d_src2_used & (d_rs2 != 0) & pending_write(d_rs2))
+        ))
+
+        hazard_ctr = self.counters["hazard_stall"] = Signal(32, name="HAZARD_STALL_CTR")
+        forward_ctr = self.counters["forward"] = Signal(32, name="FORWARD_CTR")
+
+        with m.If(hazard & ~e_stall):
+            sync += hazard_ctr.eq(hazard_ctr + 1)
+
+        if self.forwarding:
+            forwarded = Signal(2)
+            comb += forwarded.eq(Cat(
+                d_src1_used & (d_src1 != 0) & (forward_e(d_src1) | forward_m(d_src1)),
+                d_src2_used & (d_rs2 != 0) & (forward_e(d_rs2) | forward_m(d_rs2)),
+            ))
+            with m.If(d_valid & ~d_stall & ~redirect):
+                sync += forward_ctr.eq(forward_ctr + forwarded[0] + forwarded[1])
+
+        with m.If(~e_stall):
+            sync += [
+                e_valid.eq(d_valid & ~hazard & ~redirect),
+                e_pc.eq(d_pc),
+                e_instr.eq(d_instr),
+                e_pred_next.eq(d_pred_next),
+                e_pred_index.eq(d_pred_index),
+                e_rs1val.eq(d_rs1val),
+                e_rs2val.eq(d_rs2val),
+            ]
+
+        # EX stage.
+        e_funct3 = Signal(3)
+        e_imm = e_ctrl.imm
+
+        comb += e_funct3.eq(e_instr[12:15])
+
+        with m.If(e_unit.logic):
+            comb += [
+                logic.funct3.eq(e_funct3),
+                logic.src1.eq(e_rs1val),
+                logic.src2.eq(Mux(
+                    e_ctrl.src2_imm,
+                    e_imm,
+                    e_rs2val
+                )),
+            ]
+        with m.Elif(e_unit.shifter):
+            comb += [
+                shifter.en.eq(e_valid),
+                shifter.ready.eq(~m_stall),
+                shifter.funct3.eq(e_funct3),
+                shifter.arithmetic.eq(e_instr[30]),
+                shifter.src1.eq(e_rs1val),
+                shifter.shift.eq(Mux(
+                    e_ctrl.src2_imm,
+                    e_imm[0:5],
+                    e_rs2val[0:5])
+                ),
+            ]
+        if muldiv is not None:
+            with m.Elif(e_unit.muldiv):
+                comb += [
+                    muldiv.en.eq(e_valid),
+                    # result is held, while it cannot be passed to MEM stage.
+                    muldiv.ready.eq(~m_stall),
+                    muldiv.funct3.eq(e_funct3),
+                    muldiv.src1.eq(e_rs1val),
+                    muldiv.src2.eq(e_rs2val),
+                ]
+        with m.Elif(e_unit.csr):
+            comb += [
+                csr.en.eq(e_valid & ~e_stall),
+                csr.funct3.eq(e_funct3),
+                csr.addr.eq(e_instr[20:32]),
+                csr.rs1.eq(e_instr[15:20]),
+                csr.src1.eq(Mux(e_funct3[2], e_instr[15:20], e_rs1val)),
+            ]
+        with m.Elif(e_unit.adder | e_unit.compare):
+            comb += [
+                compare.funct3.eq(e_funct3),
+                # Compare Unit uses Adder for carry and overflow flags.
+                adder.src1.eq(e_rs1val),
+                adder.src2.eq(Mux(
+                    e_ctrl.src2_imm,
+                    e_imm,
+                    e_rs2val
+                )),
+            ]
+
+        comb += [
+            adder.sub.eq(e_ctrl.sub),
+            compare.negative.eq(adder.res[-1]),
+            compare.overflow.eq(adder.overflow),
+            compare.carry.eq(adder.carry),
+            compare.zero.eq(adder.res == 0),
+        ]
+
+        with m.If(e_unit.logic):
+            comb += e_result.eq(logic.res)
+        with m.Elif(e_unit.adder):
+            comb += e_result.eq(adder.res)
+        with m.Elif(e_unit.shifter):
+            comb += e_result.eq(shifter.res)
+        with m.Elif(e_unit.compare):
+            comb += e_result.eq(compare.condition_met)
+        with m.Elif(e_unit.csr):
+            comb += e_result.eq(csr.res)
+        if muldiv is not None:
+            with m.Elif(e_unit.muldiv):
+                comb += e_result.eq(muldiv.res)
+        with m.Elif(e_unit.lui):
+            comb += e_result.eq((e_rs1val & 0x0000_0FFF) | e_imm)
+        with m.Elif(e_unit.auipc):
+            comb += e_result.eq(e_pc + e_imm)
+        with m.Elif(e_unit.jal | e_unit.jalr):
+            comb += e_result.eq(e_pc + 4)
+
+        # Control transfer. Fetch follows 'pc + 4' or address predicted by 'bp', redirect if it was wrong.
+
+        # 'BranchUnit' has it's own comparator, so it doesn't depend on 'AdderUnit' driven by ALU instruction.
+        e_taken = branch.taken
+        e_target = branch.target
+        e_mispredict = Signal()
+        e_retire = Signal() # instruction leaves EX stage (and retires, as all of them do)
+        comb += [
+            branch.jal.eq(e_unit.jal),
+            branch.jalr.eq(e_unit.jalr),
+            branch.branch.eq(e_unit.branch),
+            branch.funct3.eq(e_funct3),
+            branch.src1.eq(e_rs1val),
+            branch.src2.eq(e_rs2val),
+            branch.pc.eq(e_pc),
+            branch.imm.eq(e_imm),
+        ]
+
+        comb += [
+            e_retire.eq(e_valid & ~e_stall),
+            redirect_pc.eq(branch.next_pc),
+            e_mispredict.eq(redirect_pc != e_pred_next),
+            redirect.eq(e_valid & ~e_stall & (
+                e_mispredict
+                # instructions following 'fence.i' might be already fetched, refetch them.
+                | e_unit.fence_i
+            )),
+        ]
+
+        if bp is not None:
+            comb += [
+                bp.upd_valid.eq(e_valid & ~e_stall & (e_unit.jal | e_unit.jalr | e_unit.branch)),
+                bp.upd_pc.eq(e_pc),
+                bp.upd_index.eq(e_pred_index),
+                bp.upd_kind.eq(branch_kind(e_unit, e_instr[7:12], e_instr[15:20])),
+                bp.upd_taken.eq(e_taken),
+                bp.upd_target.eq(e_target),
+                bp.upd_miss.eq(e_mispredict),
+            ]
+
+            # count cycles from redirect until correct instruction reaches ID.
+            penalty = Signal()
+            with m.If(redirect):
+                sync += penalty.eq(1)
+            with m.Elif(f_push):
+                sync += penalty.eq(0)
+            with m.If(penalty & ~f_push):
+                sync += self.bp_penalty_ctr.eq(self.bp_penalty_ctr + 1)
+
+        # events counted by 'mhpmcounter<k>'.
+        e_busy = lambda unit: e_valid & unit
+        comb += [
+            csr.retire.eq(e_retire),
+            csr.events.fetch_stall.eq(~d_valid),
+            csr.events.mem_wait.eq(m_stall),
+            csr.events.branch_taken.eq(e_retire & e_unit.branch & e_taken),
+            csr.events.branch_miss.eq(e_retire & e_mispredict),
+            csr.events.logic_busy.eq(e_busy(e_unit.logic)),
+            csr.events.adder_busy.eq(e_busy(e_unit.adder)),
+            csr.events.shifter_busy.eq(e_busy(e_unit.shifter)),
+            csr.events.mem_unit_busy.eq(e_busy(e_unit.mem_unit)),
+            csr.events.compare_busy.eq(e_busy(e_unit.compare)),
+            csr.events.branch_busy.eq(e_busy(e_unit.jal | e_unit.jalr | e_unit.branch)),
+            csr.events.muldiv_busy.eq(e_busy(e_unit.muldiv)),
+            csr.events.csr_busy.eq(e_busy(e_unit.csr)),
+        ]
+
+        # illegal instruction is reported once it reaches EX - while in ID, it may be on wrong path (e.g. data
+        # or compressed halfword fetched after taken jump) and get flushed by 'redirect' or 'hazard' bubble.
+        with m.If(e_valid & ((e_instr[0:2] != 0b11) | e_ctrl.illegal)):
+            comb += self.err.eq(Error.OP_CODE)
+
+        with m.If(csr.illegal):
+            comb += self.err.eq(Error.OP_CODE)
+
+        with m.If(~m_stall):
+            sync += [
+                # bubble is inserted, while EX stage is stalled by itself (multi-cycle unit operation in progress).
+                m_valid.eq(e_valid & ~e_stall),
+                m_mem_unit.eq(e_unit.mem_unit),
+                m_fence_i.eq(e_unit.fence_i),
+                m_store.eq(e_ctrl.store),
+                m_funct3.eq(e_funct3),
+                m_src1.eq(e_rs1val),
+                m_src2.eq(e_rs2val),
+                m_offset.eq(e_imm),
+                m_rd.eq(e_instr[7:12]),
+                m_write_rd.eq(e_write_rd),
+                m_result.eq(e_result),
+            ]
+
+        # MEM stage.
+        comb += [
+            mem_unit.en.eq(m_valid & (m_mem_unit | m_fence_i)),
+            mem_unit.fence.eq(m_fence_i),
+            mem_unit.funct3.eq(m_funct3),
+            mem_unit.src1.eq(m_src1),
+            mem_unit.src2.eq(m_src2),
+            mem_unit.store.eq(m_store),
+            mem_unit.offset.eq(m_offset),
+        ]
+
+        comb += m_rdval.eq(Mux(m_mem_unit, mem_unit.res, m_result))
+
+        if self.with_icache:
+            # Invalidate once dirty data is written back. Cache serves pending invalidation
+            # before any other request (i.a. refetch after redirect, held by 'fetch_hold' until now).
+            comb += ibus.flush.eq(m_valid & m_fence_i & mem_unit.ack)
+
+        sync += [
+            w_valid.eq(m_valid & ~m_stall),
+            w_rd.eq(m_rd),
+            w_write_rd.eq(m_write_rd),
+            w_rdval.eq(m_rdval),
+        ]
+
+        # WB stage.
+        comb += [
+            reg_write_port.addr.eq(w_rd),
+            reg_write_port.data.eq(w_rdval),
+            reg_write_port.en.eq(w_valid & w_write_rd),
+        ]
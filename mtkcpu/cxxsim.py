@@ -0,0 +1,714 @@
+import os
+import ctypes
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from nmigen.hdl.ast import *
+from nmigen.hdl.ast import SignalDict
+from nmigen.hdl.ir import Fragment
+from nmigen.hdl.xfrm import ValueVisitor, StatementVisitor, LHSGroupFilter
+from nmigen.back.pysim import Delay, Settle, Passive, Active
+
+
+# Simulator of nMigen design, compiled to C++ (shared library, loaded with 'ctypes').
+#
+# Generated code mirrors 'nmigen.back.pysim' compiler - each (fragment, domain) pair becomes single function,
+# values are held in 128-bit integers with the same (Python) semantics, and combinatorial functions are rerun
+# (in delta cycles) when any of their inputs changes - thus results are cycle-exact with 'pysim'.
+# Design may have single clock domain only, values can't be wider than 'MAX_WIDTH' bits.
+#
+# Testbench is a generator function, as for 'pysim' 'add_process' (see 'run'), that may yield:
+# * 'Value' (Signal, Const, Slice, Cat or Record of those) - to read it,
+# * 'Assign' to Signal (memory words are Signals as well) - to write it,
+# * 'Delay' - clock has period of 'period' and first edge at 'period / 2', as 'add_clock' of 'pysim' does,
+# * 'Settle', 'Passive', 'Active' - ('Passive' and 'Active' have no effect, testbench is the only process).
+#
+# Compiled libraries are cached in 'cache_dir' (default '$MTKCPU_SIM_CACHE', or '~/.cache/mtkcpu'),
+# named after hash of generated source, so that only the first run of given design pays for C++ compilation.
+
+MAX_WIDTH = 120
+
+
+def default_cache_dir():
+    return os.environ.get("MTKCPU_SIM_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mtkcpu"))
+
+
+def find_compiler():
+    for cxx in [os.environ.get("CXX"), "g++", "clang++"]:
+        if cxx and shutil.which(cxx):
+            return cxx
+    return None
+
+
+# 128-bit constant (two's complement), as C++ has no literals of that width.
+def const(value):
+    if -(1 << 63) <= value < (1 << 63):
+        return f"V({value}LL)"
+    value &= (1 << 128) - 1
+    return f"K({value >> 64}ULL, {value & ((1 << 64) - 1)}ULL)"
+
+
+class _Emitter:
+    def __init__(self):
+        self._buffer = []
+        self._suffix = 0
+        self._level = 1
+
+    def append(self, code):
+        self._buffer.append("    " * self._level + code + "\n")
+
+    @contextmanager
+    def indent(self):
+        self._level += 1
+        yield
+        self._level -= 1
+
+    def flush(self):
+        code = "".join(self._buffer)
+        self._buffer.clear()
+        return code
+
+    def gen_var(self, prefix):
+        name = f"{prefix}_{self._suffix}"
+        self._suffix += 1
+        return name
+
+    def def_var(self, prefix, value):
+        name = self.gen_var(prefix)
+        self.append(f"V {name} = {value};")
+        return name
+
+
+# Indexes of all signals of simulated design.
+class _Signals:
+    def __init__(self):
+        self.indexes = SignalDict()
+        self.signals = []
+
+    def __call__(self, signal):
+        try:
+            return self.indexes[signal]
+        except KeyError:
+            if len(signal) > MAX_WIDTH:
+                raise ValueError(f"Signal {signal.name} of width {len(signal)} is too wide (max {MAX_WIDTH})!")
+            index = len(self.signals)
+            self.signals.append(signal)
+            self.indexes[signal] = index
+            return index
+
+
+class _ValueCompiler(ValueVisitor):
+    def __init__(self, signals, emitter):
+        self.signals = signals
+        self.emitter = emitter
+
+    def __call__(self, value):
+        if len(value) > MAX_WIDTH:
+            raise ValueError(f"Value {value!r} of width {len(value)} is too wide (max {MAX_WIDTH})!")
+        return super().__call__(value)
+
+    def on_ClockSignal(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_ResetSignal(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_Record(self, value):
+        return self(Cat(value.fields.values()))
+
+    def on_AnyConst(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_AnySeq(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_Sample(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_Initial(self, value):
+        raise NotImplementedError # :nocov:
+
+
+class _RHSValueCompiler(_ValueCompiler):
+    def __init__(self, signals, emitter, *, mode, inputs=None):
+        super().__init__(signals, emitter)
+        assert mode in ("curr", "next")
+        self.mode = mode
+        # If not None, 'inputs' gets populated with RHS signals.
+        self.inputs = inputs
+
+    def on_Const(self, value):
+        return const(value.value)
+
+    def on_Signal(self, value):
+        if self.inputs is not None:
+            self.inputs.add(value)
+        index = self.signals(value)
+        if self.mode == "curr":
+            return f"st->curr[{index}]"
+        else:
+            return f"next_{index}"
+
+    def on_Operator(self, value):
+        def mask(value):
+            return f"({self(value)} & {const((1 << len(value)) - 1)})"
+
+        def sign(value):
+            if value.shape().signed:
+                return f"sign({mask(value)}, {const(-1 << (len(value) - 1))})"
+            else: # unsigned
+                return mask(value)
+
+        if len(value.operands) == 1:
+            arg, = value.operands
+            if value.operator == "~":
+                return f"(~{self(arg)})"
+            if value.operator == "-":
+                return f"(-{self(arg)})"
+            if value.operator == "b":
+                return f"V({mask(arg)} != 0)"
+            if value.operator == "r|":
+                return f"V({mask(arg)} != 0)"
+            if value.operator == "r&":
+                return f"V({mask(arg)} == {const((1 << len(arg)) - 1)})"
+            if value.operator == "r^":
+                return f"parity({mask(arg)})"
+            if value.operator in ("u", "s"):
+                # These operators don't change the bit pattern, only its interpretation.
+                return self(arg)
+        elif len(value.operands) == 2:
+            lhs, rhs = value.operands
+            if value.operator == "+":
+                return f"({sign(lhs)} + {sign(rhs)})"
+            if value.operator == "-":
+                return f"({sign(lhs)} - {sign(rhs)})"
+            if value.operator == "*":
+                return f"({sign(lhs)} * {sign(rhs)})"
+            if value.operator == "//":
+                return f"zdiv({sign(lhs)}, {sign(rhs)})"
+            if value.operator == "&":
+                return f"({self(lhs)} & {self(rhs)})"
+            if value.operator == "|":
+                return f"({self(lhs)} | {self(rhs)})"
+            if value.operator == "^":
+                return f"({self(lhs)} ^ {self(rhs)})"
+            if value.operator == "<<":
+                return f"shl({sign(lhs)}, {sign(rhs)})"
+            if value.operator == ">>":
+                return f"shr({sign(lhs)}, {sign(rhs)})"
+            for op in ["==", "!=", "<", "<=", ">", ">="]:
+                if value.operator == op:
+                    return f"V({sign(lhs)} {op} {sign(rhs)})"
+        elif len(value.operands) == 3:
+            if value.operator == "m":
+                sel, val1, val0 = value.operands
+                return f"({self(sel)} ? V({self(val1)}) : V({self(val0)}))"
+        raise NotImplementedError("Operator '{}' not implemented".format(value.operator)) # :nocov:
+
+    def on_Slice(self, value):
+        return f"(shr({self(value.value)}, {value.start}) & {const((1 << len(value)) - 1)})"
+
+    def on_Part(self, value):
+        offset_mask = const((1 << len(value.offset)) - 1)
+        offset = f"(({self(value.offset)} & {offset_mask}) * {value.stride})"
+        return f"(shr({self(value.value)}, {offset}) & {const((1 << value.width) - 1)})"
+
+    def on_Cat(self, value):
+        gen_parts = []
+        offset = 0
+        for part in value.parts:
+            part_mask = const((1 << len(part)) - 1)
+            gen_parts.append(f"(({self(part)} & {part_mask}) << {offset})")
+            offset += len(part)
+        if not gen_parts:
+            return const(0)
+        return f"({' | '.join(gen_parts)})"
+
+    def on_Repl(self, value):
+        part_mask = const((1 << len(value.value)) - 1)
+        gen_part = self.emitter.def_var("repl", f"{self(value.value)} & {part_mask}")
+        gen_parts = []
+        offset = 0
+        for _ in range(value.count):
+            gen_parts.append(f"({gen_part} << {offset})")
+            offset += len(value.value)
+        if not gen_parts:
+            return const(0)
+        return f"({' | '.join(gen_parts)})"
+
+    def on_ArrayProxy(self, value):
+        index_mask = const((1 << len(value.index)) - 1)
+        gen_index = self.emitter.def_var("rhs_index", f"{self(value.index)} & {index_mask}")
+        gen_value = self.emitter.gen_var("rhs_proxy")
+        self.emitter.append(f"V {gen_value};")
+        if value.elems:
+            for index, elem in enumerate(value.elems):
+                if index == 0:
+                    self.emitter.append(f"if ({gen_index} == {index}) {{")
+                else:
+                    self.emitter.append(f"}} else if ({gen_index} == {index}) {{")
+                with self.emitter.indent():
+                    self.emitter.append(f"{gen_value} = {self(elem)};")
+            self.emitter.append(f"}} else {{")
+            with self.emitter.indent():
+                self.emitter.append(f"{gen_value} = {self(value.elems[-1])};")
+            self.emitter.append(f"}}")
+            return gen_value
+        else:
+            return const(0)
+
+
+class _LHSValueCompiler(_ValueCompiler):
+    def __init__(self, signals, emitter, *, rhs):
+        super().__init__(signals, emitter)
+        # 'rrhs' is used to translate rvalues that are syntactically a part of an lvalue, e.g.
+        # the offset of a Part.
+        self.rrhs = rhs
+        # 'lrhs' is used to translate the read part of a read-modify-write cycle during partial
+        # update of an lvalue.
+        self.lrhs = _RHSValueCompiler(signals, emitter, mode="next", inputs=None)
+
+    def on_Const(self, value):
+        raise TypeError # :nocov:
+
+    def on_Signal(self, value):
+        def gen(arg):
+            value_mask = const((1 << len(value)) - 1)
+            if value.shape().signed:
+                value_sign = f"sign({arg} & {value_mask}, {const(-1 << (len(value) - 1))})"
+            else: # unsigned
+                value_sign = f"{arg} & {value_mask}"
+            self.emitter.append(f"next_{self.signals(value)} = {value_sign};")
+        return gen
+
+    def on_Operator(self, value):
+        raise TypeError # :nocov:
+
+    def on_Slice(self, value):
+        def gen(arg):
+            width_mask = (1 << (value.stop - value.start)) - 1
+            self(value.value)(f"({self.lrhs(value.value)} & " \
+                f"{const(~(width_mask << value.start))} | " \
+                f"(({arg} & {const(width_mask)}) << {value.start}))")
+        return gen
+
+    def on_Part(self, value):
+        def gen(arg):
+            width_mask = const((1 << value.width) - 1)
+            offset_mask = const((1 << len(value.offset)) - 1)
+            offset = f"(({self.rrhs(value.offset)} & {offset_mask}) * {value.stride})"
+            self(value.value)(f"({self.lrhs(value.value)} & " \
+                f"~shl({width_mask}, {offset}) | " \
+                f"shl({arg} & {width_mask}, {offset}))")
+        return gen
+
+    def on_Cat(self, value):
+        def gen(arg):
+            gen_arg = self.emitter.def_var("cat", arg)
+            offset = 0
+            for part in value.parts:
+                part_mask = const((1 << len(part)) - 1)
+                self(part)(f"(shr({gen_arg}, {offset}) & {part_mask})")
+                offset += len(part)
+        return gen
+
+    def on_Repl(self, value):
+        raise TypeError # :nocov:
+
+    def on_ArrayProxy(self, value):
+        def gen(arg):
+            index_mask = const((1 << len(value.index)) - 1)
+            gen_index = self.emitter.def_var("index", f"{self.rrhs(value.index)} & {index_mask}")
+            if value.elems:
+                for index, elem in enumerate(value.elems):
+                    if index == 0:
+                        self.emitter.append(f"if ({gen_index} == {index}) {{")
+                    else:
+                        self.emitter.append(f"}} else if ({gen_index} == {index}) {{")
+                    with self.emitter.indent():
+                        self(elem)(arg)
+                self.emitter.append(f"}} else {{")
+                with self.emitter.indent():
+                    self(value.elems[-1])(arg)
+                self.emitter.append(f"}}")
+        return gen
+
+
+class _StatementCompiler(StatementVisitor):
+    def __init__(self, signals, emitter, *, inputs=None):
+        self.emitter = emitter
+        self.rhs = _RHSValueCompiler(signals, emitter, mode="curr", inputs=inputs)
+        self.lhs = _LHSValueCompiler(signals, emitter, rhs=self.rhs)
+
+    def on_statements(self, stmts):
+        for stmt in stmts:
+            self(stmt)
+
+    def on_Assign(self, stmt):
+        return self.lhs(stmt.lhs)(self.rhs(stmt.rhs))
+
+    def on_Switch(self, stmt):
+        gen_test = self.emitter.def_var("test",
+            f"{self.rhs(stmt.test)} & {const((1 << len(stmt.test)) - 1)}")
+        for index, (patterns, stmts) in enumerate(stmt.cases.items()):
+            gen_checks = []
+            if not patterns:
+                gen_checks.append(f"true")
+            else:
+                for pattern in patterns:
+                    if "-" in pattern:
+                        mask  = int("".join("0" if b == "-" else "1" for b in pattern), 2)
+                        value = int("".join("0" if b == "-" else  b  for b in pattern), 2)
+                        gen_checks.append(f"({gen_test} & {const(mask)}) == {const(value)}")
+                    else:
+                        value = int(pattern, 2)
+                        gen_checks.append(f"{gen_test} == {const(value)}")
+            if index == 0:
+                self.emitter.append(f"if ({' || '.join(gen_checks)}) {{")
+            else:
+                self.emitter.append(f"}} else if ({' || '.join(gen_checks)}) {{")
+            with self.emitter.indent():
+                self(stmts)
+        if stmt.cases:
+            self.emitter.append(f"}}")
+
+    def on_Assert(self, stmt):
+        raise NotImplementedError # :nocov:
+
+    def on_Assume(self, stmt):
+        raise NotImplementedError # :nocov:
+
+    def on_Cover(self, stmt):
+        raise NotImplementedError # :nocov:
+
+
+_PRELUDE = """\
+#include <cstdint>
+#include <cstring>
+#include <cstdlib>
+
+typedef __int128 V;
+typedef unsigned __int128 U;
+
+static inline V K(uint64_t hi, uint64_t lo) { return V((U(hi) << 64) | U(lo)); }
+static inline V sign(V value, V sign) { return (value & sign) ? (value | sign) : value; }
+static inline V shl(V value, V amount) { return amount >= 127 ? V(0) : V(U(value) << int(amount)); }
+static inline V shr(V value, V amount) { return amount >= 127 ? (value < 0 ? V(-1) : V(0)) : (value >> int(amount)); }
+static inline V zdiv(V lhs, V rhs) {
+    if (rhs == 0) return 0;
+    // floor division, as in Python.
+    V q = lhs / rhs;
+    if ((lhs % rhs != 0) && ((lhs < 0) != (rhs < 0))) q -= 1;
+    return q;
+}
+static inline V parity(V value) {
+    U u = U(value);
+    return V((__builtin_popcountll(uint64_t(u)) + __builtin_popcountll(uint64_t(u >> 64))) % 2);
+}
+
+struct State {
+    V curr[NSIGNALS];
+    V next[NSIGNALS];
+    int pending[NSIGNALS];
+    int npending;
+    char is_pending[NSIGNALS];
+    char runnable[NCOMB + 1];
+};
+
+static inline void set(State* st, int index, V value) {
+    if (st->next[index] == value) return;
+    st->next[index] = value;
+    if (!st->is_pending[index]) {
+        st->is_pending[index] = 1;
+        st->pending[st->npending++] = index;
+    }
+}
+"""
+
+_EPILOGUE = """
+// wakes up combinatorial functions, that depend on changed signals, returns whether any got woken up.
+static bool commit(State* st) {
+    bool awoken = false;
+    for (int i = 0; i < st->npending; i++) {
+        int index = st->pending[i];
+        st->is_pending[index] = 0;
+        if (st->curr[index] == st->next[index]) continue;
+        st->curr[index] = st->next[index];
+        for (int j = waiters_start[index]; j < waiters_start[index + 1]; j++) {
+            st->runnable[waiters[j]] = 1;
+            awoken = true;
+        }
+    }
+    st->npending = 0;
+    return awoken;
+}
+
+static void settle(State* st) {
+    for (;;) {
+        for (int i = 0; i < NCOMB; i++) {
+            if (st->runnable[i]) {
+                st->runnable[i] = 0;
+                comb_funcs[i](st);
+            }
+        }
+        if (!commit(st)) break;
+    }
+}
+
+extern "C" {
+
+int sim_nsignals() { return NSIGNALS; }
+
+void sim_reset(State* st) {
+    for (int i = 0; i < NSIGNALS; i++) {
+        st->curr[i] = st->next[i] = resets[i];
+        st->is_pending[i] = 0;
+    }
+    st->npending = 0;
+    for (int i = 0; i < NCOMB; i++) st->runnable[i] = 1;
+}
+
+State* sim_create() {
+    State* st = (State*)malloc(sizeof(State));
+    sim_reset(st);
+    return st;
+}
+
+void sim_destroy(State* st) { free(st); }
+
+void sim_settle(State* st) {
+    commit(st);
+    settle(st);
+}
+
+// 'cycles' rising edges of the clock.
+void sim_step(State* st, int64_t cycles) {
+    sim_settle(st);
+    for (int64_t c = 0; c < cycles; c++) {
+        // clock is high for a while after the edge (e.g. transparent memory read ports depend on that).
+        if (CLK >= 0) set(st, CLK, 1);
+        for (int i = 0; i < NSYNC; i++) sync_funcs[i](st);
+        commit(st);
+        settle(st);
+        if (CLK >= 0) {
+            set(st, CLK, 0);
+            commit(st);
+            settle(st);
+        }
+    }
+}
+
+void sim_write(State* st, int index, uint64_t hi, uint64_t lo) { set(st, index, K(hi, lo)); }
+
+void sim_read(State* st, int index, uint64_t* out) {
+    U u = U(st->curr[index]);
+    out[0] = uint64_t(u >> 64);
+    out[1] = uint64_t(u);
+}
+
+}
+"""
+
+
+# Generates C++ source of simulation of 'fragment', returns (source, signals).
+def generate(fragment):
+    fragment = Fragment.get(fragment, platform=None).prepare()
+    signals = _Signals()
+    comb_funcs = []
+    sync_funcs = []
+    waiters = {}
+    domains = set()
+    clk = []
+    code = []
+
+    def compile_fragment(fragment):
+        for domain_name, domain_signals in fragment.drivers.items():
+            domain_stmts = LHSGroupFilter(domain_signals)(fragment.statements)
+            emitter = _Emitter()
+            func = f"f{len(comb_funcs) + len(sync_funcs)}"
+
+            if domain_name is None:
+                for signal in domain_signals:
+                    emitter.append(f"V next_{signals(signal)} = {const(signal.reset)};")
+                inputs = SignalSet()
+                _StatementCompiler(signals, emitter, inputs=inputs)(domain_stmts)
+                for input in inputs:
+                    waiters.setdefault(signals(input), []).append(len(comb_funcs))
+                comb_funcs.append(func)
+            else:
+                domain = fragment.domains[domain_name]
+                if domain.clk_edge != "pos" or domain.async_reset:
+                    raise NotImplementedError(f"Domain {domain_name} must be clocked on rising edge, "
+                        "with synchronous reset!")
+                domains.add(domain)
+                clk.append(signals(domain.clk))
+                for signal in domain_signals:
+                    index = signals(signal)
+                    emitter.append(f"V next_{index} = st->next[{index}];")
+                _StatementCompiler(signals, emitter)(domain_stmts)
+                sync_funcs.append(func)
+
+            for signal in domain_signals:
+                index = signals(signal)
+                emitter.append(f"set(st, {index}, next_{index});")
+            code.append(f"static void {func}(State* st) {{\n{emitter.flush()}}}\n")
+
+        for subfragment, _ in fragment.subfragments:
+            compile_fragment(subfragment)
+
+    compile_fragment(fragment)
+    if len(domains) > 1:
+        raise NotImplementedError(f"Design has {len(domains)} clock domains, only one is supported!")
+
+    nsignals = len(signals.signals)
+    waiters_start = [0]
+    waiters_list = []
+    for index in range(nsignals):
+        waiters_list += waiters.get(index, [])
+        waiters_start.append(len(waiters_list))
+
+    def array(ctype, name, elems):
+        elems = list(elems) or ["0"]
+        return f"static const {ctype} {name}[] = {{ {', '.join(elems)} }};\n"
+
+    source = "".join([
+        f"#define NSIGNALS {max(nsignals, 1)}\n",
+        f"#define NCOMB {len(comb_funcs)}\n",
+        f"#define NSYNC {len(sync_funcs)}\n",
+        f"#define CLK {clk[0] if clk else -1}\n",
+        _PRELUDE,
+        "\n",
+        *code,
+        "\n",
+        "typedef void (*func_t)(State*);\n",
+        array("func_t", "comb_funcs", comb_funcs),
+        array("func_t", "sync_funcs", sync_funcs),
+        array("V", "resets", (const(s.reset) for s in signals.signals)),
+        array("int", "waiters_start", map(str, waiters_start)),
+        array("int", "waiters", map(str, waiters_list)),
+        _EPILOGUE,
+    ])
+    return source, signals
+
+
+CXXFLAGS = ["-std=c++17", "-O1", "-fwrapv", "-shared", "-fPIC"]
+
+
+# Compiles 'source' (unless it's already cached), returns path of shared library.
+def compile_source(source, cache_dir=None):
+    cache_dir = cache_dir or default_cache_dir()
+    digest = hashlib.sha256(" ".join(CXXFLAGS + [source]).encode()).hexdigest()[:32]
+    lib_path = os.path.join(cache_dir, f"sim_{digest}.so")
+    if os.path.exists(lib_path):
+        return lib_path
+
+    cxx = find_compiler()
+    if cxx is None:
+        raise ValueError("Error! Cannot find C++ compiler (set 'CXX' or put g++ or clang++ in your PATH)!")
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as tmp_dir:
+        src_path = os.path.join(tmp_dir, "sim.cpp")
+        tmp_lib_path = os.path.join(tmp_dir, "sim.so")
+        with open(src_path, "w") as f:
+            f.write(source)
+        p = subprocess.run([cxx, *CXXFLAGS, src_path, "-o", tmp_lib_path], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        if p.returncode != 0:
+            raise ValueError(f"C++ compilation of simulation failed:\n{p.stdout.decode()}")
+        # atomic, so that concurrent runs (e.g. pytest-xdist workers) don't see partially written library.
+        os.replace(tmp_lib_path, lib_path)
+    return lib_path
+
+
+class CxxSimulator:
+    def __init__(self, fragment, period=1e-6, cache_dir=None):
+        source, self.signals = generate(fragment)
+        lib = self.lib = ctypes.CDLL(compile_source(source, cache_dir))
+        lib.sim_create.restype = ctypes.c_void_p
+        for name in ["sim_reset", "sim_destroy", "sim_settle"]:
+            getattr(lib, name).argtypes = [ctypes.c_void_p]
+        lib.sim_step.argtypes = [ctypes.c_void_p, ctypes.c_int64]
+        lib.sim_write.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_uint64, ctypes.c_uint64]
+        lib.sim_read.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_uint64)]
+        self.state = lib.sim_create()
+        self.period = period
+        self.time = 0.0
+        # signals, that aren't part of design - written and read by testbench only.
+        self.unused = SignalDict()
+        self._out = (ctypes.c_uint64 * 2)()
+
+    def __del__(self):
+        if getattr(self, "state", None) is not None:
+            self.lib.sim_destroy(self.state)
+
+    def reset(self):
+        self.lib.sim_reset(self.state)
+        self.time = 0.0
+        self.unused = SignalDict()
+
+    def read(self, value):
+        value = Value.cast(value)
+        if isinstance(value, Const):
+            return value.value
+        if isinstance(value, Signal):
+            if value not in self.signals.indexes:
+                return self.unused.get(value, Const.normalize(value.reset, value.shape()))
+            self.lib.sim_read(self.state, self.signals.indexes[value], self._out)
+            raw = (self._out[0] << 64) | self._out[1]
+            return Const.normalize(raw, value.shape())
+        if isinstance(value, Slice):
+            return (self.read(value.value) >> value.start) & ((1 << len(value)) - 1)
+        if isinstance(value, Cat):
+            res, offset = 0, 0
+            for part in value.parts:
+                res |= (self.read(part) & ((1 << len(part)) - 1)) << offset
+                offset += len(part)
+            return res
+        if hasattr(value, "fields"): # Record
+            return self.read(Cat(value.fields.values()))
+        raise NotImplementedError(f"Reading {value!r} is not supported!")
+
+    def write(self, signal, value):
+        if not isinstance(signal, Signal):
+            raise NotImplementedError(f"Writing {signal!r} is not supported, only signals can be written!")
+        value = Const.normalize(value, signal.shape())
+        if signal not in self.signals.indexes:
+            self.unused[signal] = value
+            return
+        value &= (1 << 128) - 1
+        self.lib.sim_write(self.state, self.signals.indexes[signal], value >> 64, value & ((1 << 64) - 1))
+
+    # advances time by 'delay' seconds, clock edges are at (i + 1/2) * 'period'.
+    def advance(self, delay):
+        edges = lambda t: int(t / self.period + 0.5 + 1e-9)
+        target = self.time + delay
+        self.lib.sim_step(self.state, edges(target) - edges(self.time))
+        self.time = target
+
+    # Resets simulation, and runs 'process' (generator function, see top of file) until it returns.
+    def run(self, process):
+        self.reset()
+        self.lib.sim_settle(self.state)
+        coroutine = process()
+        response = None
+        while True:
+            try:
+                command = coroutine.send(response)
+            except StopIteration:
+                return
+            response = None
+            if isinstance(command, Value):
+                response = self.read(command)
+            elif isinstance(command, Assign):
+                self.write(command.lhs, self.read(command.rhs))
+            elif isinstance(command, Delay):
+                self.advance(command.interval or 0)
+            elif isinstance(command, Settle):
+                self.lib.sim_settle(self.state)
+            elif isinstance(command, (Passive, Active)):
+                pass
+            else:
+                raise NotImplementedError(f"Command {command!r} is not supported!")
@@ -1,19 +1,20 @@
 from enum import Enum
 
 class Funct3(Enum):
-    ADD = SUB = ADDI = B = JALR = BEQ = 0b000
-    SLL = SLLI = H = BNE = 0b001
-    SLTU = 0b011
-    SLT = SLTI = W = 0b010
-    XOR = BU = BLT = 0b100
-    SRL = SRLI = HU = BGE = 0b101
+    ADD = SUB = ADDI = B = JALR = BEQ = FENCE = MUL = 0b000
+    SLL = SLLI = H = BNE = FENCE_I = MULH = CSRRW = 0b001
+    SLTU = MULHU = CSRRC = 0b011
+    SLT = SLTI = W = MULHSU = CSRRS = 0b010
+    XOR = BU = BLT = DIV = 0b100
+    SRL = SRLI = HU = BGE = DIVU = CSRRWI = 0b101
     SRA = SRAI  = 0b101
-    OR = BLTU = 0b110
-    AND = BGEU = 0b111
+    OR = BLTU = REM = CSRRSI = 0b110
+    AND = BGEU = REMU = CSRRCI = 0b111
 
 class Funct7(Enum):
     ADD = SRL = SLL = SRLI = SLLI = 0b0000000
     SUB = SRA = SRAI = 0b0100000
+    MULDIV = 0b0000001
 
 
 class InstrType(Enum):
@@ -26,6 +27,8 @@ class InstrType(Enum):
     ALU     = 0b0110011
     LOAD    = 0b0000011
     STORE   = 0b0100011
+    MISC_MEM = 0b0001111
+    SYSTEM  = 0b1110011
 
 class InstrFormat(Enum):
     R = 0 # addw t0, t1, t2
@@ -33,3 +36,23 @@ class InstrFormat(Enum):
     S = 2 # sw t1, 8(t2)  # no destination register
     B = 3 # beq t1, t2, End # no destination register
     U = 4 # upper immediate - LUI, AUIPC  # Label: AUIPC x10, 0 # Puts address of label in x10 /* only imm20 and rd */
+    J = 5 # jal x1, Label
+
+# Zicntr/Zihpm counter CSRs ('k' in 3..31 for 'HPMCOUNTER<k>' etc., see 'CsrUnit').
+class CSRIndex(Enum):
+    MCOUNTINHIBIT   = 0x320
+    MHPMEVENT3      = 0x323
+    MCYCLE          = 0xB00
+    MINSTRET        = 0xB02
+    MHPMCOUNTER3    = 0xB03
+    MCYCLEH         = 0xB80
+    MINSTRETH       = 0xB82
+    MHPMCOUNTER3H   = 0xB83
+    CYCLE           = 0xC00
+    TIME            = 0xC01
+    INSTRET         = 0xC02
+    HPMCOUNTER3     = 0xC03
+    CYCLEH          = 0xC80
+    TIMEH           = 0xC81
+    INSTRETH        = 0xC82
+    HPMCOUNTER3H    = 0xC83
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import re
+import shutil
+import subprocess
+import tempfile
+
+from argparse import ArgumentParser
+from nmigen import Fragment, Record
+from nmigen.back import rtlil
+
+from cpu import MtkCpu
+from units.decoder import InstructionDecoder
+
+
+# Synthesizes design with yosys into 4-input LUTs, and reports LUT count, flip-flop count and logic depth
+# (longest path between flip-flops, in LUT levels). Memories (register file, caches, branch predictor tables)
+# are mapped to flip-flops as well, as there is no block RAM in generic LUT flow.
+parser = ArgumentParser()
+parser.add_argument('--decoder', action='store_const', const=True, default=False, required=False, help="Synthesize instruction decoder alone, instead of whole CPU.")
+parser.add_argument('--pipelined', action='store_const', const=True, default=False, required=False, help="Use 5-stage pipelined core.")
+parser.add_argument('--table', action='store_const', const=True, default=False, required=False, help="Synthesize each CPU configuration from 'CONFIGS', print table.")
+parser.add_argument('--yosys', metavar='<path>', type=str, default="yosys", required=False, help="yosys executable.")
+
+# CPU configurations for '--table' - area and logic depth cost of each feature. Keep in sync with table in README.md.
+CONFIGS = {
+    "multi_cycle":          {},
+    "pipelined":            dict(pipelined=True),
+    "no_forwarding":        dict(pipelined=True, forwarding=False),
+    "prefetch":             dict(prefetch_depth=4),
+    "prefetch, fusion":     dict(prefetch_depth=4, fusion=True),
+    "prefetch, bimodal":    dict(prefetch_depth=4, branch_predictor="bimodal"),
+    "prefetch, gshare":     dict(prefetch_depth=4, branch_predictor="gshare"),
+    "pipelined, bimodal":   dict(pipelined=True, branch_predictor="bimodal"),
+    "pipelined, gshare":    dict(pipelined=True, branch_predictor="gshare"),
+    "icache":               dict(with_icache=True),
+    "dcache":               dict(with_dcache=True),
+    "icache, dcache":       dict(with_icache=True, with_dcache=True),
+}
+
+
+def record_signals(rec):
+    for field in rec.fields.values():
+        if isinstance(field, Record):
+            yield from record_signals(field)
+        else:
+            yield field
+
+
+def cpu_ports(cpu_kwargs):
+    dut = MtkCpu(**cpu_kwargs)
+    fragment = Fragment.get(dut, platform=None)
+    # buses are known only after elaboration.
+    ports = [dut.err]
+    for bus in dut.buses.values():
+        ports += record_signals(bus)
+    return fragment, ports
+
+
+def design_ports(args):
+    if args.decoder:
+        dut = InstructionDecoder()
+        fragment = Fragment.get(dut, platform=None)
+        return fragment, [dut.instr, dut.en, dut.clear, *record_signals(dut.ctrl)]
+    return cpu_ports(dict(pipelined=args.pipelined))
+
+
+# Works around RTLIL, that nMigen emits, but yosys reads differently:
+# * unnamed signals get private names ('$1', '$2', ...), but yosys takes private port names of this form
+#   as positional ones ('$1' is the first port), so that submodule ports get connected to wrong signals,
+# * zero-width submodule ports are connected as '{ } { }', which yosys can't parse.
+def fix_rtlil(il):
+    il = re.sub(r'"\$(\d+)"', r'"\\\\$\1"', il) # memory ids in cell parameters.
+    il = re.sub(r'(?<![\w\\$"])\$(\d+)\b', r'\\$\1', il)
+    return re.sub(r"^\s*connect \{ \} \{ \}\n", "", il, flags=re.MULTILINE)
+
+
+# 'stat' prints '<cell type> <count>' in older yosys, and '<count> <cell type>' in newer one.
+def cell_count(stat, cell_type):
+    counts = re.findall(rf"^\s*(\d+)\s+\$_?{cell_type}\s*$", stat, re.MULTILINE)
+    counts += re.findall(rf"^\s*\$_?{cell_type}\s+(\d+)\s*$", stat, re.MULTILINE)
+    return sum(map(int, counts))
+
+
+def synth_report(fragment, ports, yosys="yosys"):
+    if shutil.which(yosys) is None:
+        raise RuntimeError(f"'{yosys}' not found, install yosys to get synthesis report.")
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(f"{tmp}/top.il", "w") as f:
+            f.write(fix_rtlil(rtlil.convert(fragment, ports=ports)))
+        # paths relative to 'tmp', as sandboxed builds (e.g. 'yowasp-yosys') see only working directory.
+        out = subprocess.run(
+            [yosys, "-q", "-p", "read_rtlil top.il; synth -top top -flatten -lut 4; tee -o stat.txt stat; tee -o ltp.txt ltp -noff"],
+            capture_output=True, text=True, cwd=tmp,
+        )
+        if out.returncode != 0:
+            raise RuntimeError(f"Synthesis failed:\n{out.stdout}{out.stderr}")
+        stat = open(f"{tmp}/stat.txt").read()
+        ltp = open(f"{tmp}/ltp.txt").read()
+    depth = re.search(r"length=(\d+)", ltp)
+    return {
+        "luts": cell_count(stat, "lut"),
+        "ffs": cell_count(stat, r"\w*DFF\w*"),
+        "depth": int(depth.group(1)) if depth else 0,
+    }
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.table:
+        print(f"{'config':24}{'LUTs':>8}{'FFs':>8}{'depth':>8}")
+        for name, cpu_kwargs in CONFIGS.items():
+            report = synth_report(*cpu_ports(cpu_kwargs), yosys=args.yosys)
+            print(f"{name:24}{report['luts']:>8}{report['ffs']:>8}{report['depth']:>8}")
+    else:
+        fragment, ports = design_ports(args)
+        report = synth_report(fragment, ports, yosys=args.yosys)
+        print(f"LUTs: {report['luts']}, FFs: {report['ffs']}, logic depth: {report['depth']}")
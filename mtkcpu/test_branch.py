@@ -0,0 +1,98 @@
+import pytest
+import random
+
+from nmigen.back.pysim import Simulator, Settle
+from isa import Funct3
+from units.branch import BranchUnit
+
+
+MASK = 0xffff_ffff
+
+def signed(x):
+    return x - (1 << 32) if x >> 31 else x
+
+def condition_ref(funct3, a, b):
+    return {
+        Funct3.BEQ:     a == b,
+        Funct3.BNE:     a != b,
+        Funct3.BLT:     signed(a) < signed(b),
+        Funct3.BGE:     signed(a) >= signed(b),
+        Funct3.BLTU:    a < b,
+        Funct3.BGEU:    a >= b,
+    }[funct3]
+
+
+def test_branch_condition():
+    dut = BranchUnit()
+    sim = Simulator(dut)
+
+    corner = [0, 1, MASK, 0x8000_0000, 0x7fff_ffff]
+    rng = random.Random(0)
+    funct3s = [Funct3.BEQ, Funct3.BNE, Funct3.BLT, Funct3.BGE, Funct3.BLTU, Funct3.BGEU]
+    cases = [(f, a, b) for f in funct3s for a in corner for b in corner]
+    cases += [(rng.choice(funct3s), rng.getrandbits(32), rng.getrandbits(32)) for _ in range(100)]
+
+    def MAIN():
+        yield dut.branch.eq(1)
+        yield dut.pc.eq(0x1000)
+        yield dut.imm.eq(-8 & MASK)
+        for funct3, a, b in cases:
+            yield dut.funct3.eq(funct3)
+            yield dut.src1.eq(a)
+            yield dut.src2.eq(b)
+            yield Settle()
+            taken = condition_ref(funct3, a, b)
+            assert (yield dut.taken) == taken, (funct3, hex(a), hex(b))
+            assert (yield dut.next_pc) == (0xff8 if taken else 0x1004)
+
+    sim.add_process(MAIN)
+    sim.run()
+
+
+# unit, src1, pc, imm, next pc.
+@pytest.mark.parametrize("unit, src1, pc, imm, next_pc", [
+    ("jal",     0,          0x1000,     0x10,           0x1010),
+    ("jal",     0,          0x1000,     -0x1000 & MASK, 0x0),
+    ("jalr",    0x2001,     0x1000,     0x4,            0x2004),
+    ("jalr",    0x2000,     0x1000,     -0x3 & MASK,    0x1ffc),
+    ("branch",  0,          0x1000,     0x10,           0x1004), # not taken (bne x, x)
+])
+def test_jump_target(unit, src1, pc, imm, next_pc):
+    dut = BranchUnit()
+    sim = Simulator(dut)
+
+    def MAIN():
+        yield getattr(dut, unit).eq(1)
+        yield dut.funct3.eq(Funct3.BNE)
+        yield dut.src1.eq(src1)
+        yield dut.src2.eq(src1)
+        yield dut.pc.eq(pc)
+        yield dut.imm.eq(imm)
+        yield Settle()
+        assert (yield dut.next_pc) == next_pc
+
+    sim.add_process(MAIN)
+    sim.run()
+
+
+# compressed instruction falls through (and links) to 'pc + 2'.
+@pytest.mark.parametrize("unit, next_pc", [
+    ("jal",     0x1010),
+    ("branch",  0x1002),
+])
+def test_compressed_fall_through(unit, next_pc):
+    dut = BranchUnit()
+    sim = Simulator(dut)
+
+    def MAIN():
+        yield getattr(dut, unit).eq(1)
+        yield dut.compressed.eq(1)
+        yield dut.funct3.eq(Funct3.BNE)
+        yield dut.pc.eq(0x1000)
+        yield dut.imm.eq(0x10)
+        yield Settle()
+        assert (yield dut.next_pc) == next_pc
+        assert (yield dut.fall_through) == 0x1002
+
+    sim.add_process(MAIN)
+    sim.run()
@@ -1,270 +1,376 @@
 #!/usr/bin/env python3
 
+import os
+import math
+import shutil
+import tempfile
+import subprocess
 from itertools import count
 from io import StringIO
 from argparse import ArgumentParser
 
+import pytest
+
 from asm_dump import dump_asm
 from cpu import START_ADDR
 
-from cpu import MtkCpu
+from testbench import SimHarness, BACKENDS
+from waveform import WaveformCapture
+from units.crossbar import HARVARD_MAP
 from tests.reg_tests import REG_TESTS
 from tests.mem_tests import MEM_TESTS
 from tests.compare_tests import CMP_TESTS
 from tests.upper_tests import UPPER_TESTS
 from tests.branch_tests import BRANCH_TESTS
+from tests.muldiv_tests import MULDIV_TESTS
+from tests.csr_tests import CSR_TESTS
+from tests.rvc_tests import RVC_TESTS
 from tests.playground import PLAYGROUND_TESTS
 
 
-parser = ArgumentParser(description="mtkCPU testing script.")
-parser.add_argument('--reg', action='store_const', const=REG_TESTS, default=[], required=False)
-parser.add_argument('--mem', action='store_const', const=MEM_TESTS, default=[], required=False)
-parser.add_argument('--cmp', action='store_const', const=CMP_TESTS, default=[], required=False)
-parser.add_argument('--upper', action='store_const', const=UPPER_TESTS, default=[], required=False)
-parser.add_argument('--branch', action='store_const', const=BRANCH_TESTS, default=[], required=False)
-parser.add_argument('--playground', action='store_const', const=PLAYGROUND_TESTS, default=[], required=False)
-parser.add_argument('--verbose', action='store_const', const=True, default=False, required=False)
-
-parser.add_argument('--elf', metavar='<ELF file path.>', type=str, required=False, help="Simulate given ELF binary.")
-
-args = parser.parse_args()
-
-ELF = args.elf
-VERBOSE = args.verbose
-
-ALL_TESTS = REG_TESTS + MEM_TESTS + CMP_TESTS + UPPER_TESTS + PLAYGROUND_TESTS
-
-SELECTED_TESTS = args.mem + args.reg + args.cmp + args.upper + args.branch + args.playground
-if SELECTED_TESTS == []:
-    SELECTED_TESTS = ALL_TESTS
-
+# paths don't depend on working directory (e.g. of pytest-xdist worker).
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPILER = "riscv-none-embed-gcc"
+LINKER_SCRIPT = os.path.join(TEST_DIR, "..", "elf", "linker.ld")
+
+
+def parse_args():
+    parser = ArgumentParser(description="mtkCPU testing script.")
+    parser.add_argument('--reg', action='store_const', const=REG_TESTS, default=[], required=False)
+    parser.add_argument('--mem', action='store_const', const=MEM_TESTS, default=[], required=False)
+    parser.add_argument('--cmp', action='store_const', const=CMP_TESTS, default=[], required=False)
+    parser.add_argument('--upper', action='store_const', const=UPPER_TESTS, default=[], required=False)
+    parser.add_argument('--branch', action='store_const', const=BRANCH_TESTS, default=[], required=False)
+    parser.add_argument('--muldiv', action='store_const', const=MULDIV_TESTS, default=[], required=False, help="RV32M tests, CPU is built with multiply/divide unit.")
+    parser.add_argument('--csr', action='store_const', const=CSR_TESTS, default=[], required=False)
+    parser.add_argument('--rvc', action='store_const', const=RVC_TESTS, default=[], required=False, help="RV32C tests, CPU is built with compressed instructions support (multi-cycle core without prefetch queue only).")
+    parser.add_argument('--playground', action='store_const', const=PLAYGROUND_TESTS, default=[], required=False)
+    parser.add_argument('--verbose', action='store_const', const=True, default=False, required=False)
+    parser.add_argument('--pipelined', action='store_const', const=True, default=False, required=False, help="Use 5-stage pipelined core.")
+    parser.add_argument('--no-forwarding', action='store_const', const=True, default=False, required=False, help="Disable EX/MEM operand forwarding in pipelined core.")
+    parser.add_argument('--icache', action='store_const', const=True, default=False, required=False, help="Fetch instructions through instruction cache.")
+    parser.add_argument('--dcache', action='store_const', const=True, default=False, required=False, help="Access data through write-back data cache.")
+    parser.add_argument('--prefetch', metavar='<depth>', type=int, default=0, required=False, help="Fetch instructions ahead into queue of given depth (multi-cycle core only).")
+    parser.add_argument('--fusion', action='store_const', const=True, default=False, required=False, help="Fuse 'lui'+'addi', 'auipc'+'jalr' and 'auipc'+'lw' pairs (requires --prefetch 2 or deeper).")
+    parser.add_argument('--bp', choices=["bimodal", "gshare"], default=None, required=False, help="Use branch predictor (requires --pipelined or --prefetch).")
+    parser.add_argument('--arbiter', choices=["priority", "round_robin", "weighted"], default="priority", required=False, help="Memory arbitration scheme.")
+    parser.add_argument('--crossbar', action='store_const', const=True, default=False, required=False, help="Connect code, data and MMIO as separate slaves through crossbar (see HARVARD_MAP).")
+    parser.add_argument('--tcm', metavar='<size>', type=lambda x: int(x, 0), default=0, required=False, help="Place code in tightly-coupled memory of given size (in bytes) at START_ADDR.")
+    parser.add_argument('--store-buffer', metavar='<depth>', type=int, default=0, required=False, help="Retire stores into store buffer of given depth.")
+    parser.add_argument('--pending-loads', metavar='<n>', type=int, default=0, required=False, help="Retire loads as soon as they are issued, with up to <n> of them in flight (multi-cycle core only).")
+    parser.add_argument('--multiplier', choices=["single_cycle", "two_cycle"], default="single_cycle", required=False, help="Multiplier implementation (with --muldiv).")
+    parser.add_argument('--divider-radix', choices=[2, 4], type=int, default=2, required=False, help="Divider radix (with --muldiv).")
+    parser.add_argument('--shifter', choices=["barrel", "pipelined", "iterative"], default="barrel", required=False, help="Shifter implementation.")
+    parser.add_argument('--shifter-bits-per-cycle', choices=[1, 4], type=int, default=1, required=False, help="Bits shifted per cycle by iterative shifter.")
+    parser.add_argument('--mem-timing', metavar='<bus>:<p>:<p_stall>', action='append', default=[], required=False, help="Probabilities of completing request and of stalling, per memory bus (default .4 and .2).")
+    parser.add_argument('--mem-latency', metavar='<bus>:<cycles>', action='append', default=[], required=False, help="Fixed latency of memory bus, instead of random one.")
+    parser.add_argument('--backend', choices=list(BACKENDS), default="pysim", required=False, help="Simulation backend ('cxx' compiles design to C++, needs g++ or clang++).")
+    parser.add_argument('--vcd', metavar='<file>', type=str, default=None, required=False, help="Capture waveform of each test into given VCD file (off by default, overwritten by each test).")
+    parser.add_argument('--vcd-signals', metavar='<pattern>', action='append', default=None, required=False, help="Capture only signals, which hierarchical name (or it's trailing part) starts with given pattern, e.g. 'arbiter.bus' or 'fsm_state' (default: all).")
+    parser.add_argument('--vcd-cycles', metavar='<start>:<stop>', type=str, default=None, required=False, help="Capture only given range of cycles.")
+    parser.add_argument('--vcd-start-pc', metavar='<addr>', type=lambda x: int(x, 0), default=None, required=False, help="Start capture when CPU executes instruction at given address.")
+    parser.add_argument('--vcd-stop-pc', metavar='<addr>', type=lambda x: int(x, 0), default=None, required=False, help="Stop capture after CPU executes instruction at given address.")
+    parser.add_argument('--vcd-last', metavar='<n>', type=int, default=None, required=False, help="Keep only the last <n> captured cycles (ring buffer).")
+    parser.add_argument('--vcd-on-failure', action='store_const', const=True, default=False, required=False, help="Write VCD file only when test fails.")
+
+    parser.add_argument('--elf', metavar='<ELF file path.>', type=str, required=False, help="Simulate given ELF binary.")
+
+    return parser.parse_args()
 
 
 # returns memory (all PT_LOAD type segments) as dictionary.
 def read_elf(elf_path, verbose=False):
-    from elftools.elf.elffile import ELFFile
-    handle = open(elf_path, 'rb')
-    elf = ELFFile(handle)
-    
-    import subprocess
     p = subprocess.Popen(["riscv-none-embed-objdump", "--disassembler-options=no-aliases",  "-M",  "numeric", "-d", elf_path], stdout=subprocess.PIPE)
     out, _ = p.communicate()
 
     out = str(out.decode("ascii"))
     if verbose:
         print(out)
-    
-    from asm_dump import bytes_to_u32_arr, dump_instrs
-    
-    # for each segment that is being loaded into memory
-    # retrieve it's data and put in 'mem' dict (both code and program data). 
-    mem = {}
-    for s in elf.iter_segments():
-        file_offset, data_len = s.header.p_offset, s.header.p_memsz
-        load_addr = s.header.p_vaddr
-        handle.seek(file_offset)
-        raw = handle.read(data_len)
-        data = bytes_to_u32_arr(raw)
-        dump_instrs(data) # for debug purposes
-        segment_mem = dict(zip(count(load_addr, 4), data))
-        mem.update(segment_mem)
+
+    from asm_dump import dump_instrs
+    from units.tcm import read_elf_segments
+
+    mem = read_elf_segments(elf_path)
+    dump_instrs(list(mem.values())) # for debug purposes
     return mem
 
 
-# checks performed: 
+# checks performed:
 # * if 'expected_val' is not None: check if x<'reg_num'> == 'expected_val',
 # * if 'expected_mem' is not None: check if for all k, v in 'expected_mem.items()' mem[k] == v.
-def reg_test(name, timeout_cycles, reg_num, expected_val, expected_mem, reg_init, mem_dict, verbose=False):
-    
-    from nmigen.back.pysim import Simulator, Active, Passive, Tick, Settle
+# raises AssertionError if any of them fails, returns dict of CPU performance counters values, sampled at the end of simulation.
+# 'mem_timing' maps bus name to 'MemorySlave' timing parameters ('p' and 'p_stall', or fixed 'latency'),
+# 'capture' ('WaveformCapture' or None) gets written after checks (only if any of them fails, with 'on_failure' set).
+# Design is elaborated once per ('cpu_kwargs', 'mem_timing', 'backend') and reused by following tests (see 'SimHarness').
+def reg_test(name, timeout_cycles, reg_num, expected_val, expected_mem, reg_init, mem_dict, verbose=False, cpu_kwargs={}, mem_timing={}, backend="pysim", capture=None):
 
     LOG = lambda x : print(x) if verbose else True
 
-    cpu = MtkCpu(reg_init=reg_init)
-    sim = Simulator(cpu)
-    sim.add_clock(1e-6)
-
     assert((reg_num is None and expected_val is None) or (reg_num is not None and expected_val is not None))
+
+    key = repr((cpu_kwargs, mem_timing, backend))
+    if key not in HARNESSES:
+        HARNESSES[key] = SimHarness(cpu_kwargs, mem_timing, backend=backend)
+    timeout = 25 + timeout_cycles * timeout_scale(cpu_kwargs, mem_timing)
+    res = HARNESSES[key].run(mem_dict, reg_init=reg_init, watch_reg=reg_num, timeout=timeout, capture=capture)
+
+    try:
+        check_result(res, name, reg_num, expected_val, expected_mem)
+    except AssertionError:
+        if capture is not None:
+            capture.write()
+        raise
+    if capture is not None and not capture.on_failure:
+        capture.write()
+
+    LOG(f">>> counters: {res.counters}")
+    return res.counters
+
+HARNESSES = {}
+
+
+# Timeouts of tests tables are the ones of default cores - optional features, that make instructions take
+# more cycles (e.g. cache line refills on cold start), scale them by factor of each feature enabled.
+TIMEOUT_SCALE = {
+    "with_icache": 2,
+    "with_dcache": 2,
+}
+
+# returns factor, which 'timeout_cycles' of 'reg_test' are multiplied by, for given CPU and memory configuration.
+# Memory slower than default timing of 'MemorySlave' (in average) scales timeouts as well.
+def timeout_scale(cpu_kwargs, mem_timing):
+    scale = 1
+    for feature, factor in TIMEOUT_SCALE.items():
+        if cpu_kwargs.get(feature):
+            scale *= factor
+    default_latency = 1 / .4
+    latency = max((t.get("latency", 1 / t.get("p", .4)) for t in mem_timing.values()), default=default_latency)
+    return scale * max(1, math.ceil(latency / default_latency))
+
+
+# raises AssertionError, if 'res' ('RunResult') doesn't meet expectations (see 'reg_test').
+def check_result(res, name, reg_num, expected_val, expected_mem):
     check_reg = reg_num is not None
     check_mem = expected_mem is not None
 
-    def TEST_MEM():
-        yield Passive()
-        # yield Tick()
-        # yield Settle()
-        p = .4 # .5 # probability of mem access in current cycle
-        from enum import Enum
-        class MemState(Enum):
-            FREE = 0
-            BUSY_READ = 1
-            BUSY_WRITE = 2
-
-        # TODO legacy - not used for now.
-        # cursed - if we use state == MemState.FREE instead of list, 'timeout_range' generator wouldn't work.
-        # param need to be passed by reference not by value, for actual binding to be visible in each loop iter.
-        state = [MemState.FREE]
-
-        arbiter = cpu.arbiter
-
-        while(True): # that's ok, I'm passive.
-            import numpy.random as random
-
-            rdy = random.choice((0, 1), p=[1-p, p])
-
-            ctr = yield cpu.DEBUG_CTR
-
-            if state[0] == MemState.FREE:
-                ack = yield arbiter.bus.ack
-                if ack:
-                    yield arbiter.bus.ack.eq(0)
-                    # print(f"DEBUG_CTR: {ctr}, state: {state[0]}")
-                    yield
-                    continue
-                cyc = yield arbiter.bus.cyc
-                we  = yield arbiter.bus.we
-                write = cyc and     we 
-                read  = cyc and not we
-                mem_addr = yield arbiter.bus.adr
-                if read and write:
-                    raise ValueError("ERROR (TODO handle): simultaneous 'read' and 'write' detected.")
-                if read:
-                    state[0] = MemState.BUSY_READ
-                elif write:
-                    state[0] = MemState.BUSY_WRITE
-                    data = yield arbiter.bus.dat_w
-            else:
-                if rdy: # random indicated transaction done in current cycle
-                    yield arbiter.bus.ack.eq(1)
-                    sel = yield arbiter.bus.sel
-                    sel = format(sel, '04b') # '1111' string for full mask
-                    f = lambda x : 0xFF if int(x) == 1 else 0x00
-                    g = lambda val, el: (val << 8) + el
-                    from functools import reduce
-                    mask = reduce(g, map(f, sel))
-                    read_val = 0x0 if mem_addr not in mem_dict else mem_dict[mem_addr]
-                    if state[0] == MemState.BUSY_WRITE:
-                        mem_dict[mem_addr] = (read_val & ~mask) | (data & mask)
-                    elif state[0] == MemState.BUSY_READ:
-                        read_val &= mask
-                        yield arbiter.bus.dat_r.eq(read_val)
-                        # print(f"cyc {ctr}: fetched {read_val} (from {mem_dict})...")
-                    state[0] = MemState.FREE
-            yield
-        
-
-    def TEST_REG(timeout=25 + timeout_cycles):
-        yield Active()
-        yield Tick()
-        yield Settle()
-
-        for _ in range(timeout):
-            en = yield cpu.reg_write_port.en
-            if en == 1:
-                addr = yield cpu.reg_write_port.addr
-                if addr == reg_num:
-                    val = yield cpu.reg_write_port.data
-                    if check_reg and (val != expected_val):
-                        # TODO that mechanism for now allows for only one write to reg, extend it if neccessary.
-                        print(f"== ERROR: Expected data write to reg x{addr} of value {expected_val}," 
-                        f" got value {val}.. \n== fail test: {name}\n")
-                        print(f"{format(expected_val, '32b')} vs {format(val, '32b')}")
-                        exit(1)
-                    return
-            yield Tick()
-        
-        if check_reg:
-            print(f"== ERROR: Test timeouted! No register write observed. Test: {name}\n")
-            exit(1)
-    
-    sim.add_sync_process(TEST_MEM)
-    sim.add_sync_process(TEST_REG)
-    with sim.write_vcd("cpu.vcd"):
-        sim.run()
+    if res.mem_error == "tcm":
+        raise AssertionError(f"== ERROR: tightly-coupled memory got request to address, that is not word-aligned."
+            f" Test: {name}\n")
+    if res.mem_error is not None:
+        raise AssertionError(f"== ERROR: memory on '{res.mem_error}' bus got 'cyc' deasserted with requests pending,"
+            f" or has no free slot for store. Test: {name}\n")
+
+    if check_reg:
+        if not res.written:
+            raise AssertionError(f"== ERROR: Test timeouted! No register write observed. Test: {name}\n")
+        val = res.val
+        if val != expected_val:
+            # TODO that mechanism for now allows for only one write to reg, extend it if neccessary.
+            raise AssertionError(f"== ERROR: Expected data write to reg x{reg_num} of value {expected_val},"
+                f" got value {val}.. \n== fail test: {name}\n"
+                f"{format(expected_val, '32b')} vs {format(val, '32b')}")
 
     if check_mem:
+        mem_dict = res.mem
         print(">>> MEM CHECKING: exp. vs val:", expected_mem, mem_dict)
         for k, v in expected_mem.items():
             if not k in mem_dict:
-                print(f"Error! Wrong memory state. Expected {v} value in {k} addr, got nothing here!")
-                exit(1)
+                raise AssertionError(f"Error! Wrong memory state. Expected {v} value in {k} addr, got nothing here!")
             if mem_dict[k] != v:
-                print(f"Error! Wrong memory state. Expected {v} value in {k} addr, got {mem_dict[k]}")
-                exit(1)
-    
+                raise AssertionError(f"Error! Wrong memory state. Expected {v} value in {k} addr, got {mem_dict[k]}")
 
 
 def compile_source(source_raw, output_elf_fname):
-    import subprocess
-    COMPILER = "riscv-none-embed-gcc"
-    LINKER_SCRIPT = "../elf/linker.ld"
-    p = subprocess.Popen(["which", COMPILER], stdout=subprocess.PIPE)
-    _, _ = p.communicate()
-    if p.returncode != 0:
+    if shutil.which(COMPILER) is None:
         raise ValueError(f"Error! Cannot find {COMPILER} compiler in your PATH! Have you runned 'install_toolchain.sh' script?")
 
-    import tempfile
-    tmp_dir = tempfile.mkdtemp()
-    asm_filename = f"{tmp_dir}/tmp.S"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asm_filename = f"{tmp_dir}/tmp.S"
 
-    with open(asm_filename, 'w+') as asm_file:
-        asm_file.write(source_raw)
+        with open(asm_filename, 'w+') as asm_file:
+            asm_file.write(source_raw)
 
-    p = subprocess.Popen([COMPILER, "-nostartfiles", f"-T{LINKER_SCRIPT}", asm_filename, "-o", output_elf_fname], stdout=subprocess.PIPE)
-    out, err = p.communicate()
+        p = subprocess.Popen([COMPILER, "-nostartfiles", f"-T{LINKER_SCRIPT}", asm_filename, "-o", output_elf_fname], stdout=subprocess.PIPE)
+        out, err = p.communicate()
     if p.returncode != 0:
         raise ValueError(f"Compilation error! source {source_raw}\ncouldn't get compiled! Error msg: \n{out}\n\n{err}")
 
 
-if __name__ == "__main__":
-    if ELF is not None:
+# runs single test case 't' (dict of one of tests tables), see 'reg_test' for remaining arguments.
+# 'tmp_dir' is where test's artefacts (ELF compiled from 'source_raw') are put, so that tests may run in parallel.
+def run_test(t, tmp_dir, **kwargs):
+    name     = t['name']     if 'name'     in t else f"unnamed: \n{t['source']}\n"
+    reg_init = t['reg_init'] if 'reg_init' in t else [0 for _ in range(32)]
+    mem_init = t['mem_init'] if 'mem_init' in t else {}
+    out_reg  = t['out_reg']  if 'out_reg'  in t else None
+    out_val  = t['out_val']  if 'out_val'  in t else None
+    mem_out  = t['mem_out']  if 'mem_out'  in t else None
+
+    def get_code_mem():
+        assert any(['source' in t, 'source_raw' in t, 'elf' in t])
+        assert 1 == len([1 for k in t if k in ['source', 'source_raw', 'elf']])
+        if 'source' in t:
+            source_file = StringIO(t['source'])
+            code = dump_asm(source_file, verbose=kwargs.get('verbose', False))
+            code_mem = dict(zip(count(START_ADDR, 4), code))
+            return code_mem
+        elif 'source_raw' in t:
+            tmp_fname = os.path.join(tmp_dir, "tmp.elf")
+            # treat 'source_raw' as content of a .S file and compile it via riscv-none-embed-gcc.
+            compile_source(t['source_raw'], tmp_fname)
+            return read_elf(tmp_fname, verbose=False)
+        elif 'elf' in t:
+            return read_elf(os.path.join(TEST_DIR, t['elf']), verbose=False)
+        else:
+            raise ValueError(f"test case must contain either 'elf', 'source' or 'source_raw' key! Not found in {t['name']}")
+
+    mem_dict = get_code_mem()
+    code_len = len(mem_dict)
+
+    mem_dict.update(mem_init)
+    if code_len + len(mem_init) != len(mem_dict):
+        raise ValueError(f"ERROR: overlapping memories (instr. mem starting at {START_ADDR} ({mem_dict}) and initial {mem_init})")
+
+    return reg_test(
+        name=name,
+        timeout_cycles=t['timeout'],
+        reg_num=out_reg,
+        expected_val=out_val,
+        expected_mem=mem_out,
+        reg_init=reg_init,
+        mem_dict=mem_dict,
+        **kwargs)
+
+
+# pytest runs each test of each table (with CPU configuration table needs) on each of 'CONFIGS' cores.
+# Tests of the same core are in the same 'xdist_group', so that with 'pytest -n auto --dist loadgroup'
+# each design gets elaborated by single worker only.
+CONFIGS = {
+    "multi_cycle": {},
+    "pipelined": dict(pipelined=True),
+    # hazards resolved by interlock only.
+    "no_forwarding": dict(pipelined=True, forwarding=False),
+    "prefetch": dict(prefetch_depth=2),
+    "pipelined_gshare": dict(pipelined=True, branch_predictor="gshare"),
+    "prefetch_bimodal": dict(prefetch_depth=2, branch_predictor="bimodal"),
+    "icache": dict(with_icache=True),
+    "dcache": dict(with_dcache=True),
+    # 'fence.i' has to write back data cache and invalidate instruction cache.
+    "caches": dict(with_icache=True, with_dcache=True),
+    # code and data as separate slaves, loads in flight while next instructions are fetched.
+    "crossbar": dict(memory_map=HARVARD_MAP, prefetch_depth=2, pending_loads=2),
+    "tcm": dict(tcm_size=0x1000),
+    # stores get buffered (and loads forwarded from buffer), when data port waits for fetch.
+    "store_buffer": dict(pipelined=True, store_buffer_depth=4, arbiter_scheme="round_robin"),
+    "weighted": dict(prefetch_depth=2, arbiter_scheme="weighted", ibus_weight=3),
+}
+
+TABLES = {
+    "reg": (REG_TESTS, {}),
+    "mem": (MEM_TESTS, {}),
+    "cmp": (CMP_TESTS, {}),
+    "upper": (UPPER_TESTS, {}),
+    "branch": (BRANCH_TESTS, {}),
+    "muldiv": (MULDIV_TESTS, dict(with_muldiv=True)),
+    "csr": (CSR_TESTS, {}),
+    # multi-cycle core without prefetch queue only.
+    "rvc": (RVC_TESTS, dict(with_rvc=True)),
+    "playground": (PLAYGROUND_TESTS, {}),
+}
+
+def table_cases():
+    for config_name, config_kwargs in CONFIGS.items():
+        for table_name, (tests, table_kwargs) in TABLES.items():
+            if table_name == "rvc" and config_kwargs:
+                continue
+            cpu_kwargs = { **config_kwargs, **table_kwargs }
+            for i, t in enumerate(tests):
+                yield pytest.param(t, cpu_kwargs, id=f"{config_name}-{table_name}-{t.get('name', i)}",
+                    marks=pytest.mark.xdist_group(repr(cpu_kwargs)))
+
+@pytest.mark.parametrize("t, cpu_kwargs", table_cases())
+def test_table(t, cpu_kwargs, tmp_path):
+    if 'source_raw' in t and shutil.which(COMPILER) is None:
+        pytest.skip(f"{COMPILER} not found")
+    if 'elf' in t and not os.path.exists(os.path.join(TEST_DIR, t['elf'])):
+        pytest.skip(f"{t['elf']} not found (see 'ELF tests' in README)")
+    run_test(t, tmp_path, cpu_kwargs=cpu_kwargs)
+
+
+def main():
+    args = parse_args()
+
+    ALL_TESTS = REG_TESTS + MEM_TESTS + CMP_TESTS + UPPER_TESTS + MULDIV_TESTS + CSR_TESTS + PLAYGROUND_TESTS
+    if not (args.pipelined or args.prefetch):
+        ALL_TESTS += RVC_TESTS
+
+    SELECTED_TESTS = args.mem + args.reg + args.cmp + args.upper + args.branch + args.muldiv + args.csr + args.rvc + args.playground
+    if SELECTED_TESTS == []:
+        SELECTED_TESTS = ALL_TESTS
+
+    # passed directly to MtkCpu constructor.
+    CPU_KWARGS = dict(
+        pipelined=args.pipelined,
+        forwarding=not args.no_forwarding,
+        with_icache=args.icache,
+        with_dcache=args.dcache,
+        prefetch_depth=args.prefetch,
+        fusion=args.fusion,
+        branch_predictor=args.bp,
+        arbiter_scheme=args.arbiter,
+        memory_map=HARVARD_MAP if args.crossbar else None,
+        tcm_size=args.tcm,
+        store_buffer_depth=args.store_buffer,
+        pending_loads=args.pending_loads,
+        # RV32M is enabled only when it's tests are run, so that other suites check core without it.
+        with_muldiv=any(t in MULDIV_TESTS for t in SELECTED_TESTS),
+        multiplier=args.multiplier,
+        divider_radix=args.divider_radix,
+        shifter=args.shifter,
+        shifter_bits_per_cycle=args.shifter_bits_per_cycle,
+        # the same goes for RV32C - with it, regular tests are fetched through fetch buffer.
+        with_rvc=any(t in RVC_TESTS for t in SELECTED_TESTS),
+    )
+
+    # passed directly to reg_test.
+    MEM_TIMING = {}
+    for t in args.mem_timing:
+        bus_name, p, p_stall = t.split(":")
+        MEM_TIMING[bus_name] = dict(p=float(p), p_stall=float(p_stall))
+    for t in args.mem_latency:
+        bus_name, latency = t.split(":")
+        MEM_TIMING[bus_name] = dict(latency=int(latency))
+
+    capture = None
+    if args.vcd is not None:
+        cycles = None if args.vcd_cycles is None else tuple(int(x, 0) for x in args.vcd_cycles.split(":"))
+        capture = WaveformCapture(args.vcd, signals=args.vcd_signals, cycles=cycles, start_pc=args.vcd_start_pc,
+            stop_pc=args.vcd_stop_pc, last=args.vcd_last, on_failure=args.vcd_on_failure)
+
+    if args.elf is not None:
         # for future: simulate ELF, print output memory/registers and exit.
         raise NotImplementedError("direct ELF simulating not supported for now! (However, most of architecture is already done.)")
-    
+
     print("===== Running tests...")
-    for i, t in enumerate(SELECTED_TESTS, 1):
-        name     = t['name']     if 'name'     in t else f"unnamed: \n{t['source']}\n"
-        reg_init = t['reg_init'] if 'reg_init' in t else [0 for _ in range(32)]
-        mem_init = t['mem_init'] if 'mem_init' in t else {}
-        out_reg  = t['out_reg']  if 'out_reg'  in t else None
-        out_val  = t['out_val']  if 'out_val'  in t else None
-        mem_out  = t['mem_out']  if 'mem_out'  in t else None
-
-        def get_code_mem():
-            assert any(['source' in t, 'source_raw' in t, 'elf' in t])
-            assert 1 == len([1 for k in t if k in ['source', 'source_raw', 'elf']])
-            if 'source' in t:
-                source_file = StringIO(t['source'])
-                code = dump_asm(source_file, verbose=False)
-                code_mem = dict(zip(count(START_ADDR, 4), code))
-                return code_mem
-            elif 'source_raw' in t:
-                tmp_fname = "tmp.elf"
-                # treat 'source_raw' as content of a .S file and compile it via riscv-none-embed-gcc.
-                compile_source(t['source_raw'], tmp_fname)
-                return read_elf(tmp_fname, verbose=False)
-            elif 'elf' in t:
-                return read_elf(t['elf'], verbose=False)
-            else:
-                raise ValueError(f"test case must contain either 'elf', 'source' or 'source_raw' key! Not found in {t['name']}")
-
-        mem_dict = get_code_mem()
-        code_len = len(mem_dict)
-
-        mem_dict.update(mem_init)
-        if code_len + len(mem_init) != len(mem_dict):
-            raise ValueError(f"ERROR: overlapping memories (instr. mem starting at {START_ADDR} ({mem_dict}) and initial {mem_init})")
-
-        reg_test(
-            name=name, 
-            timeout_cycles=t['timeout'], 
-            reg_num=out_reg, 
-            expected_val=out_val, 
-            expected_mem=mem_out, 
-            reg_init=reg_init,
-            mem_dict=mem_dict,
-            verbose=VERBOSE)
-        print(f"== Test {i}/{len(SELECTED_TESTS)}: <{name}> completed successfully..")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i, t in enumerate(SELECTED_TESTS, 1):
+            name = t['name'] if 'name' in t else f"unnamed: \n{t['source']}\n"
+            try:
+                run_test(t, tmp_dir,
+                    verbose=args.verbose,
+                    cpu_kwargs=CPU_KWARGS,
+                    mem_timing=MEM_TIMING,
+                    backend=args.backend,
+                    capture=capture)
+            except AssertionError as e:
+                print(e)
+                exit(1)
+            print(f"== Test {i}/{len(SELECTED_TESTS)}: <{name}> completed successfully..")
 
     # from minized import MinizedPlatform, TopWrapper
     # m = MtkCpu(32)
     # MinizedPlatform().build(TopWrapper(m), do_program=False)
+
+
+if __name__ == "__main__":
+    main()
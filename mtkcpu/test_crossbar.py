@@ -0,0 +1,72 @@
+import pytest
+
+from nmigen.back.pysim import Simulator, Settle
+from units.crossbar import Crossbar
+
+
+MAP = [
+    ("code", 0x1000, 0x1000),
+    ("data", 0x0, None),
+]
+
+
+def test_crossbar_parallel():
+    xbar = Crossbar(MAP)
+    dbus = xbar.port(priority=0, name="dbus")
+    ibus = xbar.port(priority=1, name="ibus")
+
+    sim = Simulator(xbar)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        # masters reaching different slaves are both accepted in the same cycle.
+        for bus, adr in [(ibus, 0x1004), (dbus, 0x200)]:
+            yield bus.adr.eq(adr)
+            yield bus.cyc.eq(1)
+            yield bus.stb.eq(1)
+        yield Settle()
+        assert (yield ibus.stall) == 0
+        assert (yield dbus.stall) == 0
+        assert (yield xbar.slaves["code"].adr) == 0x1004
+        assert (yield xbar.slaves["data"].adr) == 0x200
+        yield
+        yield ibus.stb.eq(0)
+        yield dbus.stb.eq(0)
+        yield xbar.slaves["data"].ack.eq(1)
+        yield xbar.slaves["data"].dat_r.eq(0xdead)
+        yield Settle()
+        assert (yield dbus.ack) == 1
+        assert (yield dbus.dat_r) == 0xdead
+        assert (yield ibus.ack) == 0
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_crossbar_conflict():
+    xbar = Crossbar(MAP)
+    dbus = xbar.port(priority=0, name="dbus")
+
+    sim = Simulator(xbar)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        yield dbus.adr.eq(0x1000)
+        yield dbus.cyc.eq(1)
+        yield dbus.stb.eq(1)
+        yield
+        # request to other slave waits, until previous one is acked.
+        yield dbus.adr.eq(0x0)
+        yield Settle()
+        assert (yield dbus.stall) == 1
+        assert (yield xbar.slaves["data"].stb) == 0
+        assert (yield xbar.slaves["code"].cyc) == 1
+        yield xbar.slaves["code"].ack.eq(1)
+        yield
+        yield xbar.slaves["code"].ack.eq(0)
+        yield Settle()
+        assert (yield dbus.stall) == 0
+        assert (yield xbar.slaves["data"].stb) == 1
+
+    sim.add_sync_process(MAIN)
+    sim.run()
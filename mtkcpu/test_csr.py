@@ -0,0 +1,78 @@
+import pytest
+
+from nmigen.back.pysim import Simulator, Settle
+from isa import Funct3, CSRIndex
+from units.csr import CsrUnit, HPM_EVENTS
+
+
+# executes single CSR instruction, returns ('res', 'illegal') - old value of CSR.
+# Note, that one cycle passes before sync process starts.
+def csr_instr(dut, funct3, addr, src1=0, rs1=1):
+    yield dut.en.eq(1)
+    yield dut.funct3.eq(funct3)
+    yield dut.addr.eq(addr)
+    yield dut.src1.eq(src1)
+    yield dut.rs1.eq(rs1)
+    yield Settle()
+    res = (yield dut.res), (yield dut.illegal)
+    yield
+    yield dut.en.eq(0)
+    return res
+
+
+def test_csr_counters():
+    dut = CsrUnit(hpm_counters=2)
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        # 'mhpmcounter4' counts 'dcache_miss', 'mhpmcounter3' stays stopped.
+        yield from csr_instr(dut, Funct3.CSRRW, CSRIndex.MHPMEVENT3.value + 1, HPM_EVENTS.index("dcache_miss") + 1)
+        for i in range(10):
+            yield dut.retire.eq(i % 2)
+            yield dut.events.dcache_miss.eq(i % 3 == 0)
+            yield
+        yield dut.retire.eq(0)
+        yield dut.events.dcache_miss.eq(0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.CYCLE.value, rs1=0)) == (12, 0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.TIME.value, rs1=0)) == (13, 0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.INSTRET.value, rs1=0)) == (5, 0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.HPMCOUNTER3.value, rs1=0)) == (0, 0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.HPMCOUNTER3.value + 1, rs1=0)) == (4, 0)
+
+        # 'mcycle' (and 'cycle', it's read-only shadow) gets stopped, 'time' keeps counting.
+        yield from csr_instr(dut, Funct3.CSRRWI, CSRIndex.MCOUNTINHIBIT.value, 0b111)
+        yield from csr_instr(dut, Funct3.CSRRW, CSRIndex.MCYCLEH.value, 0x1234)
+        yield
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.MCOUNTINHIBIT.value, rs1=0)) == (0b101, 0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.CYCLE.value, rs1=0)) == (18, 0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.CYCLEH.value, rs1=0)) == (0x1234, 0)
+        assert (yield from csr_instr(dut, Funct3.CSRRS, CSRIndex.TIME.value, rs1=0)) == (23, 0)
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+@pytest.mark.parametrize("funct3, addr, rs1, illegal", [
+    (Funct3.CSRRS, CSRIndex.CYCLE.value,            0, 0),
+    (Funct3.CSRRS, CSRIndex.CYCLE.value,            1, 1), # user counters are read-only
+    (Funct3.CSRRW, CSRIndex.TIME.value,             0, 1),
+    (Funct3.CSRRW, CSRIndex.MHPMCOUNTER3.value + 28, 1, 0), # not implemented, hardwired to zero
+    (Funct3.CSRRS, 0x340,                           0, 1), # 'mscratch' is not implemented
+])
+def test_csr_illegal(funct3, addr, rs1, illegal):
+    dut = CsrUnit(hpm_counters=2)
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        _, res_illegal = yield from csr_instr(dut, funct3, addr, rs1=rs1)
+        assert res_illegal == illegal
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_csr_bad_params():
+    with pytest.raises(ValueError):
+        CsrUnit(hpm_counters=30)
@@ -0,0 +1,160 @@
+import random
+
+import pytest
+from nmigen import *
+from nmigen.back.pysim import Simulator, Delay, Settle
+
+from cxxsim import CxxSimulator, find_compiler
+
+
+# Differential test of 'cxxsim' against 'pysim': random design (operators, slices, parts, Cat, Repl, Mux, Array,
+# If/Switch, comb and sync assignments, memory with both kinds of read port) is driven with random inputs,
+# and every signal is sampled each cycle, by both simulators - the traces must be equal.
+
+NCYCLES = 40
+
+
+class RandomDesign(Elaboratable):
+    def __init__(self, rng):
+        self.rng = rng
+        self.inputs = [Signal(Shape(rng.randint(1, 16), rng.random() < .3), name=f"i{n}") for n in range(6)]
+        self.signals = []
+
+    def shape(self):
+        return Shape(self.rng.randint(1, 24), self.rng.random() < .3)
+
+    def operand(self, pool):
+        return self.rng.choice(pool)
+
+    # random expression, of at most 'depth' levels, on signals from 'pool'.
+    def expr(self, pool, depth):
+        rng = self.rng
+        if depth == 0 or rng.random() < .2:
+            if rng.random() < .2:
+                return Const(rng.randint(-50, 200), Shape(9, True))
+            return self.operand(pool)
+        a, b = self.expr(pool, depth - 1), self.expr(pool, depth - 1)
+        kind = rng.randrange(14)
+        if kind == 0:
+            res = rng.choice([a + b, a - b, a * b, a & b, a | b, a ^ b])
+        elif kind == 1:
+            res = rng.choice([a == b, a != b, a < b, a <= b, a > b, a >= b])
+        elif kind == 2:
+            res = rng.choice([~a, -a, a.bool(), a.any(), a.all(), a.xor()])
+        elif kind == 3:
+            amount = rng.randint(0, 5)
+            res = rng.choice([a << amount, a >> amount, a.implies(b), Cat(a, b, a)[:3].matches(0b101, "1-0", "-1-")])
+        elif kind == 4:
+            res = rng.choice([a << b[:3].as_unsigned(), a >> b[:4].as_unsigned()])
+        elif kind == 5:
+            res = Mux(a.bool(), b, self.expr(pool, depth - 1))
+        elif kind == 6:
+            start = rng.randrange(len(a))
+            res = a[start:rng.randint(start + 1, len(a))]
+        elif kind == 7:
+            res = a.bit_select(b[:3].as_unsigned(), rng.randint(1, 4))
+        elif kind == 8:
+            res = a.word_select(b[:2].as_unsigned(), rng.randint(1, 4))
+        elif kind == 9:
+            res = Cat(a, b)
+        elif kind == 10:
+            res = Repl(a[:4], rng.randint(1, 3))
+        elif kind == 11:
+            res = rng.choice([a.as_signed(), a.as_unsigned()])
+        elif kind == 12:
+            res = Array(self.expr(pool, depth - 1) for _ in range(rng.randint(2, 5)))[b[:3].as_unsigned()]
+        else:
+            res = a.as_unsigned() // (b[:4].as_unsigned() | 1)
+        # keeps widths (e.g. of products and shifts) in range, that both simulators support.
+        if len(res) > 32:
+            res = res[:rng.randint(1, 32)]
+        return res
+
+    def elaborate(self, platform):
+        rng = self.rng
+        m = Module()
+
+        regs = []
+        for n in range(5):
+            shape = self.shape()
+            regs.append(Signal(shape, reset=rng.randrange(1 << (shape.width - 1)), name=f"r{n}"))
+        wires = [Signal(self.shape(), name=f"w{n}") for n in range(5)]
+        pool = self.inputs + regs
+
+        # comb signals - each one depends on inputs, registers and previous comb signals only.
+        for n, wire in enumerate(wires):
+            kind = rng.randrange(3)
+            if kind == 0:
+                m.d.comb += wire.eq(self.expr(pool, 3))
+            elif kind == 1:
+                with m.If(self.expr(pool, 2).bool()):
+                    m.d.comb += wire.eq(self.expr(pool, 3))
+                with m.Elif(self.expr(pool, 2).bool()):
+                    m.d.comb += wire[:rng.randint(1, len(wire))].eq(self.expr(pool, 3))
+            else:
+                with m.Switch(Cat(self.operand(pool), self.operand(pool))[:2]):
+                    with m.Case(0):
+                        m.d.comb += wire.eq(self.expr(pool, 3))
+                    with m.Case("1-"):
+                        m.d.comb += Cat(wire[:1], wire[1:]).eq(self.expr(pool, 3))
+                    with m.Default():
+                        m.d.comb += wire.eq(wire.reset + 1)
+            pool.append(wire)
+
+        for reg in regs:
+            with m.If(self.expr(pool, 2).bool()):
+                m.d.sync += reg.eq(self.expr(pool, 3))
+            with m.Elif(self.expr(pool, 1).bool()):
+                m.d.sync += reg.bit_select(self.operand(pool)[:3].as_unsigned(), 2).eq(self.expr(pool, 2))
+
+        mem = Memory(width=2 * rng.randint(2, 8), depth=8, init=[rng.randrange(100) for _ in range(5)])
+        m.submodules.rdport = rdport = mem.read_port(transparent=rng.random() < .5)
+        m.submodules.async_rdport = async_rdport = mem.read_port(domain="comb")
+        m.submodules.wrport = wrport = mem.write_port(granularity=mem.width // 2)
+        m.d.comb += [
+            rdport.addr.eq(self.expr(pool, 2)),
+            async_rdport.addr.eq(self.expr(pool, 2)),
+            wrport.addr.eq(self.expr(pool, 2)),
+            wrport.data.eq(self.expr(pool, 2)),
+            wrport.en.eq(self.expr(pool, 2)),
+        ]
+        # ('en' of transparent port is constant)
+        if not rdport.transparent:
+            m.d.comb += rdport.en.eq(self.expr(pool, 1))
+
+        self.signals = [*pool, rdport.data, async_rdport.data]
+        return m
+
+
+# Runs 'design' for 'NCYCLES' cycles, with 'simulator_run' (function, that runs given process), returns trace.
+def run(simulator_run, design, rng):
+    trace = []
+    def process():
+        for _ in range(NCYCLES):
+            for i in design.inputs:
+                yield i.eq(rng.randrange(-(1 << len(i)), 1 << len(i)))
+            yield Settle()
+            values = []
+            for s in design.signals:
+                values.append((yield s))
+            trace.append(values)
+            yield Delay(1e-6)
+    simulator_run(process)
+    return trace
+
+
+@pytest.mark.skipif(find_compiler() is None, reason="no C++ compiler")
+@pytest.mark.parametrize("seed", range(16))
+def test_random_design(seed, tmp_path):
+    design = RandomDesign(random.Random(seed))
+    fragment = Fragment.get(design, None)
+
+    sim = Simulator(fragment)
+    sim.add_clock(1e-6)
+    def pysim_run(process):
+        sim.add_process(process)
+        sim.run()
+    expected = run(pysim_run, design, random.Random(seed))
+
+    cxx_sim = CxxSimulator(fragment, period=1e-6, cache_dir=str(tmp_path))
+    assert run(cxx_sim.run, design, random.Random(seed)) == expected
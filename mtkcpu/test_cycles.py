@@ -0,0 +1,174 @@
+import pytest
+
+from io import StringIO
+from itertools import count
+
+from asm_dump import dump_asm
+from common import START_ADDR
+from cpu import MtkCpu
+from testbench import SimHarness
+
+
+# Cycles taken by each instruction class on multi-cycle core (with zero wait-state memory):
+# instruction, cycles by default, and cycles with prefetch queue (and code in TCM, so that fetching ahead
+# doesn't compete with data accesses). Keep in sync with table in README.md.
+MULTI_CYCLE_TABLE = {
+    "logic":        ("and x2, x2, x3",      3, 2),
+    "adder":        ("addi x2, x2, 1",      3, 2),
+    "shifter":      ("sll x2, x2, x3",      3, 2),
+    "compare":      ("slt x2, x2, x3",      3, 2),
+    "lui":          ("lui x2, 0x12",        3, 2),
+    "auipc":        ("auipc x2, 0x12",      3, 2),
+    "jal":          ("jal x2, l{i}",        3, 4),
+    "jalr":         ("jalr x2, x1, {next}", 3, 4),
+    "branch":       ("bne x0, x0, l{i}",    3, 2),
+    "branch taken": ("beq x0, x0, l{i}",    3, 2),
+    "load":         ("lw x2, 0x100(x0)",    4, 3),
+    "store":        ("sw x2, 0x100(x0)",    4, 3),
+}
+
+PREFETCH_KWARGS = dict(prefetch_depth=2, tcm_size=0x1000)
+
+# RV32M instructions on multi-cycle core: cycles with default unit, and with "two_cycle" multiplier
+# and radix-4 divider (see bench_muldiv.py for multiply-heavy kernels).
+MULDIV_CYCLE_TABLE = {
+    "mul":  ("mul x2, x2, x3",  3, 4),
+    "mulh": ("mulh x2, x2, x3", 3, 4),
+    "div":  ("div x2, x2, x3",  36, 20),
+    "rem":  ("rem x2, x2, x3",  36, 20),
+}
+
+MULDIV_KWARGS = dict(with_muldiv=True, multiplier="two_cycle", divider_radix=4)
+
+# Shift by 1, 5 and 31 on multi-cycle core, for each shifter implementation (see bench_shifter.py).
+SHIFTER_CYCLE_TABLE = {
+    "barrel":       (dict(shifter="barrel"),                                [3, 3, 3]),
+    "pipelined":    (dict(shifter="pipelined"),                             [4, 4, 4]),
+    "iterative":    (dict(shifter="iterative"),                             [3, 7, 33]),
+    "iterative 4":  (dict(shifter="iterative", shifter_bits_per_cycle=4),   [3, 4, 10]),
+}
+
+SHIFTER_CYCLE_AMOUNTS = [1, 5, 31]
+
+# RV32C on multi-cycle core: instruction (or pair of them), cycles per instance. Compressed instruction
+# in upper half of already fetched word is taken from fetch buffer, 32-bit one crossing word boundary
+# waits for the next word. Keep in sync with table in README.md.
+RVC_CYCLE_TABLE = {
+    "32-bit":               ("addi x2, x2, 1",                  3),
+    "compressed":           ("c.addi x8, 1",                    2.5),
+    "compressed load":      ("c.lw x9, 0x40(x8)",               3.5),
+    "compressed, 32-bit":   ("c.addi x8, 1\naddi x2, x2, 1",    6),
+}
+
+# Loads on multi-cycle core with prefetch queue (see PREFETCH_KWARGS): instruction sequence, cycles per instance
+# with blocking loads, and with non-blocking ones. Keep in sync with table in README.md.
+PENDING_LOADS_CYCLE_TABLE = {
+    "load":                 ("lw x2, 0x100(x0)",                                        3, 2.75),
+    "load, independent":    ("lw x2, 0x100(x0)\naddi x3, x3, 1",                        5, 4),
+    "load, use":            ("lw x2, 0x100(x0)\naddi x2, x2, 1",                        5, 5),
+    "two loads, use":       ("lw x2, 0x100(x0)\nlw x3, 0x104(x0)\nadd x4, x2, x3",      8, 7),
+}
+
+# Instruction pairs, that get fused, on multi-cycle core with deeper prefetch queue (it has to hold both of them):
+# cycles per instance without and with fusion. Keep in sync with table in README.md.
+FUSION_CYCLE_TABLE = {
+    "lui, addi":            ("lui x2, 0x12\naddi x2, x2, 1",                    4, 2.5),
+    "auipc, lw":            ("auipc x2, 0\nlw x2, 0x100(x2)",                   5, 3.5),
+    "addi, auipc, jalr":    ("addi x3, x3, 1\nauipc x2, 0\njalr x2, x2, 8",     8, 6),
+}
+
+FUSION_KWARGS = dict(prefetch_depth=4, tcm_size=0x1000)
+
+N = 4
+
+
+# Returns number of cycles, until 'x31' gets written (by the last instruction of 'lines').
+# Simulation of each CPU configuration is built once (see 'SimHarness'), with zero wait-state memory,
+# each request is acked in the next cycle.
+def run_program(lines, cpu_kwargs={}, reg_init=[0, START_ADDR], mem_init={}, timeout=1000):
+    code = dump_asm(StringIO(".section code\n" + "\n".join(lines) + "\n"), verbose=False)
+    mem_dict = dict(zip(count(START_ADDR, 4), code))
+    mem_dict.update(mem_init)
+
+    key = repr(cpu_kwargs)
+    if key not in HARNESSES:
+        HARNESSES[key] = SimHarness(cpu_kwargs, mem_timing={ "mem": dict(latency=1) })
+    res = HARNESSES[key].run(mem_dict, reg_init=reg_init, watch_reg=31, timeout=timeout)
+    assert res.written, f"timeout: {lines}"
+    return res.cycle
+
+HARNESSES = {}
+
+
+# Returns number of cycles, until 'x31' gets written by the last instruction
+# (executed after 'n' instances of 'instr', each followed by label 'l<i>').
+def run_cycles(instr, n, cpu_kwargs={}):
+    lines = []
+    for i in range(n):
+        lines.append(instr.format(i=i, next=4 * (i + 1)))
+        lines.append(f"l{i}:")
+    lines.append("addi x31, x0, 1")
+    return run_program(lines, cpu_kwargs, timeout=50 * (n + 1))
+
+
+def instr_cycles(instr, cpu_kwargs={}):
+    return (run_cycles(instr, N, cpu_kwargs) - run_cycles(instr, 0, cpu_kwargs)) / N
+
+
+@pytest.mark.parametrize("name", MULTI_CYCLE_TABLE)
+def test_multi_cycle_table(name):
+    instr, expected, _ = MULTI_CYCLE_TABLE[name]
+    assert instr_cycles(instr) == expected
+
+
+@pytest.mark.parametrize("name", MULTI_CYCLE_TABLE)
+def test_multi_cycle_prefetch_table(name):
+    instr, _, expected = MULTI_CYCLE_TABLE[name]
+    assert instr_cycles(instr, PREFETCH_KWARGS) == expected
+
+
+@pytest.mark.parametrize("name", MULDIV_CYCLE_TABLE)
+def test_muldiv_cycle_table(name):
+    instr, expected, expected_two_cycle = MULDIV_CYCLE_TABLE[name]
+    assert instr_cycles(instr, dict(with_muldiv=True)) == expected
+    assert instr_cycles(instr, MULDIV_KWARGS) == expected_two_cycle
+
+
+@pytest.mark.parametrize("name", SHIFTER_CYCLE_TABLE)
+def test_shifter_cycle_table(name):
+    cpu_kwargs, expected = SHIFTER_CYCLE_TABLE[name]
+    assert [instr_cycles(f"slli x2, x2, {s}", cpu_kwargs) for s in SHIFTER_CYCLE_AMOUNTS] == expected
+
+
+@pytest.mark.parametrize("name", RVC_CYCLE_TABLE)
+def test_rvc_cycle_table(name):
+    instr, expected = RVC_CYCLE_TABLE[name]
+    assert instr_cycles(instr, dict(with_rvc=True)) == expected
+
+
+@pytest.mark.parametrize("name", PENDING_LOADS_CYCLE_TABLE)
+def test_pending_loads_cycle_table(name):
+    instr, expected, expected_pending = PENDING_LOADS_CYCLE_TABLE[name]
+    assert instr_cycles(instr, PREFETCH_KWARGS) == expected
+    assert instr_cycles(instr, dict(pending_loads=2, **PREFETCH_KWARGS)) == expected_pending
+
+
+def test_pending_loads_bad_params():
+    with pytest.raises(ValueError):
+        MtkCpu(pending_loads=2, pipelined=True)
+    with pytest.raises(ValueError):
+        MtkCpu(pending_loads=2, store_buffer_depth=2)
+
+
+@pytest.mark.parametrize("name", FUSION_CYCLE_TABLE)
+def test_fusion_cycle_table(name):
+    instr, expected, expected_fused = FUSION_CYCLE_TABLE[name]
+    assert instr_cycles(instr, FUSION_KWARGS) == expected
+    assert instr_cycles(instr, dict(fusion=True, **FUSION_KWARGS)) == expected_fused
+
+
+def test_fusion_bad_params():
+    with pytest.raises(ValueError):
+        MtkCpu(fusion=True)
+    with pytest.raises(ValueError):
+        MtkCpu(fusion=True, prefetch_depth=1)
@@ -0,0 +1,115 @@
+import pytest
+
+from io import StringIO
+from nmigen.back.pysim import Simulator, Settle
+
+from asm_dump import dump_asm
+from isa import InstrFormat
+from units.decoder import InstructionDecoder
+from units.upper import FusionDetector
+
+
+# returns encoding of last instruction, preceding ones (separated by ';') may define labels.
+def encode(instr):
+    lines = instr.replace("; ", "\n")
+    return dump_asm(StringIO(f".section code\n{lines}\n"), verbose=False)[-1]
+
+
+# four instructions back.
+BACK = "l:; addi x0, x0, 0; addi x0, x0, 0; addi x0, x0, 0; addi x0, x0, 0; "
+
+
+# instruction, active unit, immediate format, immediate, write_rd
+DECODER_TABLE = [
+    ("addi x1, x2, -5",     "adder",    InstrFormat.I, -5,      1),
+    ("sub x1, x2, x3",      "adder",    InstrFormat.R, 0,       1),
+    ("slli x1, x2, 3",      "shifter",  InstrFormat.I, 3,       1),
+    ("lw x0, -4(x2)",       "mem_unit", InstrFormat.I, -4,      0),
+    ("sw x1, -8(x2)",       "mem_unit", InstrFormat.S, -8,      0),
+    ("lui x1, 0x12345",     "lui",      InstrFormat.U, 0x12345000, 1),
+    (BACK + "bne x1, x2, l", "branch", InstrFormat.B, -16,     0),
+    (BACK + "jal x1, l",    "jal",      InstrFormat.J, -16,     1),
+    ("jalr x1, x2, 12",     "jalr",     InstrFormat.I, 12,      1),
+    ("csrrs x1, 0xc00, x0", "csr",      InstrFormat.I, -0x400,  1),
+]
+
+
+@pytest.mark.parametrize("instr, unit, imm_format, imm, write_rd", DECODER_TABLE)
+def test_decoder(instr, unit, imm_format, imm, write_rd):
+    dut = InstructionDecoder()
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        yield dut.instr.eq(encode(instr))
+        yield dut.en.eq(1)
+        yield Settle()
+        # one-hot 'unit', decoded combinationally...
+        for name, field in dut.dec.unit.fields.items():
+            assert (yield field) == int(name == unit)
+        assert (yield dut.dec.imm_format) == imm_format.value
+        assert (yield dut.dec.imm) == imm & 0xFFFF_FFFF
+        assert (yield dut.dec.write_rd) == write_rd
+        assert (yield dut.dec.illegal) == 0
+        # ...and registered in 'ctrl'.
+        assert (yield dut.ctrl.unit[unit]) == 0
+        yield
+        yield dut.en.eq(0)
+        yield dut.clear.eq(1)
+        yield Settle()
+        assert (yield dut.ctrl.unit[unit]) == 1
+        assert (yield dut.ctrl.imm) == imm & 0xFFFF_FFFF
+        yield
+        yield Settle()
+        assert (yield dut.ctrl) == 0
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_decoder_illegal():
+    dut = InstructionDecoder()
+    sim = Simulator(dut)
+
+    def MAIN():
+        # 'ecall' is not supported.
+        yield dut.instr.eq(0x0000_0073)
+        yield Settle()
+        assert (yield dut.dec.illegal) == 1
+        assert (yield dut.dec.unit) == 0
+
+    sim.add_process(MAIN)
+    sim.run()
+
+
+# pair of instructions, whether it gets fused, and if so - whether first one is 'lui'.
+FUSION_TABLE = [
+    ("lui x5, 0x12345", "addi x5, x5, 0x678",   1, 1),
+    ("auipc x1, 0x10",  "jalr x1, x1, -4",      1, 0),
+    ("auipc x6, 0",     "lw x6, 0x100(x6)",     1, 0),
+    # temporary would stay visible.
+    ("lui x5, 0x12345", "addi x6, x5, 0x678",   0, 0),
+    ("auipc x5, 0x10",  "jalr x0, x5, 0",       0, 0),
+    # not one of supported pairs.
+    ("auipc x5, 0x10",  "addi x5, x5, 1",       0, 0),
+    ("lui x5, 0x12345", "lw x5, 0(x5)",         0, 0),
+    ("auipc x6, 0",     "lh x6, 0x100(x6)",     0, 0),
+    ("lui x0, 0x12345", "addi x0, x0, 1",       0, 0),
+]
+
+@pytest.mark.parametrize("first, second, fuse, lui", FUSION_TABLE)
+def test_fusion_detector(first, second, fuse, lui):
+    dut = FusionDetector()
+    sim = Simulator(dut)
+
+    def MAIN():
+        yield dut.first.eq(encode(first))
+        yield dut.second.eq(encode(second))
+        yield Settle()
+        assert (yield dut.fuse) == fuse
+        if fuse:
+            assert (yield dut.lui) == lui
+            assert (yield dut.imm) == encode(first) & 0xFFFF_F000
+
+    sim.add_process(MAIN)
+    sim.run()
@@ -5,7 +5,7 @@ from nmigen import Module
 from units.loadstore import LoadStoreUnit, MemoryArbiter
 
 
-def test_mem_port_unit():
+def test_mem_port_unit(tmp_path):
     # m = MtkCpu(reg_init=reg_init)
     arbiter = MemoryArbiter()
     port0 = arbiter.port(priority=0)
@@ -23,6 +23,221 @@ def test_mem_port_unit():
             yield
 
     sim.add_sync_process(MAIN)
-    with sim.write_vcd("cpu.vcd"):
+    with sim.write_vcd(str(tmp_path / "cpu.vcd")):
         sim.run()
 
+
+
+# returns list of (granted port idx or None) for each cycle, ports request according to 'requests' (list of sets).
+def run_arbiter(scheme, requests, weights=(1, 1)):
+    arbiter = MemoryArbiter(scheme=scheme)
+    ports = [arbiter.port(priority=i, weight=w) for i, w in enumerate(weights)]
+
+    sim = Simulator(arbiter)
+    sim.add_clock(1e-6)
+    grants = []
+
+    def MAIN():
+        yield arbiter.bus.stall.eq(0)
+        for active in requests:
+            for i, p in enumerate(ports):
+                yield p.cyc.eq(i in active)
+                yield p.stb.eq(i in active)
+            yield Settle()
+            stalls = []
+            for p in ports:
+                stalls.append((yield p.stall))
+            granted = [i for i in active if not stalls[i]]
+            assert len(granted) <= 1
+            grants.append(granted[0] if granted else None)
+            # each tenure is a single request, acked in the next cycle.
+            yield
+            for p in ports:
+                yield p.cyc.eq(0)
+                yield p.stb.eq(0)
+            yield arbiter.bus.ack.eq(1)
+            yield
+            yield arbiter.bus.ack.eq(0)
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+    return grants
+
+
+def test_arbiter_zero_latency():
+    for scheme in ["priority", "round_robin", "weighted"]:
+        assert run_arbiter(scheme, [{1}, {0}, {1}]) == [1, 0, 1]
+
+
+def test_arbiter_priority():
+    assert run_arbiter("priority", [{0, 1}] * 4) == [0, 0, 0, 0]
+
+
+def test_arbiter_round_robin():
+    assert run_arbiter("round_robin", [{0, 1}] * 4) == [1, 0, 1, 0]
+
+
+def test_arbiter_weighted():
+    assert run_arbiter("weighted", [{0, 1}] * 6, weights=(2, 1)) == [1, 0, 0, 1, 0, 0]
+
+
+def test_store_buffer():
+    from nmigen.hdl.rec import Record
+    from units.loadstore import MemoryUnit, bus_layout
+    from isa import Funct3
+
+    bus = Record(bus_layout)
+    mem_unit = MemoryUnit(bus, store_buffer_depth=2)
+
+    sim = Simulator(mem_unit)
+    sim.add_clock(1e-6)
+
+    def request(store, funct3, addr, data=0):
+        yield mem_unit.en.eq(1)
+        yield mem_unit.store.eq(store)
+        yield mem_unit.funct3.eq(funct3)
+        yield mem_unit.src1.eq(addr)
+        yield mem_unit.src2.eq(data)
+        yield Settle()
+        return (yield mem_unit.ack), (yield mem_unit.res)
+
+    def MAIN():
+        # memory doesn't accept any request, buffered stores are acked anyway.
+        yield bus.stall.eq(1)
+        assert (yield from request(1, Funct3.W, 0x10, 0x11223344))[0] == 1
+        yield
+        assert (yield from request(1, Funct3.H, 0x20, 0xaaaa))[0] == 1
+        yield
+        # combined with previous store.
+        assert (yield from request(1, Funct3.B, 0x20, 0xbb))[0] == 1
+        yield
+        yield Settle()
+        assert (yield from mem_unit.sim_buffered_stores()) == [(0x10, 0x11223344, 0b1111), (0x20, 0xffffaabb, 0b0011)]
+        assert (yield mem_unit.merge_ctr) == 1
+        # served from buffer.
+        assert (yield from request(0, Funct3.HU, 0x20)) == (1, 0xaabb)
+        yield
+        # not all bytes are buffered, load has to wait.
+        assert (yield from request(0, Funct3.W, 0x20))[0] == 0
+        yield
+        yield Settle()
+        assert (yield mem_unit.forward_ctr) == 1
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+def test_load_queue():
+    from nmigen.hdl.rec import Record
+    from units.loadstore import MemoryUnit, bus_layout
+    from isa import Funct3
+
+    bus = Record(bus_layout)
+    mem_unit = MemoryUnit(bus, pending_loads=2)
+
+    sim = Simulator(mem_unit)
+    sim.add_clock(1e-6)
+
+    def request(store, funct3, addr, rd=0):
+        yield mem_unit.en.eq(1)
+        yield mem_unit.store.eq(store)
+        yield mem_unit.funct3.eq(funct3)
+        yield mem_unit.src1.eq(addr)
+        yield mem_unit.rd.eq(rd)
+        yield Settle()
+        return (yield mem_unit.ack)
+
+    def respond(data):
+        yield mem_unit.en.eq(0)
+        yield bus.ack.eq(1)
+        yield bus.dat_r.eq(data)
+        yield
+        yield bus.ack.eq(0)
+        yield Settle()
+        return (yield mem_unit.load_valid), (yield mem_unit.load_rd), (yield mem_unit.load_res)
+
+    def MAIN():
+        # memory doesn't respond yet, loads are acked as soon as they are issued.
+        assert (yield from request(0, Funct3.W, 0x10, rd=5)) == 1
+        yield
+        assert (yield from request(0, Funct3.HU, 0x20, rd=6)) == 1
+        yield
+        # queue is full.
+        assert (yield from request(0, Funct3.W, 0x30, rd=7)) == 0
+        # stores wait for loads in flight.
+        assert (yield from request(1, Funct3.W, 0x30)) == 0
+        assert (yield mem_unit.load_valid) == 0
+        assert (yield from respond(0x11223344)) == (1, 5, 0x11223344)
+        # oldest load is written back, the next one is still in flight.
+        yield mem_unit.load_pop.eq(1)
+        yield
+        yield mem_unit.load_pop.eq(0)
+        yield Settle()
+        assert (yield mem_unit.load_valid) == 0
+        assert (yield from respond(0xaaaabbbb)) == (1, 6, 0xbbbb)
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_memory_slave():
+    from nmigen.hdl.rec import Record
+    from units.loadstore import bus_layout
+    from units.memslave import MemorySlave
+
+    bus = Record(bus_layout)
+    mem = MemorySlave(bus, init={0x10: 0x11223344}, nslots=2, latency=2)
+
+    sim = Simulator(mem)
+    sim.add_clock(1e-6)
+
+    # issues single request, returns (cycles until ack, 'dat_r').
+    def request(addr, we=0, data=0, sel=0b1111):
+        yield bus.cyc.eq(1)
+        yield bus.stb.eq(1)
+        yield bus.adr.eq(addr)
+        yield bus.we.eq(we)
+        yield bus.dat_w.eq(data)
+        yield bus.sel.eq(sel)
+        yield
+        yield bus.stb.eq(0)
+        cycles = 1
+        yield Settle()
+        while not (yield bus.ack):
+            yield
+            yield Settle()
+            cycles += 1
+        res = yield bus.dat_r
+        yield
+        yield bus.cyc.eq(0)
+        return cycles, res
+
+    def MAIN():
+        assert (yield from request(0x10)) == (2, 0x11223344)
+        assert (yield from request(0x10, sel=0b0011)) == (2, 0x3344)
+        # never written.
+        assert (yield from request(0x20)) == (2, 0)
+        yield from request(0x10, we=1, data=0xaabbccdd, sel=0b1100)
+        yield from request(0x20, we=1, data=0x55)
+        yield Settle()
+        assert (yield from mem.sim_words()) == {0x10: 0xaabb3344, 0x20: 0x55}
+        assert (yield mem.error) == 0
+        # no free slot left.
+        yield from request(0x30, we=1, data=0x66)
+        yield Settle()
+        assert (yield mem.error) == 1
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_memory_slave_bad_params():
+    from nmigen.hdl.rec import Record
+    from units.loadstore import bus_layout
+    from units.memslave import MemorySlave
+
+    with pytest.raises(ValueError):
+        MemorySlave(Record(bus_layout), nslots=0)
+    with pytest.raises(ValueError):
+        MemorySlave(Record(bus_layout), latency=0)
+    with pytest.raises(ValueError):
+        MemorySlave(Record(bus_layout), p=0)
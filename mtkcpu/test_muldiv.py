@@ -0,0 +1,104 @@
+import pytest
+import random
+
+from nmigen.back.pysim import Simulator, Settle
+from isa import Funct3
+from units.muldiv import MulDivUnit
+
+
+MASK = 0xffff_ffff
+
+def signed(x):
+    return x - (1 << 32) if x >> 31 else x
+
+# RV32M reference model, including division by zero and overflow cases.
+def muldiv_ref(funct3, a, b):
+    if funct3 == Funct3.MUL:
+        return (a * b) & MASK
+    if funct3 == Funct3.MULH:
+        return ((signed(a) * signed(b)) >> 32) & MASK
+    if funct3 == Funct3.MULHSU:
+        return ((signed(a) * b) >> 32) & MASK
+    if funct3 == Funct3.MULHU:
+        return (a * b) >> 32
+    if funct3 == Funct3.DIVU:
+        return a // b if b else MASK
+    if funct3 == Funct3.REMU:
+        return a % b if b else a
+    a, b = signed(a), signed(b)
+    if b == 0:
+        return MASK if funct3 == Funct3.DIV else a & MASK
+    q = abs(a) // abs(b) * (-1 if (a < 0) != (b < 0) else 1)
+    if funct3 == Funct3.DIV:
+        return q & MASK
+    return (a - q * b) & MASK
+
+
+@pytest.mark.parametrize("multiplier, divider_radix", [("single_cycle", 2), ("two_cycle", 4)])
+def test_muldiv(multiplier, divider_radix):
+    dut = MulDivUnit(multiplier=multiplier, divider_radix=divider_radix)
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+
+    corner = [0, 1, 3, MASK, 0x8000_0000, 0x7fff_ffff]
+    rng = random.Random(0)
+    funct3s = [Funct3.MUL, Funct3.MULH, Funct3.MULHSU, Funct3.MULHU, Funct3.DIV, Funct3.DIVU, Funct3.REM, Funct3.REMU]
+    cases = [(f, a, b) for f in funct3s for a in corner for b in corner]
+    cases += [(rng.choice(funct3s), rng.getrandbits(32), rng.getrandbits(32)) for _ in range(100)]
+
+    def MAIN():
+        for funct3, a, b in cases:
+            yield dut.funct3.eq(funct3)
+            yield dut.src1.eq(a)
+            yield dut.src2.eq(b)
+            yield dut.en.eq(1)
+            for _ in range(40):
+                yield Settle()
+                if (yield dut.ack):
+                    break
+                yield
+            assert (yield dut.res) == muldiv_ref(funct3, a, b), (funct3, hex(a), hex(b))
+            # 'en' is kept, so that next operation starts right after this one is consumed.
+            yield
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_muldiv_ready():
+    dut = MulDivUnit(divider_radix=4)
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        yield dut.funct3.eq(Funct3.DIVU)
+        yield dut.src1.eq(100)
+        yield dut.src2.eq(7)
+        yield dut.en.eq(1)
+        yield dut.ready.eq(0)
+        for _ in range(40):
+            yield Settle()
+            if (yield dut.ack):
+                break
+            yield
+        # result is held, until it gets consumed.
+        for _ in range(3):
+            yield
+            yield Settle()
+            assert (yield dut.ack) == 1
+            assert (yield dut.res) == 14
+        yield dut.ready.eq(1)
+        yield
+        yield
+        yield Settle()
+        assert (yield dut.ack) == 0
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_muldiv_bad_params():
+    with pytest.raises(ValueError):
+        MulDivUnit(multiplier="booth")
+    with pytest.raises(ValueError):
+        MulDivUnit(divider_radix=8)
@@ -0,0 +1,82 @@
+import pytest
+
+from nmigen.back.pysim import Simulator, Settle
+
+from test_decoder import encode, BACK
+from units.rvc import CompressedExpander
+from cpu import MtkCpu
+
+
+# compressed instruction, it's 32-bit equivalent. Preceding instructions are 32-bit ones, so that
+# compressed one ends up in lower half of last word.
+RVC_TABLE = [
+    ("c.addi4spn x8, x2, 1020", "addi x8, x2, 1020"),
+    ("c.lw x9, 124(x15)",       "lw x9, 124(x15)"),
+    ("c.sw x9, 64(x15)",        "sw x9, 64(x15)"),
+    ("c.nop",                   "addi x0, x0, 0"),
+    ("c.addi x1, -32",          "addi x1, x1, -32"),
+    (BACK + "c.jal l",          BACK + "jal x1, l"),
+    ("c.li x31, 31",            "addi x31, x0, 31"),
+    ("c.addi16sp x2, -512",     "addi x2, x2, -512"),
+    ("c.lui x3, 0x20",          "lui x3, 0xfffe0"),
+    ("c.srli x8, 31",           "srli x8, x8, 31"),
+    ("c.srai x9, 1",            "srai x9, x9, 1"),
+    ("c.andi x10, -1",          "andi x10, x10, -1"),
+    ("c.sub x15, x8",           "sub x15, x15, x8"),
+    ("c.xor x15, x8",           "xor x15, x15, x8"),
+    ("c.or x15, x8",            "or x15, x15, x8"),
+    ("c.and x15, x8",           "and x15, x15, x8"),
+    (BACK + "c.j l",            BACK + "jal x0, l"),
+    (BACK + "c.beqz x8, l",     BACK + "beq x8, x0, l"),
+    (BACK + "c.bnez x15, l",    BACK + "bne x15, x0, l"),
+    ("c.slli x31, 31",          "slli x31, x31, 31"),
+    ("c.lwsp x1, 252(x2)",      "lw x1, 252(x2)"),
+    ("c.jr x5",                 "jalr x0, x5, 0"),
+    ("c.mv x1, x31",            "add x1, x0, x31"),
+    ("c.jalr x7",               "jalr x1, x7, 0"),
+    ("c.add x1, x31",           "add x1, x1, x31"),
+    ("c.swsp x31, 252(x2)",     "sw x31, 252(x2)"),
+]
+
+
+def expand(instr):
+    dut = CompressedExpander()
+    sim = Simulator(dut)
+    res = []
+
+    def MAIN():
+        yield dut.instr.eq(instr)
+        yield Settle()
+        res.append(((yield dut.res), (yield dut.illegal)))
+
+    sim.add_process(MAIN)
+    sim.run()
+    return res[0]
+
+
+@pytest.mark.parametrize("compressed, expanded", RVC_TABLE)
+def test_rvc_expand(compressed, expanded):
+    assert expand(encode(compressed) & 0xFFFF) == (encode(expanded), 0)
+
+
+@pytest.mark.parametrize("instr", [
+    0x0000, # all zeros
+    0x0004, # 'c.addi4spn' with zero immediate
+    0x6000, # 'c.flw'
+    0x6081, # 'c.lui' with zero immediate
+    0x6101, # 'c.addi16sp' with zero immediate
+    0x9c01, # 'c.subw'
+    0x1086, # 'c.slli' with shamt[5] set
+    0x4002, # 'c.lwsp' to x0
+    0x8002, # 'c.jr x0'
+    0x0013, # not a compressed one
+])
+def test_rvc_illegal(instr):
+    assert expand(instr)[1] == 1
+
+
+def test_rvc_bad_params():
+    with pytest.raises(ValueError):
+        MtkCpu(with_rvc=True, pipelined=True)
+    with pytest.raises(ValueError):
+        MtkCpu(with_rvc=True, prefetch_depth=2)
@@ -0,0 +1,67 @@
+import pytest
+import random
+
+from nmigen import Module, Signal
+from nmigen.back.pysim import Simulator, Settle
+from isa import Funct3
+from units.shifter import ShifterUnit
+
+
+MASK = 0xffff_ffff
+
+def shift_ref(funct3, arithmetic, a, shift):
+    if funct3 == Funct3.SLL:
+        return (a << shift) & MASK
+    if arithmetic and a >> 31:
+        return ((a - (1 << 32)) >> shift) & MASK
+    return a >> shift
+
+
+# extra cycles of shift by 0, 1, 4, 5 and 31.
+@pytest.mark.parametrize("implementation, bits_per_cycle, latency", [
+    ("barrel",      1, [0, 0, 0, 0, 0]),
+    ("pipelined",   1, [1, 1, 1, 1, 1]),
+    ("iterative",   1, [0, 0, 3, 4, 30]),
+    ("iterative",   4, [0, 0, 0, 1, 7]),
+])
+def test_shifter(implementation, bits_per_cycle, latency):
+    dut = ShifterUnit(implementation=implementation, bits_per_cycle=bits_per_cycle)
+    # barrel shifter has no 'sync' domain on it's own.
+    m = Module()
+    m.submodules.dut = dut
+    cycle = Signal()
+    m.d.sync += cycle.eq(~cycle)
+    sim = Simulator(m)
+    sim.add_clock(1e-6)
+
+    rng = random.Random(0)
+    cases = [(Funct3.SLL, 0, 0x8000_0001, s) for s in [0, 1, 4, 5, 31]]
+    cases += [(rng.choice([Funct3.SLL, Funct3.SRL]), rng.getrandbits(1), rng.getrandbits(32), rng.randrange(32)) for _ in range(100)]
+    cycles = []
+
+    def MAIN():
+        for funct3, arithmetic, a, shift in cases:
+            yield dut.funct3.eq(funct3)
+            yield dut.arithmetic.eq(arithmetic)
+            yield dut.src1.eq(a)
+            yield dut.shift.eq(shift)
+            yield dut.en.eq(1)
+            for i in range(40):
+                yield Settle()
+                if (yield dut.ack):
+                    break
+                yield
+            cycles.append(i)
+            assert (yield dut.res) == shift_ref(funct3, arithmetic, a, shift), (funct3, arithmetic, hex(a), shift)
+            yield
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+    assert cycles[:5] == latency
+
+
+def test_shifter_bad_params():
+    with pytest.raises(ValueError):
+        ShifterUnit(implementation="funnel")
+    with pytest.raises(ValueError):
+        ShifterUnit(implementation="iterative", bits_per_cycle=2)
@@ -0,0 +1,130 @@
+import pytest
+
+from io import StringIO
+from itertools import count
+
+from nmigen.back.pysim import Simulator, Settle
+from asm_dump import dump_asm
+from common import START_ADDR
+from testbench import SimHarness
+from units.tcm import TightlyCoupledMemory, read_hex
+
+
+def test_tcm_read_hex(tmp_path):
+    image = tmp_path / "image.hex"
+    image.write_text("deadbeef // first word\n00000013\n@10 cafebabe\n")
+    assert read_hex(str(image), base=0x1000) == {
+        0x1000: 0xdeadbeef,
+        0x1004: 0x13,
+        0x1040: 0xcafebabe,
+    }
+
+
+def test_tcm_access():
+    tcm = TightlyCoupledMemory(base=0x1000, size=0x100, image={0x1000: 0x13, 0x1004: 0xdeadbeef, 0x0: 0x1})
+    ibus = tcm.port(writable=False)
+    dbus = tcm.port(writable=True)
+
+    sim = Simulator(tcm)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        # both ports are accepted in the same cycle, and acked in the next one.
+        yield ibus.adr.eq(0x1000)
+        yield dbus.adr.eq(0x1004)
+        yield dbus.dat_w.eq(0xaaaa)
+        yield dbus.sel.eq(0b0011)
+        yield dbus.we.eq(1)
+        for bus in [ibus, dbus]:
+            yield bus.cyc.eq(1)
+            yield bus.stb.eq(1)
+        yield Settle()
+        assert (yield ibus.stall) == 0
+        assert (yield dbus.stall) == 0
+        yield
+        yield ibus.adr.eq(0x1004)
+        yield dbus.stb.eq(0)
+        yield Settle()
+        assert (yield ibus.ack) == 1
+        assert (yield dbus.ack) == 1
+        assert (yield ibus.dat_r) == 0x13
+        yield
+        yield ibus.stb.eq(0)
+        yield Settle()
+        # only bytes selected with 'sel' are written.
+        assert (yield ibus.dat_r) == 0xdeadaaaa
+        assert (yield from tcm.sim_words()) == {0x1000: 0x13, 0x1004: 0xdeadaaaa}
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+def test_tcm_misaligned():
+    tcm = TightlyCoupledMemory(base=0x1000, size=0x100, image={0x1000: 0x11223344})
+    dbus = tcm.port(writable=True)
+
+    sim = Simulator(tcm)
+    sim.add_clock(1e-6)
+
+    def MAIN():
+        # byte store to word-aligned address goes to the lowest byte.
+        yield dbus.adr.eq(0x1000)
+        yield dbus.dat_w.eq(0xaa)
+        yield dbus.sel.eq(0b0001)
+        yield dbus.we.eq(1)
+        yield dbus.cyc.eq(1)
+        yield dbus.stb.eq(1)
+        yield
+        # the one to address, that is not word-aligned, is rejected.
+        yield dbus.adr.eq(0x1001)
+        yield dbus.dat_w.eq(0xbb)
+        yield
+        yield dbus.we.eq(0)
+        yield Settle()
+        assert (yield dbus.ack) == 1
+        assert (yield tcm.error) == 1
+        yield
+        yield dbus.stb.eq(0)
+        yield Settle()
+        # and so is load from it.
+        assert (yield dbus.ack) == 1
+        assert (yield dbus.dat_r) == 0
+        assert (yield from tcm.sim_words()) == {0x1000: 0x112233aa}
+
+    sim.add_sync_process(MAIN)
+    sim.run()
+
+
+# sub-word stores and loads on TCM address (code is in TCM as well) - word-aligned ones use byte enables,
+# the others are rejected, instead of hitting bytes of the word below.
+def test_tcm_sub_word():
+    def program(source):
+        code = dump_asm(StringIO(".section code\n" + source), verbose=False)
+        return dict(zip(count(START_ADDR, 4), code))
+
+    harness = SimHarness(dict(tcm_size=0x1000))
+    data = START_ADDR + 0x800
+    res = harness.run(program("""
+        sw x2, 0(x1)
+        sb x3, 0(x1)
+        sh x3, 4(x1)
+        lbu x4, 0(x1)
+        lhu x5, 4(x1)
+        lw x6, 0(x1)
+        add x7, x4, x5
+        add x10, x6, x7
+    """), reg_init=[0, data, 0x11223344, 0xaabb], watch_reg=10, timeout=200)
+    assert (res.written, res.val, res.mem_error) == (True, 0x112233bb + 0xbb + 0xaabb, None)
+    assert (res.mem[data], res.mem[data + 4]) == (0x112233bb, 0xaabb)
+
+    res = harness.run(program("""
+        sw x2, 0(x1)
+        sb x3, 1(x1)
+        lw x10, 0(x1)
+    """), reg_init=[0, data, 0x11223344, 0xaabb], watch_reg=10, timeout=200)
+    assert (res.written, res.val, res.mem_error) == (True, 0x11223344, "tcm")
+
+
+def test_tcm_bad_size():
+    with pytest.raises(ValueError):
+        TightlyCoupledMemory(size=0x102)
@@ -0,0 +1,98 @@
+from io import StringIO
+from itertools import count
+
+import pytest
+
+from asm_dump import dump_asm
+from common import START_ADDR
+from cpu import Error
+from cxxsim import find_compiler
+from testbench import SimHarness
+
+
+def program(source, mem_init={}):
+    code = dump_asm(StringIO(".section code\n" + source), verbose=False)
+    return { **dict(zip(count(START_ADDR, 4), code)), **mem_init }
+
+
+def test_harness_reuse():
+    harness = SimHarness(dict(with_dcache=True))
+    store = program("""
+        sw x2, 0(x1)
+        addi x10, x2, 1
+    """)
+    load = program("""
+        lw x10, 0(x1)
+    """, mem_init={0x100: 7})
+
+    res = harness.run(store, reg_init=[0, 0x100, 5], watch_reg=10, timeout=200)
+    assert (res.written, res.val) == (True, 6)
+    assert res.mem[0x100] == 5
+    # neither registers, memory nor data cache content is left from previous run.
+    res = harness.run(load, reg_init=[0, 0x100], watch_reg=10, timeout=200)
+    assert (res.written, res.val) == (True, 7)
+    res = harness.run(store, reg_init=[0, 0x100, 1], watch_reg=10, timeout=200)
+    assert (res.written, res.val) == (True, 2)
+
+
+def test_harness_grows():
+    harness = SimHarness(nwords=1)
+    res = harness.run(program("addi x1, x0, 1\n" * 3 + "addi x10, x0, 2\n"), watch_reg=10, timeout=200)
+    assert harness.nslots >= 4
+    assert (res.written, res.val) == (True, 2)
+
+
+# data fetched after taken jump (e.g. by pipelined core) is not an error, unless it gets executed.
+@pytest.mark.parametrize("cpu_kwargs", [{}, dict(pipelined=True), dict(pipelined=True, branch_predictor="gshare")])
+def test_wrong_path_illegal(cpu_kwargs):
+    harness = SimHarness(cpu_kwargs)
+    res = harness.run(program("""
+        jal x0, skip
+        dd 0x00000001
+        dd 0xffffffff
+    skip:
+        addi x10, x0, 2
+    end:
+        jal x0, end
+    """), watch_reg=10, timeout=200)
+    assert (res.written, res.val, res.err) == (True, 2, Error.OK)
+    res = harness.run(program("""
+        dd 0xffffffff
+        addi x10, x0, 2
+    """), watch_reg=10, timeout=200)
+    assert res.err == Error.OP_CODE
+
+
+# load into x0 is performed, but x0 must stay zero - also when it's completed later, by non-blocking load queue.
+@pytest.mark.parametrize("cpu_kwargs", [{}, dict(pending_loads=2), dict(prefetch_depth=2, pending_loads=2)])
+def test_load_x0(cpu_kwargs):
+    harness = SimHarness(cpu_kwargs)
+    res = harness.run(program("""
+        lw x0, 0(x1)
+        lw x2, 4(x1)
+        add x10, x0, x2
+    """, mem_init={0x100: 0x1bd5a, 0x104: 5}), reg_init=[0, 0x100], watch_reg=10, timeout=200)
+    assert (res.written, res.val) == (True, 5)
+
+
+@pytest.mark.skipif(find_compiler() is None, reason="no C++ compiler")
+def test_cxx_backend_matches_pysim():
+    code = program("""
+        addi x3, x0, 5
+    loop:
+        lw x4, 0(x1)
+        add x4, x4, x3
+        sw x4, 0(x1)
+        sb x3, 4(x1)
+        addi x3, x3, -1
+        bne x3, x0, loop
+        lw x10, 4(x1)
+    """, mem_init={0x100: 1, 0x104: 0xAABBCCDD})
+    results = []
+    for backend in ["pysim", "cxx"]:
+        res = SimHarness(dict(with_dcache=True), backend=backend).run(code, reg_init=[0, 0x100], watch_reg=10,
+            timeout=2000)
+        results.append((res.written, res.val, res.cycle, res.mem, res.counters))
+    assert results[0][:2] == (True, 0xAABBCC01)
+    assert results[0][3][0x100] == 16
+    assert results[0] == results[1]
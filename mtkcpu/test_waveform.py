@@ -0,0 +1,55 @@
+import pytest
+
+from nmigen import Signal
+from nmigen.hdl.ast import SignalDict
+
+from test_cpu import reg_test
+from test_testbench import program
+from waveform import WaveformCapture
+
+
+def timestamps(vcd_file):
+    with open(vcd_file) as f:
+        return [int(line[1:]) for line in f if line.startswith("#")]
+
+
+def test_ring_buffer(tmp_path):
+    a, b = Signal(4, name="a"), Signal(name="b")
+    capture = WaveformCapture(str(tmp_path / "w.vcd"), signals=["u.a"], cycles=(2, 100), last=3)
+    assert capture.start(SignalDict([(a, "u.a"), (b, "u.b")])) == [a]
+    for cycle in range(1, 11):
+        capture.sample(cycle, 0, [cycle % 16])
+    capture.write()
+    assert timestamps(capture.vcd_file) == [8, 9, 10, 11]
+    with open(capture.vcd_file) as f:
+        content = f.read()
+    # value from the first cycle of window is the initial one.
+    assert "$dumpvars\nb1000 " in content
+
+
+def test_capture_triggers(tmp_path):
+    code = program("addi x1, x0, 1\n" * 8 + "addi x10, x0, 2\n")
+    capture = WaveformCapture(str(tmp_path / "w.vcd"), signals=["cpu.pc"], start_pc=0x1008, stop_pc=0x1010)
+    reg_test("triggers", 100, 10, 2, None, [], code, capture=capture)
+    with open(capture.vcd_file) as f:
+        values = [line.split()[0] for line in f if line.startswith("b")]
+    assert (values[0], values[-1]) == (f"b{0x1008:b}", f"b{0x1010:b}")
+
+
+def test_capture_on_failure(tmp_path):
+    code = program("addi x10, x0, 2\n")
+    capture = WaveformCapture(str(tmp_path / "w.vcd"), last=4, on_failure=True)
+    reg_test("pass", 10, 10, 2, None, [], code, capture=capture)
+    assert not (tmp_path / "w.vcd").exists()
+    with pytest.raises(AssertionError):
+        reg_test("fail", 10, 10, 3, None, [], code, capture=capture)
+    assert len(timestamps(capture.vcd_file)) <= 4 + 1
+
+
+def test_capture_bad_params():
+    with pytest.raises(ValueError):
+        WaveformCapture("w.vcd", last=0)
+    with pytest.raises(ValueError):
+        WaveformCapture("w.vcd", cycles=(10, 5))
+    with pytest.raises(ValueError):
+        WaveformCapture("w.vcd", signals=["no_such_signal"]).start(SignalDict([(Signal(name="a"), "a")]))
@@ -0,0 +1,201 @@
+from nmigen import *
+from nmigen.back.pysim import Simulator, Delay
+
+from cpu import MtkCpu, Error
+from cxxsim import CxxSimulator
+from waveform import signal_names
+from units.memslave import MemorySlave
+
+
+# Words of memory slots, left free for stores of the test (see 'MemorySlave').
+STORE_SLOTS = 16
+
+
+# Simulation backends - each one simulates 'design' (with clock of 1us period), by running 'process'
+# (generator function, as for 'Simulator.add_process') from reset, until it returns.
+class PysimBackend:
+    def __init__(self, design, process):
+        self.sim = Simulator(design)
+        self.sim.add_clock(1e-6)
+        # the only process, restarted by 'sim.reset()'.
+        self.sim.add_process(process)
+
+    def run(self):
+        self.sim.reset()
+        self.sim.run()
+
+
+# Design is compiled to C++ (see 'cxxsim.py') - much faster, when it comes to long runs.
+class CxxBackend:
+    def __init__(self, design, process):
+        self.sim = CxxSimulator(design, period=1e-6)
+        self.process = process
+
+    def run(self):
+        self.sim.run(self.process)
+
+
+BACKENDS = {
+    "pysim": PysimBackend,
+    "cxx": CxxBackend,
+}
+
+
+# Result of single 'SimHarness.run'.
+# * 'written' - whether watched register got written, 'val' is the first value written and 'cycle' - cycle of that write,
+# * 'mem' - memory state (dict address -> 4 byte word), as seen by CPU (with data cache and store buffer content),
+# * 'counters' - values of CPU performance counters, sampled at the end of simulation,
+# * 'mem_error' - name of bus, which memory model flagged error (see 'MemorySlave'), "tcm" if tightly-coupled memory
+#   did (see 'TightlyCoupledMemory'), or None,
+# * 'err' - the first error reported by CPU ('MtkCpu.err'), 'Error.OK' if none.
+class RunResult:
+    def __init__(self):
+        self.written = False
+        self.val = None
+        self.cycle = None
+        self.mem = {}
+        self.counters = {}
+        self.mem_error = None
+        self.err = Error.OK
+
+
+# CPU with memory model on each of it's buses (see 'MtkCpu.buses'), elaborated and compiled for simulation once,
+# then reused by many tests. Each 'run' resets simulation and loads registers and memory content at runtime,
+# by writing simulated signals before the first clock edge - so that tests differ only in state, not in design.
+#
+# Checks are done in RTL, so that no Python code runs in per-cycle loop: the first write to watched register
+# is latched (with cycle of it), and testbench wakes up every 'CHECK_INTERVAL' cycles only, to see whether
+# simulation can be stopped. Memory models are rebuilt (with whole design) only when content of test doesn't fit.
+# Waveform capture is opt-in (see 'WaveformCapture'), only then testbench wakes up in each cycle.
+#
+# 'mem_timing' maps bus name to 'MemorySlave' timing parameters ('p' and 'p_stall', or fixed 'latency'),
+# 'backend' is name of simulation backend (see 'BACKENDS').
+class SimHarness:
+    CHECK_INTERVAL = 16
+
+    def __init__(self, cpu_kwargs={}, mem_timing={}, nwords=64, backend="pysim"):
+        if "tcm_init" in cpu_kwargs or "reg_init" in cpu_kwargs:
+            raise ValueError("Harness loads registers and TCM at runtime, don't pass 'reg_init' nor 'tcm_init'!")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown simulation backend {backend}, must be one of {', '.join(BACKENDS)}!")
+        self.cpu_kwargs = cpu_kwargs
+        self.mem_timing = mem_timing
+        self.backend = backend
+        self.build(nwords)
+
+    def build(self, nwords):
+        self.nslots = nwords + STORE_SLOTS
+        cpu = self.cpu = MtkCpu(**self.cpu_kwargs)
+
+        m = Module()
+        # CPU is elaborated here, as 'buses' and others are known only then.
+        m.submodules.cpu = Fragment.get(cpu, platform=None)
+        self.mems = {}
+        for i, (bus_name, bus) in enumerate(cpu.buses.items(), 1):
+            self.mems[bus_name] = m.submodules[f"mem_{bus_name}"] = MemorySlave(bus, nslots=self.nslots, seed=i,
+                **self.mem_timing.get(bus_name, {}))
+
+        # the first write to 'watch_reg' is latched (if 'watch_en' is set).
+        self.watch_en = Signal(name="watch_en")
+        self.watch_reg = Signal(5, name="watch_reg")
+        self.cycle = Signal(32, name="cycle")
+        self.written = Signal(name="written")
+        self.written_val = Signal(32, name="written_val")
+        self.written_cycle = Signal(32, name="written_cycle")
+        # so is the first error.
+        self.error = Signal(Error, name="error")
+        port = cpu.reg_write_port
+        m.d.sync += self.cycle.eq(self.cycle + 1)
+        with m.If((self.error == Error.OK) & (cpu.err != Error.OK)):
+            m.d.sync += self.error.eq(cpu.err)
+        with m.If(self.watch_en & port.en & (port.addr == self.watch_reg) & ~self.written):
+            m.d.sync += [
+                self.written.eq(1),
+                self.written_val.eq(port.data),
+                self.written_cycle.eq(self.cycle),
+            ]
+
+        # elaborated once, so that the same signals are simulated and named for waveform capture.
+        self.design = Fragment.get(m, platform=None)
+        self.names = None
+        # the only process - runs test set up by 'run'.
+        self.sim = BACKENDS[self.backend](self.design, self.process)
+
+    def process(self):
+        test = self.test
+        res = test["result"]
+        cpu = self.cpu
+
+        # state of test, loaded before the first clock edge.
+        yield from cpu.sim_load_regs(test["reg_init"])
+        for mem in self.mems.values():
+            yield from mem.sim_load(test["mem_dict"])
+        if cpu.tcm is not None:
+            yield from cpu.tcm.sim_load(test["mem_dict"])
+        if test["watch_reg"] is not None:
+            yield self.watch_en.eq(1)
+            yield self.watch_reg.eq(test["watch_reg"])
+
+        capture = test["capture"]
+        if capture is None:
+            for _ in range(0, test["timeout"], self.CHECK_INTERVAL):
+                yield Delay(self.CHECK_INTERVAL * 1e-6)
+                if (yield self.written):
+                    break
+        else:
+            # stops in the same cycle as without capture.
+            signals = capture.start(self.names)
+            for cycle in range(1, -(-test["timeout"] // self.CHECK_INTERVAL) * self.CHECK_INTERVAL + 1):
+                yield Delay(1e-6)
+                values = []
+                for signal in signals:
+                    values.append((yield signal))
+                capture.sample(cycle, (yield cpu.pc), values)
+                if cycle % self.CHECK_INTERVAL == 0 and (yield self.written):
+                    break
+
+        res.written = bool((yield self.written))
+        if res.written:
+            res.val = yield self.written_val
+            res.cycle = yield self.written_cycle
+        for k, v in cpu.counters.items():
+            res.counters[k] = yield v
+        res.err = Error((yield self.error))
+        for bus_name, mem in self.mems.items():
+            if (yield mem.error):
+                res.mem_error = bus_name
+        if cpu.tcm is not None and (yield cpu.tcm.error):
+            res.mem_error = "tcm"
+
+        mem_dict = test["mem_dict"]
+        dirty_mem = {}
+        # stores, that reached memory (on any bus).
+        for mem in self.mems.values():
+            words = yield from mem.sim_words()
+            dirty_mem.update((k, v) for k, v in words.items() if mem_dict.get(k) != v)
+        # stores, that are still in data cache, didn't reach memory yet.
+        if cpu.dcache is not None:
+            dirty_mem.update((yield from cpu.dcache.sim_dirty_words()))
+        # nor stores to tightly-coupled memory.
+        if cpu.tcm is not None:
+            dirty_mem.update((yield from cpu.tcm.sim_words()))
+        res.mem = { **mem_dict, **dirty_mem }
+        # nor stores waiting in store buffer (newer than any of above).
+        for mem_addr, data, sel in (yield from cpu.mem_unit.sim_buffered_stores()):
+            mask = sum(0xFF << (8 * i) for i in range(4) if (sel >> i) & 1)
+            res.mem[mem_addr] = (res.mem.get(mem_addr, 0) & ~mask) | (data & mask)
+
+    # Runs CPU for up to 'timeout' cycles, with registers initialized with 'reg_init' and memory with 'mem_dict'
+    # (dict address -> 4 byte word, also loaded into TCM, if present), returns 'RunResult'.
+    # Simulation stops earlier (at most 'CHECK_INTERVAL' cycles later), if 'watch_reg' gets written.
+    # Each cycle is sampled by 'capture' ('WaveformCapture'), if given - it's up to caller to 'write' it.
+    def run(self, mem_dict, reg_init=[], watch_reg=None, timeout=1000, capture=None):
+        if len(mem_dict) > self.nslots - STORE_SLOTS:
+            self.build(max(len(mem_dict), 2 * (self.nslots - STORE_SLOTS)))
+        if capture is not None and self.names is None:
+            self.names = signal_names(self.design)
+        res = RunResult()
+        self.test = dict(mem_dict=mem_dict, reg_init=reg_init, watch_reg=watch_reg, timeout=timeout, capture=capture,
+            result=res)
+        self.sim.run()
+        return res
@@ -18,10 +18,11 @@ BRANCH_TESTS = [
         "source": 
         """
         .section code
-            jalr x10, x0, 8
+            jalr x10, x1, 8
             addi x5, x0, 10
             addi x5, x0, 20
         """,
+        "reg_init": [0, START_ADDR],
         "out_reg": 5,
         "out_val": 20,
         "timeout": 10,
@@ -32,11 +33,12 @@ BRANCH_TESTS = [
         "source": 
         """
         .section code
-            jalr x10, x0, 12
+            jalr x10, x1, 12
             addi x5, x0, 10
             addi x5, x0, 20
-            jalr x10, x0, -4
+            jalr x10, x1, 8
         """,
+        "reg_init": [0, START_ADDR],
         "out_reg": 5,
         "out_val": 20,
         "timeout": 20,
@@ -279,4 +281,43 @@ BRANCH_TESTS = [
         "out_val": 111,
         "timeout": 10,
     },
+
+    {
+        "name": "backward 'bne' loop",
+        "source": 
+        """
+        .section code
+                addi x1, x0, 5
+                addi x3, x0, 0
+            loop:
+                addi x3, x3, 2
+                addi x1, x1, -1
+                bne x1, x0, loop
+                add x4, x3, x3
+        """,
+        "out_reg": 4,
+        "out_val": 20,
+        "timeout": 300,
+    },
+
+    {
+        "name": "call and return 'jalr' loop",
+        "source":
+        """
+        .section code
+                addi x2, x0, 3
+            loop:
+                jalr x1, x5, 20 ; call 'func'
+                addi x2, x2, -1
+                bne x2, x0, loop
+                add x7, x6, x0
+            func:
+                addi x6, x6, 1
+                jalr x0, x1, 0 ; return
+        """,
+        "reg_init": [0, 0, 0, 0, 0, START_ADDR],
+        "out_reg": 7,
+        "out_val": 3,
+        "timeout": 300,
+    },
 ]
\ No newline at end of file
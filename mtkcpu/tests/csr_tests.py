@@ -0,0 +1,159 @@
+from isa import CSRIndex
+from units.csr import HPM_EVENTS
+
+# CSR tests, counters start from zero. Only values independent of memory latency are checked.
+CSR_TESTS = [
+
+    {
+        "name": "simple 'instret'",
+        "source":
+        f"""
+        .section code
+            addi x1, x0, 1
+            addi x2, x0, 2
+            csrrs x10, {CSRIndex.INSTRET.value}, x0
+        """,
+        "out_reg": 10,
+        "out_val": 2,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'rdinstret' pseudo-instruction",
+        "source":
+        """
+        .section code
+            addi x1, x0, 1
+            addi x2, x0, 2
+            addi x3, x0, 3
+            rdinstret x10
+        """,
+        "out_reg": 10,
+        "out_val": 3,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'lui' + 'addi' counts as two in 'instret' (fused with --fusion)",
+        "source":
+        """
+        .section code
+            addi x3, x0, 3
+            lui x1, 0x12
+            addi x1, x1, 1
+            addi x2, x0, 2
+            rdinstret x10
+        """,
+        "out_reg": 10,
+        "out_val": 4,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "write 'minstret'",
+        "source":
+        f"""
+        .section code
+            addi x1, x0, 100
+            csrrw x0, {CSRIndex.MINSTRET.value}, x1
+            addi x2, x0, 2
+            csrrs x10, {CSRIndex.INSTRET.value}, x0
+        """,
+        "out_reg": 10,
+        "out_val": 101,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'mcountinhibit' stops 'instret'",
+        "source":
+        f"""
+        .section code
+            csrrwi x0, {CSRIndex.MCOUNTINHIBIT.value}, 4
+            addi x1, x0, 1
+            addi x2, x0, 2
+            csrrs x10, {CSRIndex.MINSTRET.value}, x0
+        """,
+        "out_reg": 10,
+        "out_val": 1,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'csrrw' returns old value",
+        "source":
+        f"""
+        .section code
+            addi x1, x0, 5
+            addi x2, x0, 7
+            csrrw x0, {CSRIndex.MHPMEVENT3.value}, x1
+            csrrw x10, {CSRIndex.MHPMEVENT3.value}, x2
+        """,
+        "out_reg": 10,
+        "out_val": 5,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'csrrsi' and 'csrrci'",
+        "source":
+        f"""
+        .section code
+            csrrsi x0, {CSRIndex.MHPMEVENT3.value}, 7
+            csrrci x0, {CSRIndex.MHPMEVENT3.value}, 5
+            csrrs x10, {CSRIndex.MHPMEVENT3.value}, x0
+        """,
+        "out_reg": 10,
+        "out_val": 2,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'hpmcounter3' counts 'csr_busy' cycles",
+        "source":
+        f"""
+        .section code
+            addi x1, x0, {HPM_EVENTS.index("csr_busy") + 1}
+            csrrw x0, {CSRIndex.MHPMEVENT3.value}, x1
+            csrrs x0, {CSRIndex.CYCLE.value}, x0
+            addi x2, x0, 2
+            csrrs x0, {CSRIndex.CYCLE.value}, x0
+            csrrs x10, {CSRIndex.HPMCOUNTER3.value}, x0
+        """,
+        "out_reg": 10,
+        "out_val": 2,
+        "timeout": 40,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "not implemented 'mhpmcounter31' reads zero",
+        "source":
+        f"""
+        .section code
+            addi x1, x0, 1
+            csrrw x0, {CSRIndex.MHPMCOUNTER3.value + 28}, x1
+            csrrs x10, {CSRIndex.MHPMCOUNTER3.value + 28}, x0
+        """,
+        "out_reg": 10,
+        "out_val": 0,
+        "timeout": 30,
+        "mem_init": {},
+        "reg_init": [0 for _ in range(32)],
+    },
+]
@@ -7,6 +7,7 @@
 
 
 from bitstring import Bits
+from common import START_ADDR
 
 MEM_TESTS = [
     
@@ -166,4 +167,98 @@ MEM_TESTS = [
         "mem_init": {0xbb: 0xdeadbeef},
         "mem_out": {0xbb: 0xaaaa},
     },
+
+    {
+        "name": "load-use 'lw'",
+        "source": 
+        """
+        .section code
+            sw x5, 0xbb(x0)
+            lw x6, 0xbb(x0)
+            add x7, x6, x5
+        """,
+        "timeout": 100,
+        "reg_init": [i for i in range(32)],
+        "out_reg": 7,
+        "out_val": 10,
+    },
+
+    {
+        "name": "self-modifying code 'fence.i'",
+        "source": 
+        """
+        .section code
+                addi x2, x0, 2
+            loop:
+                addi x5, x0, 111
+                addi x2, x2, -1
+                sw x1, 0(x3)
+                dd 0x0000100f ; fence.i
+                bne x2, x0, loop
+                add x6, x5, x0
+        """,
+        "timeout": 400,
+        # x1 - 'addi x5, x0, 222' encoding, x3 - address of instruction to be replaced.
+        "reg_init": [0, 0x0de00293, 0, START_ADDR + 4],
+        "out_reg": 6,
+        "out_val": 222,
+    },
+
+    {
+        "name": "conflicting 'sw' and 'lw'",
+        "source":
+        """
+        .section code
+            sw x1, 0x100(x0)
+            sw x2, 0x10c(x0)
+            sw x3, 0x300(x0)
+            lw x4, 0x10c(x0)
+        """,
+        "timeout": 250,
+        # with default data cache geometry 0x100 and 0x300 map to the same line, thus dirty line gets evicted.
+        "reg_init": [0, 0x11, 0x22, 0x33],
+        "out_reg": 4,
+        "out_val": 0x22,
+        "mem_out": {0x100: 0x11, 0x10c: 0x22, 0x300: 0x33},
+    },
+
+    {
+        "name": "back-to-back 'sw' and 'lw'",
+        "source":
+        """
+        .section code
+            sw x1, 0x200(x0)
+            sw x2, 0x204(x0)
+            lw x5, 0x200(x0)
+            sw x3, 0x208(x0)
+            lw x6, 0x204(x0)
+            lw x7, 0x208(x0)
+            add x8, x5, x6
+            add x9, x8, x7
+        """,
+        "timeout": 300,
+        "reg_init": [0, 0x11, 0x22, 0x33],
+        "out_reg": 9,
+        "out_val": 0x66,
+        "mem_out": {0x200: 0x11, 0x204: 0x22, 0x208: 0x33},
+    },
+
+    {
+        "name": "combined 'sh' and 'sb', then 'lhu'",
+        "source":
+        """
+        .section code
+            sw x1, 0x300(x0)
+            sh x2, 0x304(x0)
+            sb x3, 0x304(x0)
+            lhu x4, 0x304(x0)
+            lw x5, 0x300(x0)
+            add x6, x4, x5
+        """,
+        "timeout": 300,
+        "reg_init": [0, 0x11223344, 0x5566, 0x77],
+        "out_reg": 6,
+        "out_val": 0x112288bb,
+        "mem_out": {0x300: 0x11223344, 0x304: 0x5577},
+    },
 ]
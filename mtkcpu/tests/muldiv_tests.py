@@ -0,0 +1,156 @@
+from bitstring import Bits
+
+# RV32M tests, operands are set via 'reg_init': x1 = -7, x2 = 3, x3 = INT_MIN, x4 = -1, x5 = 0, x6 = 0x12345678.
+MULDIV_REG_INIT = [0, Bits(int=-7, length=32).uint, 3, 0x8000_0000, 0xffff_ffff, 0, 0x1234_5678] + [0 for _ in range(25)]
+
+MULDIV_TESTS = [
+
+    {
+        "name": "simple 'mul'",
+        "source":
+        """
+        .section code
+            mul x10, x1, x2
+        """,
+        "out_reg": 10,
+        "out_val": Bits(int=-21, length=32).uint,
+        "timeout": 30,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "simple 'mulh'",
+        "source":
+        """
+        .section code
+            mulh x10, x3, x6
+        """,
+        "out_reg": 10,
+        "out_val": Bits(int=(-2**31 * 0x1234_5678) >> 32, length=32).uint,
+        "timeout": 30,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "simple 'mulhsu'",
+        "source":
+        """
+        .section code
+            mulhsu x10, x1, x4
+        """,
+        "out_reg": 10,
+        "out_val": Bits(int=(-7 * 0xffff_ffff) >> 32, length=32).uint,
+        "timeout": 30,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "simple 'mulhu'",
+        "source":
+        """
+        .section code
+            mulhu x10, x4, x6
+        """,
+        "out_reg": 10,
+        "out_val": (0xffff_ffff * 0x1234_5678) >> 32,
+        "timeout": 30,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "simple 'div'",
+        "source":
+        """
+        .section code
+            div x10, x1, x2
+        """,
+        "out_reg": 10,
+        "out_val": Bits(int=-2, length=32).uint,
+        "timeout": 100,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "simple 'divu'",
+        "source":
+        """
+        .section code
+            divu x10, x6, x2
+        """,
+        "out_reg": 10,
+        "out_val": 0x1234_5678 // 3,
+        "timeout": 100,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "simple 'rem'",
+        "source":
+        """
+        .section code
+            rem x10, x1, x2
+        """,
+        "out_reg": 10,
+        "out_val": Bits(int=-1, length=32).uint,
+        "timeout": 100,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "simple 'remu'",
+        "source":
+        """
+        .section code
+            remu x10, x6, x2
+        """,
+        "out_reg": 10,
+        "out_val": 0x1234_5678 % 3,
+        "timeout": 100,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "'div' by zero",
+        "source":
+        """
+        .section code
+            div x11, x1, x5
+            rem x12, x1, x5
+            sub x10, x11, x12
+        """,
+        "out_reg": 10,
+        "out_val": Bits(int=-1 - -7, length=32).uint,
+        "timeout": 250,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "'div' overflow",
+        "source":
+        """
+        .section code
+            div x11, x3, x4
+            rem x12, x3, x4
+            or x10, x11, x12
+        """,
+        "out_reg": 10,
+        "out_val": 0x8000_0000,
+        "timeout": 250,
+        "reg_init": MULDIV_REG_INIT,
+    },
+
+    {
+        "name": "dependent 'mul', 'div', 'mul'",
+        "source":
+        """
+        .section code
+            mul x11, x6, x2
+            divu x12, x11, x2
+            mul x10, x12, x1
+        """,
+        "out_reg": 10,
+        "out_val": (0x1234_5678 * -7) & 0xffff_ffff,
+        "timeout": 250,
+        "reg_init": MULDIV_REG_INIT,
+    },
+]
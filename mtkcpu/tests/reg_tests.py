@@ -66,6 +66,36 @@ REG_TESTS = [
         "reg_init": [i for i in range(32)]
     },
 
+    {  # logical shift fills with zeros, even for negative value
+        "name": "negative 'srl'",
+        "source": 
+        """
+        .section code
+            srl x13, x11, x1
+            srli x12, x11, 31
+            or x10, x13, x12
+        """,
+        "out_reg": 10,
+        "out_val": 0x0800_0001,
+        "timeout": 100,
+        "mem_init": {},
+        "reg_init": [0, 4] + [0x8000_0000 for _ in range(30)]
+    },
+
+    {  # shift by more than 4 bits takes multiple cycles with iterative shifter
+        "name": "long 'sll'",
+        "source": 
+        """
+        .section code
+            slli x10, x11, 31
+        """,
+        "out_reg": 10,
+        "out_val": 0x8000_0000,
+        "timeout": 100,
+        "mem_init": {},
+        "reg_init": [i for i in range(32)]
+    },
+
     {  # 0b111 << 2 = 0b11100 
         "name": "simple 'slli'",
         "source": 
@@ -241,4 +271,22 @@ REG_TESTS = [
         "reg_init": [i for i in range(32)]
     },
 
+    ### back-to-back dependencies (RAW hazards in pipelined core)
+
+    {  # x1 = 1 + 1, x2 = x1 + x1, x3 = x2 + x1
+        "name": "dependent 'add' chain",
+        "source": 
+        """
+        .section code
+            addi x1, x0, 1
+            addi x1, x1, 1
+            add x2, x1, x1
+            add x3, x2, x1
+        """,
+        "out_reg": 3,
+        "out_val": 6,
+        "timeout": 60,
+        "mem_init": {},
+    },
+
 ]
\ No newline at end of file
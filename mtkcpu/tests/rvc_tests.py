@@ -0,0 +1,176 @@
+from bitstring import Bits
+from common import START_ADDR
+
+# RV32C tests, CPU is built with compressed instructions support. Code mixes 16-bit and 32-bit
+# instructions, so that some of the latter cross word boundary.
+RVC_TESTS = [
+
+    {
+        "name": "simple 'c.li', 'c.addi' and 'c.mv'",
+        "source":
+        """
+        .section code
+            c.li x8, 5
+            c.addi x8, -3
+            c.mv x10, x8
+        """,
+        "out_reg": 10,
+        "out_val": 2,
+        "timeout": 40,
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "32-bit instruction crossing word boundary",
+        "source":
+        """
+        .section code
+            c.li x8, 1
+            addi x9, x0, 100
+            c.add x9, x8
+            add x10, x9, x8
+        """,
+        "out_reg": 10,
+        "out_val": 102,
+        "timeout": 50,
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'c.lui' and compressed shifts",
+        "source":
+        """
+        .section code
+            c.lui x8, 0x3f
+            c.srai x8, 4
+            c.lui x9, 1
+            c.srli x9, 12
+            c.slli x9, 3
+            c.andi x8, -2
+            c.add x8, x9
+            c.mv x10, x8
+        """,
+        "out_reg": 10,
+        "out_val": Bits(int=-0x1000 >> 4, length=32).uint + 8,
+        "timeout": 80,
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'c.sub', 'c.xor', 'c.or' and 'c.and'",
+        "source":
+        """
+        .section code
+            c.sub x8, x9
+            c.xor x9, x11
+            c.or x11, x12
+            c.and x12, x13
+            c.add x8, x9
+            c.add x8, x11
+            c.add x8, x12
+            c.mv x10, x8
+        """,
+        "out_reg": 10,
+        "out_val": (8 - 9) + (9 ^ 11) + (11 | 12) + (12 & 13),
+        "timeout": 80,
+        "reg_init": [i for i in range(32)],
+    },
+
+    {
+        "name": "compressed loads and stores",
+        "source":
+        """
+        .section code
+            c.lw x8, 4(x9)
+            c.addi x8, 1
+            c.sw x8, 8(x9)
+            c.lwsp x12, 12(x2)
+            c.swsp x12, 16(x2)
+            c.lw x10, 8(x9)
+        """,
+        "out_reg": 10,
+        "out_val": 0x124,
+        "timeout": 120,
+        "mem_init": {0x104: 0x123, 0x20c: 0xabc},
+        "mem_out": {0x108: 0x124, 0x210: 0xabc},
+        "reg_init": [0, 0, 0x200, 0, 0, 0, 0, 0, 0, 0x100] + [0 for _ in range(22)],
+    },
+
+    {
+        "name": "'c.addi4spn' and 'c.addi16sp'",
+        "source":
+        """
+        .section code
+            c.addi16sp x2, -64
+            c.addi4spn x8, x2, 1020
+            c.add x8, x2
+            c.mv x10, x8
+        """,
+        "out_reg": 10,
+        "out_val": 2 * (0x1000 - 64) + 1020,
+        "timeout": 50,
+        "reg_init": [0, 0, 0x1000] + [0 for _ in range(29)],
+    },
+
+    {
+        "name": "'c.bnez' loop",
+        "source":
+        """
+        .section code
+            c.li x8, 5
+            c.li x9, 0
+        loop:
+            c.add x9, x8
+            addi x8, x8, -1
+            c.bnez x8, loop
+            c.beqz x8, end
+            c.li x9, 0
+        end:
+            c.mv x10, x9
+        """,
+        "out_reg": 10,
+        "out_val": 15,
+        "timeout": 200,
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "'c.jal' links address of next halfword",
+        "source":
+        """
+        .section code
+            c.nop
+            c.jal fun
+            c.li x9, 7
+        fun:
+            c.mv x10, x1
+        """,
+        "out_reg": 10,
+        "out_val": START_ADDR + 4,
+        "timeout": 40,
+        "reg_init": [0 for _ in range(32)],
+    },
+
+    {
+        "name": "call and return with 'c.jalr', 'c.jr' and 'c.j'",
+        "source":
+        """
+        .section code
+            c.li x8, 3
+            auipc x9, 0
+            c.addi x9, 10
+            c.jalr x9
+            c.mv x10, x8
+        fun:
+            c.j skip
+            c.li x8, 0
+        skip:
+            addi x8, x8, 4
+            c.jr x1
+        """,
+        "out_reg": 10,
+        "out_val": 7,
+        "timeout": 120,
+        "reg_init": [0 for _ in range(32)],
+    },
+]
@@ -39,4 +39,51 @@ UPPER_TESTS = [
         "out_val": START_ADDR + (0xaa << 12),
         "timeout": 10,
     },
+
+    # pairs below get fused with --fusion.
+    {
+        "name": "'lui' + 'addi' constant",
+        "source":
+        """
+        .section code
+            lui x5, 0x12346
+            addi x5, x5, -0x100
+            addi x10, x5, 0
+        """,
+        "out_reg": 10,
+        "out_val": 0x12345f00,
+        "timeout": 40,
+    },
+
+    {
+        "name": "'auipc' + 'lw' PC-relative load",
+        "source":
+        """
+        .section code
+            addi x6, x0, 1
+            auipc x6, 0
+            lw x6, 0x100(x6)
+            addi x10, x6, 0
+        """,
+        "out_reg": 10,
+        "out_val": 0xabc,
+        "mem_init": {START_ADDR + 0x104: 0xabc},
+        "timeout": 60,
+    },
+
+    {
+        "name": "'auipc' + 'jalr' far call",
+        "source":
+        """
+        .section code
+            auipc x1, 0
+            jalr x1, x1, 16
+            addi x10, x0, 1
+            addi x10, x0, 2
+            addi x10, x1, 0
+        """,
+        "out_reg": 10,
+        "out_val": START_ADDR + 8,
+        "timeout": 60,
+    },
 ]
\ No newline at end of file
@@ -0,0 +1,180 @@
+from nmigen import *
+from nmigen.utils import log2_int
+from enum import IntEnum
+
+
+class BranchKind(IntEnum):
+    BRANCH = 0 # conditional branch
+    JUMP = 1 # 'jal'/'jalr' that is neither call nor return
+    CALL = 2 # 'jal'/'jalr' with rd = ra
+    RETURN = 3 # 'jalr x0, 0(ra)'
+
+
+def is_link(reg):
+    return (reg == 1) | (reg == 5)
+
+
+# Branch prediction unit. Consists of:
+# * direct-mapped Branch Target Buffer, tagged with instruction address, remembering target and kind
+#   of each taken control transfer,
+# * Pattern History Table of 2-bit saturating counters, indexed by 'pc' ("bimodal")
+#   or by 'pc' xor Global History Register ("gshare"),
+# * Return Address Stack, pushed on predicted call and popped on predicted return.
+#
+# Lookup is combinational: prediction for 'pc' is valid in the same cycle, 'fetch' should be asserted if
+# prediction was used (only then RAS gets updated). RAS is updated speculatively and not repaired
+# on misprediction (it affects accuracy only). GHR and counters are updated on branch resolution ('upd_valid').
+class BranchPredictor(Elaboratable):
+    def __init__(self, predictor="bimodal", btb_entries=32, pht_entries=128, ras_depth=4):
+        if predictor not in ["bimodal", "gshare"]:
+            raise ValueError(f"Unknown branch predictor '{predictor}', use 'bimodal' or 'gshare'.")
+        for name, val in [("btb_entries", btb_entries), ("pht_entries", pht_entries)]:
+            if val < 1 or val & (val - 1):
+                raise ValueError(f"Branch predictor {name} must be a power of 2, not {val}!")
+        if ras_depth < 1:
+            raise ValueError(f"Return address stack depth must be positive, not {ras_depth}!")
+
+        self.predictor = predictor
+        self.btb_entries = btb_entries
+        self.pht_entries = pht_entries
+        self.ras_depth = ras_depth
+
+        self.pht_bits = log2_int(pht_entries)
+
+        # Lookup.
+        self.pc = Signal(32, name="BP_pc")
+        self.fetch = Signal(name="BP_fetch")
+        self.taken = Signal(name="BP_taken")
+        self.target = Signal(32, name="BP_target")
+        self.index = Signal(self.pht_bits, name="BP_index") # has to be passed back on update
+
+        # Update.
+        self.upd_valid = Signal(name="BP_upd_valid")
+        self.upd_pc = Signal(32, name="BP_upd_pc")
+        self.upd_index = Signal(self.pht_bits, name="BP_upd_index")
+        self.upd_kind = Signal(BranchKind, name="BP_upd_kind")
+        self.upd_taken = Signal(name="BP_upd_taken")
+        self.upd_target = Signal(32, name="BP_upd_target")
+        self.upd_miss = Signal(name="BP_upd_miss") # next instruction was mispredicted
+
+        # Performance counters, resolved instructions and mispredictions of each kind.
+        self.ctrs = {}
+        for kind in BranchKind:
+            name = kind.name.lower()
+            self.ctrs[f"bp_{name}"] = Signal(32, name=f"BP_{kind.name}_CTR")
+            self.ctrs[f"bp_{name}_miss"] = Signal(32, name=f"BP_{kind.name}_MISS_CTR")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        idx_bits = log2_int(self.btb_entries)
+        tag_bits = 30 - idx_bits
+
+        btb_index = lambda pc: pc[2:2 + idx_bits]
+        btb_tag = lambda pc: pc[2 + idx_bits:]
+
+        # BTB entry: valid, kind, tag, target[2:].
+        btb = Memory(width=1 + 2 + tag_bits + 30, depth=self.btb_entries)
+        btb_rp = m.submodules.btb_rp = btb.read_port(domain="comb")
+        btb_wp = m.submodules.btb_wp = btb.write_port()
+
+        # 2-bit counters, initially weakly taken (BTB entry exists only for branch that was taken).
+        pht = Memory(width=2, depth=self.pht_entries, init=[2] * self.pht_entries)
+        pht_rp = m.submodules.pht_rp = pht.read_port(domain="comb")
+        pht_upd_rp = m.submodules.pht_upd_rp = pht.read_port(domain="comb")
+        pht_wp = m.submodules.pht_wp = pht.write_port()
+
+        ghr = Signal(self.pht_bits)
+
+        ras = Array([Signal(32, name=f"ras{i}") for i in range(self.ras_depth)])
+        ras_ptr = Signal(range(self.ras_depth)) # points to top of stack
+        ras_level = Signal(range(self.ras_depth + 1))
+
+        # Lookup.
+        entry_valid = Signal()
+        entry_kind = Signal(BranchKind)
+        entry_tag = Signal(tag_bits)
+        entry_target = Signal(32)
+        hit = Signal()
+
+        comb += [
+            btb_rp.addr.eq(btb_index(self.pc)),
+            Cat(entry_valid, entry_kind, entry_tag, entry_target[2:]).eq(btb_rp.data),
+            hit.eq(entry_valid & (entry_tag == btb_tag(self.pc))),
+        ]
+
+        if self.predictor == "gshare":
+            comb += self.index.eq(self.pc[2:2 + self.pht_bits] ^ ghr)
+        else:
+            comb += self.index.eq(self.pc[2:2 + self.pht_bits])
+        comb += pht_rp.addr.eq(self.index)
+
+        with m.If(hit):
+            with m.Switch(entry_kind):
+                with m.Case(BranchKind.BRANCH):
+                    comb += [
+                        self.taken.eq(pht_rp.data[1]),
+                        self.target.eq(entry_target),
+                    ]
+                with m.Case(BranchKind.RETURN):
+                    comb += [
+                        self.taken.eq(1),
+                        self.target.eq(Mux(ras_level != 0, ras[ras_ptr], entry_target)),
+                    ]
+                with m.Default():
+                    comb += [
+                        self.taken.eq(1),
+                        self.target.eq(entry_target),
+                    ]
+
+        next_ptr = lambda ptr: Mux(ptr == self.ras_depth - 1, 0, ptr + 1)
+        prev_ptr = lambda ptr: Mux(ptr == 0, self.ras_depth - 1, ptr - 1)
+
+        with m.If(self.fetch & hit):
+            with m.If(entry_kind == BranchKind.CALL):
+                # on overflow, the oldest entry gets overwritten.
+                sync += [
+                    ras[next_ptr(ras_ptr)].eq(self.pc + 4),
+                    ras_ptr.eq(next_ptr(ras_ptr)),
+                ]
+                with m.If(ras_level != self.ras_depth):
+                    sync += ras_level.eq(ras_level + 1)
+            with m.Elif((entry_kind == BranchKind.RETURN) & (ras_level != 0)):
+                sync += [
+                    ras_ptr.eq(prev_ptr(ras_ptr)),
+                    ras_level.eq(ras_level - 1),
+                ]
+
+        # Update.
+        counter = pht_upd_rp.data
+        comb += [
+            pht_upd_rp.addr.eq(self.upd_index),
+            pht_wp.addr.eq(self.upd_index),
+            pht_wp.data.eq(Mux(
+                self.upd_taken,
+                Mux(counter == 3, 3, counter + 1),
+                Mux(counter == 0, 0, counter - 1)
+            )),
+            pht_wp.en.eq(self.upd_valid & (self.upd_kind == BranchKind.BRANCH)),
+
+            btb_wp.addr.eq(btb_index(self.upd_pc)),
+            btb_wp.data.eq(Cat(Const(1, 1), self.upd_kind, btb_tag(self.upd_pc), self.upd_target[2:])),
+            btb_wp.en.eq(self.upd_valid & self.upd_taken),
+        ]
+
+        with m.If(self.upd_valid & (self.upd_kind == BranchKind.BRANCH)):
+            sync += ghr.eq(Cat(self.upd_taken, ghr))
+
+        with m.If(self.upd_valid):
+            with m.Switch(self.upd_kind):
+                for kind in BranchKind:
+                    with m.Case(kind):
+                        name = kind.name.lower()
+                        total, miss = self.ctrs[f"bp_{name}"], self.ctrs[f"bp_{name}_miss"]
+                        sync += total.eq(total + 1)
+                        with m.If(self.upd_miss):
+                            sync += miss.eq(miss + 1)
+
+        return m
@@ -0,0 +1,62 @@
+from nmigen import *
+
+from isa import Funct3
+
+# Resolves control transfer of 'jal', 'jalr' and branches in one step - condition is evaluated
+# by it's own comparator (not by 'AdderUnit' flags), and taken target by single adder
+# ('pc + imm', or 'rs1 + imm' for 'jalr'), in parallel with 'pc + 4' ('pc + 2' for compressed instruction).
+class BranchUnit(Elaboratable):
+    def __init__(self):
+        # Input signals.
+        self.jal = Signal(name="branch_jal")
+        self.jalr = Signal(name="branch_jalr")
+        self.branch = Signal(name="branch_branch")
+        self.funct3 = Signal(Funct3)
+        self.src1 = Signal(32, name="branch_src1")
+        self.src2 = Signal(32, name="branch_src2")
+        self.pc = Signal(32, name="branch_pc")
+        self.imm = Signal(32, name="branch_imm")
+        self.compressed = Signal(name="branch_compressed")
+
+        # Output signals.
+        self.condition_met = Signal(name="branch_condition_met")
+        self.taken = Signal(name="branch_taken")
+        self.target = Signal(32, name="branch_target") # address of taken control transfer
+        self.fall_through = Signal(32, name="branch_fall_through") # address of next instruction, also link address
+        self.next_pc = Signal(32, name="branch_next_pc")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+
+        eq = Signal()
+        lt = Signal()
+        ltu = Signal()
+        comb += [
+            eq.eq(self.src1 == self.src2),
+            lt.eq(self.src1.as_signed() < self.src2.as_signed()),
+            ltu.eq(self.src1 < self.src2),
+        ]
+        with m.Switch(self.funct3):
+            with m.Case(Funct3.BEQ):
+                comb += self.condition_met.eq(eq)
+            with m.Case(Funct3.BNE):
+                comb += self.condition_met.eq(~eq)
+            with m.Case(Funct3.BLT):
+                comb += self.condition_met.eq(lt)
+            with m.Case(Funct3.BGE):
+                comb += self.condition_met.eq(~lt)
+            with m.Case(Funct3.BLTU):
+                comb += self.condition_met.eq(ltu)
+            with m.Case(Funct3.BGEU):
+                comb += self.condition_met.eq(~ltu)
+
+        # 'jal' and branch offsets are even, so clearing lowest bit (as 'jalr' requires) doesn't change them.
+        comb += [
+            self.target.eq(Cat(Const(0, 1), (Mux(self.jalr, self.src1, self.pc) + self.imm)[1:32])),
+            self.taken.eq(self.jal | self.jalr | (self.branch & self.condition_met)),
+            self.fall_through.eq(self.pc + Mux(self.compressed, 2, 4)),
+            self.next_pc.eq(Mux(self.taken, self.target, self.fall_through)),
+        ]
+
+        return m
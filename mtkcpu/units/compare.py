@@ -45,8 +45,8 @@ class CompareUnit(Elaboratable):
 from common import matcher
 
 match_compare_unit = matcher([
-    (InstrType.ALU, Funct3.SLT),
-    (InstrType.ALU, Funct3.SLTU),
+    (InstrType.ALU, Funct3.SLT, 0b0000000),
+    (InstrType.ALU, Funct3.SLTU, 0b0000000),
 
     (InstrType.OP_IMM, Funct3.SLT),
     (InstrType.OP_IMM, Funct3.SLTU),
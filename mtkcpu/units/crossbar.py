@@ -0,0 +1,129 @@
+from nmigen import *
+from nmigen.hdl.rec import *
+
+from common import START_ADDR
+from units.loadstore import MemoryArbiter, bus_layout
+
+
+# Default address map for Harvard-style setups - code, memory mapped I/O, and data (everything else).
+HARVARD_MAP = [
+    ("code", START_ADDR, 0x9000), # up to linker script limit (see elf/linker.ld)
+    ("mmio", 0x8000_0000, 0x8000_0000),
+    ("data", 0x0, None),
+]
+
+
+def check_address_map(address_map):
+    if not address_map:
+        raise ValueError("Address map must contain at least one region!")
+    names = [name for name, _, _ in address_map]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicated slave names in address map: {names}")
+    for name, base, size in address_map:
+        if size is not None and (base < 0 or size <= 0 or base + size > 2 ** 32):
+            raise ValueError(f"Slave '{name}' region ({hex(base)}, size {hex(size)}) doesn't fit in address space!")
+
+
+# Routes requests of single master ('bus') to one of 'slaves' (dict name -> bus Record), address-decoded
+# with 'address_map' - list of (name, base, size), first matching region wins, size None matches any address
+# (put it last).
+#
+# Master may have many requests in flight, but all to one slave (so that acks come back in order) -
+# request to another slave is stalled until all of them are acked.
+class Decoder(Elaboratable):
+    def __init__(self, address_map, slaves):
+        check_address_map(address_map)
+        if set(slaves) != set(name for name, _, _ in address_map):
+            raise ValueError(f"Decoder slaves {list(slaves)} don't match address map {address_map}.")
+        self.address_map = address_map
+        self.slaves = slaves
+        self.bus = Record(bus_layout, name="DEC_bus")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        master = self.bus
+        ports = [self.slaves[name] for name, _, _ in self.address_map]
+        n = len(ports)
+
+        # index of slave, that address is decoded to ('reversed', as the last assignment wins).
+        decoded = Signal(range(n))
+        for i, (name, base, size) in reversed(list(enumerate(self.address_map))):
+            match = 1 if size is None else (master.adr >= base) & (master.adr < base + size)
+            with m.If(match):
+                comb += decoded.eq(i)
+
+        target = Signal(range(n)) # slave of in-flight requests
+        pending = Signal(8)
+        conflict = Signal()
+        accepted = Signal()
+
+        comb += conflict.eq((pending != 0) & (decoded != target))
+
+        for i, p in enumerate(ports):
+            comb += [
+                p.adr.eq(master.adr),
+                p.dat_w.eq(master.dat_w),
+                p.sel.eq(master.sel),
+                p.we.eq(master.we),
+                p.cti.eq(master.cti),
+                p.bte.eq(master.bte),
+                p.stb.eq(master.stb & (decoded == i) & ~conflict),
+                p.cyc.eq(master.cyc & Mux(pending != 0, target == i, decoded == i)),
+            ]
+
+        comb += [
+            master.stall.eq(conflict | Array([p.stall for p in ports])[decoded]),
+            master.ack.eq(Array([p.ack for p in ports])[target]),
+            master.dat_r.eq(Array([p.dat_r for p in ports])[target]),
+            accepted.eq(master.stb & ~master.stall),
+        ]
+
+        with m.If(accepted):
+            sync += target.eq(decoded)
+        sync += pending.eq(pending + accepted - master.ack)
+
+        return m
+
+
+# Crossbar interconnect, that connects each master port to each of slave buses (with 'Decoder').
+# Each slave has it's own 'MemoryArbiter', thus masters reaching different slaves proceed in parallel.
+# Same 'port()' interface as 'MemoryArbiter' is provided.
+class Crossbar(Elaboratable):
+    def __init__(self, address_map=HARVARD_MAP, scheme="priority"):
+        check_address_map(address_map)
+        self.address_map = address_map
+        self.arbiters = { name: MemoryArbiter(scheme=scheme) for name, _, _ in address_map }
+        # slave name -> bus, to be connected to slave device.
+        self.slaves = { name: arbiter.bus for name, arbiter in self.arbiters.items() }
+
+        # master priority -> 'Decoder'
+        self.decoders = {}
+
+        # Performance counters (per master and slave: tenures granted, cycles waited for grant, longest wait).
+        self.ctrs = {}
+
+    def elaborate(self, platform):
+        m = Module()
+
+        for name, arbiter in self.arbiters.items():
+            m.submodules[f"arbiter_{name}"] = arbiter
+        for prio, decoder in self.decoders.items():
+            m.submodules[f"decoder{prio}"] = decoder
+
+        return m
+
+    def port(self, priority, weight=1, name=None):
+        if priority in self.decoders:
+            raise ValueError("Conflicting priority passed to Crossbar.port()")
+        name = f"port{priority}" if name is None else name
+        ports = {
+            slave: arbiter.port(priority=priority, weight=weight, name=f"{name}_{slave}")
+            for slave, arbiter in self.arbiters.items()
+        }
+        for arbiter in self.arbiters.values():
+            self.ctrs.update(arbiter.ctrs)
+        decoder = self.decoders[priority] = Decoder(self.address_map, ports)
+        return decoder.bus
@@ -0,0 +1,150 @@
+from nmigen import *
+
+from isa import Funct3, InstrType, CSRIndex
+
+# Events that can be counted by 'mhpmcounter<k>' - number of event is it's position in that list,
+# plus one ('mhpmevent<k>' set to 0 stops the counter). Each event is a single-cycle pulse, driven by CPU.
+HPM_EVENTS = [
+    "fetch_stall",      # no instruction ready to be executed (EXECUTE, ID stage), waiting for fetch
+    "mem_wait",         # load, store or 'fence.i' waits for memory
+    "branch_taken",
+    "branch_miss",      # mispredicted control transfer (by pipeline or prefetch queue, fetching ahead)
+    "icache_hit",
+    "icache_miss",
+    "dcache_hit",
+    "dcache_miss",
+    # cycles spent in EXECUTE (EX stage) by instruction of given unit.
+    "logic_busy",
+    "adder_busy",
+    "shifter_busy",
+    "mem_unit_busy",
+    "compare_busy",
+    "branch_busy",      # 'jal', 'jalr' and branches
+    "muldiv_busy",
+    "csr_busy",
+    "load_use_stall",   # instruction waits for result of load in flight (non-blocking loads)
+]
+
+# Executes CSR instructions (in single cycle), with counters of Zicntr and Zihpm extensions:
+# 'cycle', 'instret' and 'time' (which counts cycles too, as there is no real-time clock),
+# and 'hpm_counters' of 'hpmcounter<k>' (k = 3, 4, ...), each counting event selected by 'mhpmevent<k>'.
+# All counters are 64-bit wide, writable through machine-mode CSRs (except 'time'), and can be stopped
+# with 'mcountinhibit'. Not implemented 'mhpmcounter<k>' and 'mhpmevent<k>' are read-only zeros,
+# access to CSR other than the ones above sets 'illegal'.
+class CsrUnit(Elaboratable):
+    def __init__(self, hpm_counters=4):
+        if not 0 <= hpm_counters <= 29:
+            raise ValueError(f"Number of hpm counters must be in range 0..29, not {hpm_counters}!")
+        self.hpm_counters = hpm_counters
+
+        # Input signals.
+        self.en = Signal(name="csr_en")         # CSR instruction executes in that cycle
+        self.funct3 = Signal(Funct3)
+        self.addr = Signal(12, name="csr_addr")
+        self.src1 = Signal(32, name="csr_src1") # 'rs1' value, or zero-extended 'uimm' for CSRR*I
+        self.rs1 = Signal(5, name="csr_rs1")    # 'rs1' (or 'uimm') field, CSRRS/CSRRC don't write when it's zero
+        self.retire = Signal(name="csr_retire") # instruction retires in that cycle
+        self.retire_fused = Signal(name="csr_retire_fused") # together with 'retire' - fused pair, counts as two
+        self.events = Record([(name, 1) for name in HPM_EVENTS], name="hpm_events")
+
+        # Output signals.
+        self.res = Signal(32, name="csr_res")   # old value of CSR, written to 'rd'
+        self.illegal = Signal(name="csr_illegal")
+
+        # Counters.
+        self.cycle = Signal(64, name="mcycle")
+        self.instret = Signal(64, name="minstret")
+        self.time = Signal(64, name="time")
+        self.hpmcounter = [Signal(64, name=f"mhpmcounter{3 + i}") for i in range(hpm_counters)]
+        self.hpmevent = [Signal(range(len(HPM_EVENTS) + 1), name=f"mhpmevent{3 + i}") for i in range(hpm_counters)]
+        self.countinhibit = Signal(3 + hpm_counters, name="mcountinhibit")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        # bit 1 of 'mcountinhibit' ('time') is not writable.
+        inhibit = Signal(32)
+        count = Signal(3 + self.hpm_counters)
+        comb += [
+            inhibit.eq(self.countinhibit & ~0b010),
+            count.eq(~inhibit),
+        ]
+
+        events = Cat(Const(0, 1), *self.events.fields.values())
+        sync += [
+            self.cycle.eq(self.cycle + count[0]),
+            self.time.eq(self.time + 1),
+            self.instret.eq(self.instret + (self.retire & count[2]) + (self.retire_fused & count[2])),
+        ]
+        for i, (counter, event) in enumerate(zip(self.hpmcounter, self.hpmevent)):
+            sync += counter.eq(counter + ((events >> event)[0] & count[3 + i]))
+
+        # address -> (value, Signal written by machine-mode CSR, or None if it's read-only).
+        csrs = {
+            CSRIndex.MCOUNTINHIBIT.value: (inhibit, self.countinhibit),
+            CSRIndex.MCYCLE.value:      (self.cycle[0:32], self.cycle[0:32]),
+            CSRIndex.MCYCLEH.value:     (self.cycle[32:64], self.cycle[32:64]),
+            CSRIndex.MINSTRET.value:    (self.instret[0:32], self.instret[0:32]),
+            CSRIndex.MINSTRETH.value:   (self.instret[32:64], self.instret[32:64]),
+            CSRIndex.CYCLE.value:       (self.cycle[0:32], None),
+            CSRIndex.CYCLEH.value:      (self.cycle[32:64], None),
+            CSRIndex.TIME.value:        (self.time[0:32], None),
+            CSRIndex.TIMEH.value:       (self.time[32:64], None),
+            CSRIndex.INSTRET.value:     (self.instret[0:32], None),
+            CSRIndex.INSTRETH.value:    (self.instret[32:64], None),
+        }
+        for k in range(29):
+            if k < self.hpm_counters:
+                counter, event = self.hpmcounter[k], self.hpmevent[k]
+                csrs[CSRIndex.MHPMCOUNTER3.value + k] = (counter[0:32], counter[0:32])
+                csrs[CSRIndex.MHPMCOUNTER3H.value + k] = (counter[32:64], counter[32:64])
+                csrs[CSRIndex.MHPMEVENT3.value + k] = (event, event)
+                csrs[CSRIndex.HPMCOUNTER3.value + k] = (counter[0:32], None)
+                csrs[CSRIndex.HPMCOUNTER3H.value + k] = (counter[32:64], None)
+            else:
+                for base in [CSRIndex.MHPMCOUNTER3, CSRIndex.MHPMCOUNTER3H, CSRIndex.MHPMEVENT3,
+                        CSRIndex.HPMCOUNTER3, CSRIndex.HPMCOUNTER3H]:
+                    csrs[base.value + k] = (Const(0, 32), None)
+
+        # CSRRS/CSRRC (and immediate variants) with 'rs1' = x0 only read CSR.
+        write = Signal()
+        wdata = Signal(32)
+        comb += write.eq(self.en & ((self.funct3[0:2] == Funct3.CSRRW.value) | (self.rs1 != 0)))
+        with m.Switch(self.funct3[0:2]):
+            with m.Case(Funct3.CSRRW.value):
+                comb += wdata.eq(self.src1)
+            with m.Case(Funct3.CSRRS.value):
+                comb += wdata.eq(self.res | self.src1)
+            with m.Case(Funct3.CSRRC.value):
+                comb += wdata.eq(self.res & ~self.src1)
+
+        # writes override counters incremented above.
+        with m.Switch(self.addr):
+            for addr, (value, target) in csrs.items():
+                with m.Case(addr):
+                    comb += self.res.eq(value)
+                    if target is not None:
+                        with m.If(write):
+                            sync += target.eq(wdata)
+            with m.Default():
+                comb += self.illegal.eq(self.en)
+
+        # CSRs with two highest bits of address set are read-only.
+        with m.If(write & (self.addr[10:12] == 0b11)):
+            comb += self.illegal.eq(1)
+
+        return m
+
+
+from common import matcher
+
+match_csr_unit = matcher([
+    (InstrType.SYSTEM, Funct3.CSRRW),
+    (InstrType.SYSTEM, Funct3.CSRRS),
+    (InstrType.SYSTEM, Funct3.CSRRC),
+    (InstrType.SYSTEM, Funct3.CSRRWI),
+    (InstrType.SYSTEM, Funct3.CSRRSI),
+    (InstrType.SYSTEM, Funct3.CSRRCI),
+])
@@ -0,0 +1,340 @@
+from nmigen import *
+from nmigen.utils import log2_int
+
+from units.loadstore import LoadStoreInterface, CycleType, line_burst_type
+from units.icache import LFSR, plru_victim, plru_update
+
+
+# Write-back, write-allocate cache, that is a drop-in replacement for 'MemoryUnit.loadstore'.
+# Same 'en'/'busy'/'ack' handshake is used, with 'ack' asserted combinationally in the cycle
+# after request in case of hit. Stores are merged into cached word with 'mask' byte enables
+# (as computed by 'Selector'), and only mark line dirty. On miss, dirty victim line is written back
+# to 'mem_port', then whole line is refilled, and request is replayed. Both write-back and refill
+# are single bursts, issuing one word per cycle without waiting for acks.
+#
+# Requests with 'fence' set write back all dirty lines (lines stay valid).
+#
+# NOTE: bus passes sub-word addresses as they are (without aligning to 4), thus
+# two lowest address bits are part of a tag - that way cached and uncached accesses are equivalent.
+class DataCache(Elaboratable, LoadStoreInterface):
+    def __init__(self, mem_port, nways=1, nlines=32, nwords=4, replacement="lru"):
+        super().__init__()
+
+        for name, val in [("nways", nways), ("nlines", nlines), ("nwords", nwords)]:
+            if val < 1 or val & (val - 1):
+                raise ValueError(f"Cache {name} must be a power of 2, not {val}!")
+        if replacement not in ["lru", "random"]:
+            raise ValueError(f"Unknown cache replacement policy '{replacement}', use 'lru' or 'random'.")
+
+        self.mem_port = mem_port
+        self.nways = nways
+        self.nlines = nlines
+        self.nwords = nwords
+        self.replacement = replacement
+
+        self.offset_bits = log2_int(nwords)
+        self.index_bits = log2_int(nlines)
+        self.tag_bits = 32 - self.offset_bits - self.index_bits
+
+        # Tag memory keeps 'valid' and 'dirty' bits at two LSBs.
+        self.tags = [Memory(width=self.tag_bits + 2, depth=nlines) for _ in range(nways)]
+        self.data = [Memory(width=32, depth=nlines * nwords) for _ in range(nways)]
+
+        # Input signals.
+        self.fence = Signal(name="DCACHE_fence")
+
+        # Performance counters, and their single-cycle events (for 'CsrUnit').
+        self.hit_ctr = Signal(32, name="DCACHE_HIT_CTR")
+        self.miss_ctr = Signal(32, name="DCACHE_MISS_CTR")
+        self.hit = Signal(name="DCACHE_hit")
+        self.miss = Signal(name="DCACHE_miss")
+        self.writeback_ctr = Signal(32, name="DCACHE_WRITEBACK_CTR")
+
+    def split(self, addr):
+        word = addr[2:2 + self.offset_bits]
+        index = addr[2 + self.offset_bits:2 + self.offset_bits + self.index_bits]
+        tag = Cat(addr[0:2], addr[2 + self.offset_bits + self.index_bits:])
+        return word, index, tag
+
+    def line_addr(self, word, index, tag):
+        return Cat(tag[0:2], word, index, tag[2:])
+
+    # Simulation only - returns dict of (address, value) of all words, that are not yet written back.
+    def sim_dirty_words(self):
+        res = {}
+        for tags, data in zip(self.tags, self.data):
+            for index in range(self.nlines):
+                entry = yield tags[index]
+                valid, dirty, tag = entry & 1, (entry >> 1) & 1, entry >> 2
+                if not (valid and dirty):
+                    continue
+                for word in range(self.nwords):
+                    addr = (tag & 0b11) \
+                        | (word << 2) \
+                        | (index << (2 + self.offset_bits)) \
+                        | ((tag >> 2) << (2 + self.offset_bits + self.index_bits))
+                    res[addr] = yield data[index * self.nwords + word]
+        return res
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        nways, nlines, nwords = self.nways, self.nlines, self.nwords
+
+        req_addr = Signal(32)
+        req_store = Signal()
+        req_mask = Signal(4)
+        req_data = Signal(32)
+        replay = Signal() # request is looked up again after refill, don't count it as a hit.
+
+        req_word, req_index, req_tag = self.split(req_addr)
+
+        # Line being evicted/refilled.
+        line_way = Signal(range(nways))
+        line_index = Signal(self.index_bits)
+        line_tag = Signal(self.tag_bits)
+        line_word = Signal(self.offset_bits) # next word to be acked
+        issue_word = Signal(self.offset_bits) # next word to be requested
+        issued = Signal(range(nwords + 1))
+        flushing = Signal() # 'fence' request in progress, eviction returns to flush loop.
+
+        tag_addr = Signal(self.index_bits)
+        data_addr = Signal(self.index_bits + self.offset_bits)
+        read_data = Signal(32)
+
+        tag_rps, tag_wps, data_rps, data_wps = [], [], [], []
+        for i in range(nways):
+            tag_rp = m.submodules[f"tag_rp{i}"] = self.tags[i].read_port()
+            tag_wp = m.submodules[f"tag_wp{i}"] = self.tags[i].write_port()
+            data_rp = m.submodules[f"data_rp{i}"] = self.data[i].read_port()
+            data_wp = m.submodules[f"data_wp{i}"] = self.data[i].write_port(granularity=8)
+            comb += [
+                tag_rp.addr.eq(tag_addr),
+                data_rp.addr.eq(data_addr),
+            ]
+            tag_rps.append(tag_rp)
+            tag_wps.append(tag_wp)
+            data_rps.append(data_rp)
+            data_wps.append(data_wp)
+
+        valid = Cat(*[rp.data[0] for rp in tag_rps])
+        dirty = Cat(*[rp.data[1] for rp in tag_rps])
+        hits = Cat(*[rp.data[0] & (rp.data[2:] == req_tag) for rp in tag_rps])
+        hit_way = Signal(range(nways))
+        for i in reversed(range(nways)):
+            with m.If(hits[i]):
+                comb += hit_way.eq(i)
+        hit_data = Array([rp.data for rp in data_rps])[hit_way]
+
+        def write_tag(way, index, entry):
+            for i in range(nways):
+                with m.If(way == i):
+                    m.d.comb += [
+                        tag_wps[i].addr.eq(index),
+                        tag_wps[i].data.eq(entry),
+                        tag_wps[i].en.eq(1),
+                    ]
+
+        def write_data(way, addr, data, mask):
+            for i in range(nways):
+                with m.If(way == i):
+                    m.d.comb += [
+                        data_wps[i].addr.eq(addr),
+                        data_wps[i].data.eq(data),
+                        data_wps[i].en.eq(mask),
+                    ]
+
+        # Replacement state.
+        replace_way = Signal(range(nways))
+        update_way = Signal(range(nways))
+        update_repl = Signal()
+        if nways > 1:
+            if self.replacement == "lru":
+                plru = Memory(width=nways - 1, depth=nlines)
+                plru_rp = m.submodules.plru_rp = plru.read_port()
+                plru_wp = m.submodules.plru_wp = plru.write_port()
+                comb += [
+                    plru_rp.addr.eq(tag_addr),
+                    plru_wp.addr.eq(req_index),
+                    plru_wp.data.eq(plru_update(plru_rp.data, nways, update_way)),
+                    plru_wp.en.eq(update_repl),
+                    replace_way.eq(plru_victim(plru_rp.data, nways)),
+                ]
+            else:
+                lfsr = m.submodules.lfsr = LFSR()
+                comb += replace_way.eq(lfsr.o)
+
+        # prefer invalid way, if any.
+        victim = Signal(range(nways))
+        with m.If(~valid.all()):
+            for i in reversed(range(nways)):
+                with m.If(~valid[i]):
+                    comb += victim.eq(i)
+        with m.Else():
+            comb += victim.eq(replace_way)
+
+        # first dirty way (for 'fence').
+        dirty_way = Signal(range(nways))
+        for i in reversed(range(nways)):
+            with m.If(valid[i] & dirty[i]):
+                comb += dirty_way.eq(i)
+
+        issue = Signal()
+        comb += [
+            self.busy.eq(0),
+            self.read_data.eq(read_data),
+            self.mem_port.sel.eq(0b1111),
+            self.mem_port.cti.eq(Mux(issued == nwords - 1, CycleType.END_OF_BURST, CycleType.INCR_BURST)),
+            self.mem_port.bte.eq(line_burst_type(nwords)),
+            issue.eq(self.mem_port.stb & ~self.mem_port.stall),
+        ]
+        with m.If(issue):
+            sync += [
+                issue_word.eq(issue_word + 1),
+                issued.eq(issued + 1),
+            ]
+
+        with m.FSM():
+            with m.State("IDLE"):
+                word, index, _ = self.split(self.addr)
+                comb += [
+                    tag_addr.eq(index),
+                    data_addr.eq(Cat(word, index)),
+                ]
+                with m.If(self.en):
+                    sync += [
+                        req_addr.eq(self.addr),
+                        req_store.eq(self.store),
+                        req_mask.eq(self.mask),
+                        req_data.eq(self.write_data),
+                    ]
+                    with m.If(self.fence):
+                        sync += [
+                            line_index.eq(0),
+                            flushing.eq(1),
+                        ]
+                        m.next = "FLUSH_READ"
+                    with m.Else():
+                        m.next = "LOOKUP"
+
+            with m.State("LOOKUP"):
+                comb += [
+                    self.busy.eq(1),
+                    tag_addr.eq(req_index),
+                    # first word to be evicted in case of miss.
+                    data_addr.eq(Cat(Const(0, self.offset_bits), req_index)),
+                ]
+                with m.If(hits.any()):
+                    comb += [
+                        self.ack.eq(1),
+                        self.read_data.eq(hit_data),
+                        update_way.eq(hit_way),
+                        update_repl.eq(1),
+                    ]
+                    sync += [
+                        read_data.eq(hit_data),
+                        replay.eq(0),
+                    ]
+                    with m.If(~replay):
+                        comb += self.hit.eq(1)
+                        sync += self.hit_ctr.eq(self.hit_ctr + 1)
+                    with m.If(req_store):
+                        write_data(hit_way, Cat(req_word, req_index), req_data, req_mask)
+                        write_tag(hit_way, req_index, Cat(Const(0b11, 2), req_tag))
+                    m.next = "IDLE"
+                with m.Else():
+                    comb += self.miss.eq(1)
+                    sync += [
+                        self.miss_ctr.eq(self.miss_ctr + 1),
+                        line_way.eq(victim),
+                        line_index.eq(req_index),
+                        line_tag.eq(Array([rp.data[2:] for rp in tag_rps])[victim]),
+                        line_word.eq(0),
+                        issue_word.eq(0),
+                        issued.eq(0),
+                    ]
+                    with m.If(valid.bit_select(victim, 1) & dirty.bit_select(victim, 1)):
+                        m.next = "EVICT"
+                    with m.Else():
+                        m.next = "REFILL"
+
+            with m.State("EVICT"):
+                # Data read port is addressed one word ahead when request is accepted,
+                # so that 'dat_w' is valid in the very next cycle.
+                comb += [
+                    self.busy.eq(1),
+                    tag_addr.eq(line_index),
+                    data_addr.eq(Cat(Mux(issue, issue_word + 1, issue_word)[:self.offset_bits], line_index)),
+                    self.mem_port.cyc.eq(1),
+                    self.mem_port.stb.eq(issued != nwords),
+                    self.mem_port.we.eq(1),
+                    self.mem_port.adr.eq(self.line_addr(issue_word, line_index, line_tag)),
+                    self.mem_port.dat_w.eq(Array([rp.data for rp in data_rps])[line_way]),
+                ]
+                with m.If(self.mem_port.ack):
+                    sync += line_word.eq(line_word + 1)
+                    with m.If(line_word == nwords - 1):
+                        sync += [
+                            self.writeback_ctr.eq(self.writeback_ctr + 1),
+                            issue_word.eq(0),
+                            issued.eq(0),
+                        ]
+                        with m.If(flushing):
+                            # line stays valid, but is clean now.
+                            write_tag(line_way, line_index, Cat(Const(0b01, 2), line_tag))
+                            m.next = "FLUSH_READ"
+                        with m.Else():
+                            m.next = "REFILL"
+
+            with m.State("REFILL"):
+                comb += [
+                    self.busy.eq(1),
+                    tag_addr.eq(req_index),
+                    data_addr.eq(Cat(req_word, req_index)),
+                    self.mem_port.cyc.eq(1),
+                    self.mem_port.stb.eq(issued != nwords),
+                    self.mem_port.we.eq(0),
+                    self.mem_port.adr.eq(self.line_addr(issue_word, req_index, req_tag)),
+                ]
+                with m.If(self.mem_port.ack):
+                    write_data(line_way, Cat(line_word, req_index), self.mem_port.dat_r, 0b1111)
+                    sync += line_word.eq(line_word + 1)
+                    with m.If(line_word == nwords - 1):
+                        write_tag(line_way, req_index, Cat(Const(0b01, 2), req_tag))
+                        # replay request, it will hit now.
+                        sync += replay.eq(1)
+                        m.next = "LOOKUP"
+
+            with m.State("FLUSH_READ"):
+                comb += [
+                    self.busy.eq(1),
+                    tag_addr.eq(line_index),
+                ]
+                m.next = "FLUSH_CHECK"
+
+            with m.State("FLUSH_CHECK"):
+                comb += [
+                    self.busy.eq(1),
+                    tag_addr.eq(line_index),
+                    data_addr.eq(Cat(Const(0, self.offset_bits), line_index)),
+                ]
+                with m.If((valid & dirty).any()):
+                    sync += [
+                        line_way.eq(dirty_way),
+                        line_tag.eq(Array([rp.data[2:] for rp in tag_rps])[dirty_way]),
+                        line_word.eq(0),
+                        issue_word.eq(0),
+                        issued.eq(0),
+                    ]
+                    m.next = "EVICT"
+                with m.Elif(line_index == nlines - 1):
+                    comb += self.ack.eq(1)
+                    sync += flushing.eq(0)
+                    m.next = "IDLE"
+                with m.Else():
+                    sync += line_index.eq(line_index + 1)
+                    m.next = "FLUSH_READ"
+
+        return m
@@ -0,0 +1,185 @@
+from nmigen import *
+from nmigen.hdl.rec import *
+from functools import reduce
+from operator import or_
+
+from common import matcher
+from isa import Funct3, Funct7, InstrType, InstrFormat
+from units.logic import match_logic_unit
+from units.adder import match_adder_unit
+from units.shifter import match_shifter_unit
+from units.compare import match_compare_unit
+from units.upper import match_lui, match_auipc
+from units.loadstore import match_loadstore_unit
+from units.muldiv import match_muldiv_unit
+from units.csr import match_csr_unit
+
+
+match_jal = matcher([
+    (InstrType.JAL, ),
+])
+
+match_jalr = matcher([
+    (InstrType.JALR, Funct3.JALR),
+])
+
+match_branch = matcher([
+    (InstrType.BRANCH, Funct3.BEQ),
+    (InstrType.BRANCH, Funct3.BNE),
+    (InstrType.BRANCH, Funct3.BLT),
+    (InstrType.BRANCH, Funct3.BGE),
+    (InstrType.BRANCH, Funct3.BLTU),
+    (InstrType.BRANCH, Funct3.BGEU),
+])
+
+match_fence_i = matcher([
+    (InstrType.MISC_MEM, Funct3.FENCE_I),
+])
+
+
+class ActiveUnitLayout(Layout):
+    def __init__(self):
+        super().__init__([
+            ("logic", 1),
+            ("adder", 1),
+            ("shifter", 1),
+            ("mem_unit", 1),
+            ("compare", 1),
+            ("lui", 1),
+            ("auipc", 1),
+            ("jal", 1),
+            ("jalr", 1),
+            ("branch", 1),
+            ("fence_i", 1),
+            ("muldiv", 1),
+            ("csr", 1),
+        ])
+
+class ActiveUnit(Record):
+    def __init__(self):
+        super().__init__(ActiveUnitLayout(), name="active_unit")
+
+
+class ControlLayout(Layout):
+    def __init__(self):
+        super().__init__([
+            ("unit", ActiveUnitLayout()), # one-hot, all zeros for illegal instruction
+            ("sub", 1),             # adder subtracts ('sub' and compare instructions)
+            ("imm_format", InstrFormat),
+            ("imm", 32),            # immediate, decoded (and sign extended) according to 'imm_format'
+            ("src2_imm", 1),        # immediate is second operand, instead of 'rs2' (OP_IMM)
+            ("src1_rd", 1),         # 'rd' is read instead of 'rs1' ('lui' keeps lowest 12 bits of 'rd')
+            ("src1_used", 1),
+            ("src2_used", 1),
+            ("write_rd", 1),        # never set for x0
+            ("store", 1),
+            ("illegal", 1),
+        ])
+
+
+# Decodes 'instr' into control vector - each instruction matcher is evaluated only once (units are mutually exclusive,
+# thus no priority chain is needed), and all the rest is derived from one-hot 'unit'.
+# 'dec' is combinational (for stages, that need it in the same cycle, e.g. to read registers or detect hazards),
+# 'ctrl' is 'dec' registered when 'en' is asserted (and reset to zeros on 'clear'), consumed by execute stage.
+# RV32M instructions are decoded only 'with_muldiv', otherwise they are illegal.
+class InstructionDecoder(Elaboratable):
+    def __init__(self, with_muldiv=False):
+        self.with_muldiv = with_muldiv
+
+        # Input signals.
+        self.instr = Signal(32, name="DEC_instr")
+        self.en = Signal(name="DEC_en")
+        self.clear = Signal(name="DEC_clear")
+
+        # Output signals.
+        self.dec = Record(ControlLayout(), name="DEC_dec")
+        self.ctrl = Record(ControlLayout(), name="DEC_ctrl")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        instr = self.instr
+        dec = self.dec
+        unit = dec.unit
+
+        opcode = instr[0:7]
+        rd = instr[7:12]
+        funct3 = instr[12:15]
+        funct7 = instr[25:32]
+
+        comb += [
+            unit.logic.eq(match_logic_unit(opcode, funct3, funct7)),
+            unit.adder.eq(match_adder_unit(opcode, funct3, funct7)),
+            unit.shifter.eq(match_shifter_unit(opcode, funct3, funct7)),
+            unit.mem_unit.eq(match_loadstore_unit(opcode, funct3, funct7)),
+            unit.compare.eq(match_compare_unit(opcode, funct3, funct7)),
+            unit.lui.eq(match_lui(opcode, funct3, funct7)),
+            unit.auipc.eq(match_auipc(opcode, funct3, funct7)),
+            unit.jal.eq(match_jal(opcode, funct3, funct7)),
+            unit.jalr.eq(match_jalr(opcode, funct3, funct7)),
+            unit.branch.eq(match_branch(opcode, funct3, funct7)),
+            unit.fence_i.eq(match_fence_i(opcode, funct3, funct7)),
+            unit.csr.eq(match_csr_unit(opcode, funct3, funct7)),
+        ]
+        if self.with_muldiv:
+            comb += unit.muldiv.eq(match_muldiv_unit(opcode, funct3, funct7))
+
+        store = opcode == InstrType.STORE
+
+        comb += [
+            dec.sub.eq(
+                (unit.adder & (opcode == InstrType.ALU) & (funct7 == Funct7.SUB))
+                | unit.compare
+            ),
+            dec.src2_imm.eq(opcode == InstrType.OP_IMM),
+            dec.src1_rd.eq(unit.lui),
+            # CSRR*I take 'uimm' instead of 'rs1'.
+            dec.src1_used.eq(~unit.jal & ~unit.auipc & ~(unit.csr & funct3[2])),
+            dec.src2_used.eq(
+                (opcode == InstrType.ALU)
+                | store
+                | (opcode == InstrType.BRANCH)
+            ),
+            dec.write_rd.eq(
+                (unit.logic | unit.adder | unit.shifter | unit.compare | unit.lui | unit.auipc | unit.jal | unit.jalr
+                    | unit.muldiv | unit.csr | (unit.mem_unit & ~store))
+                & (rd != 0)
+            ),
+            dec.store.eq(store),
+            dec.illegal.eq(~reduce(or_, unit.fields.values())),
+        ]
+
+        with m.Switch(opcode):
+            with m.Case(InstrType.STORE):
+                comb += dec.imm_format.eq(InstrFormat.S)
+            with m.Case(InstrType.BRANCH):
+                comb += dec.imm_format.eq(InstrFormat.B)
+            with m.Case(InstrType.LUI, InstrType.AUIPC):
+                comb += dec.imm_format.eq(InstrFormat.U)
+            with m.Case(InstrType.JAL):
+                comb += dec.imm_format.eq(InstrFormat.J)
+            with m.Case(InstrType.ALU):
+                comb += dec.imm_format.eq(InstrFormat.R)
+            with m.Default():
+                comb += dec.imm_format.eq(InstrFormat.I)
+
+        with m.Switch(dec.imm_format):
+            with m.Case(InstrFormat.I):
+                comb += dec.imm.eq(Cat(instr[20:31], Repl(instr[31], 21)))
+            with m.Case(InstrFormat.S):
+                comb += dec.imm.eq(Cat(instr[7:12], instr[25:31], Repl(instr[31], 21)))
+            with m.Case(InstrFormat.B):
+                comb += dec.imm.eq(Cat(Const(0, 1), instr[8:12], instr[25:31], instr[7], Repl(instr[31], 20)))
+            with m.Case(InstrFormat.U):
+                comb += dec.imm.eq(Cat(Const(0, 12), instr[12:32]))
+            with m.Case(InstrFormat.J):
+                comb += dec.imm.eq(Cat(Const(0, 1), instr[21:31], instr[20], instr[12:20], Repl(instr[31], 12)))
+
+        with m.If(self.en):
+            sync += self.ctrl.eq(dec)
+        with m.Elif(self.clear):
+            sync += self.ctrl.eq(0)
+
+        return m
@@ -0,0 +1,276 @@
+from nmigen import *
+from nmigen.utils import log2_int
+
+from units.loadstore import LoadStoreInterface, CycleType, line_burst_type
+
+
+# Pseudo-LRU (tree) replacement - for 'nways' ways there are 'nways - 1' bits per line,
+# each of them pointing to less recently used half of it's subtree (0 - left, 1 - right).
+# For 2 ways it's exact LRU.
+def plru_victim(bits, nways):
+    levels = log2_int(nways)
+
+    def walk(node, level):
+        if level == levels - 1:
+            return bits[node]
+        left = walk(2 * node + 1, level + 1)
+        right = walk(2 * node + 2, level + 1)
+        return Cat(Mux(bits[node], right, left), bits[node])
+
+    return walk(0, 0)
+
+
+def plru_update(bits, nways, way):
+    levels = log2_int(nways)
+    new_bits = []
+    for level in range(levels):
+        for pos in range(2 ** level):
+            node = 2 ** level - 1 + pos
+            on_path = (way[levels - level:levels] == pos) if level > 0 else 1
+            # make node point away from just accessed way.
+            new_bits.append(Mux(on_path, ~way[levels - 1 - level], bits[node]))
+    return Cat(*new_bits)
+
+
+# Pseudo-random number generator, used for random replacement policy.
+class LFSR(Elaboratable):
+    def __init__(self, width=16, taps=0xB400):
+        self.width = width
+        self.taps = taps
+        self.o = Signal(width, reset=1)
+
+    def elaborate(self, platform):
+        m = Module()
+        # Galois LFSR (default taps give maximal period for 16 bits).
+        with m.If(self.o[0]):
+            m.d.sync += self.o.eq((self.o >> 1) ^ self.taps)
+        with m.Else():
+            m.d.sync += self.o.eq(self.o >> 1)
+        return m
+
+
+# Read-only cache that is a drop-in replacement for instruction fetch 'LoadStoreUnit'.
+# Same 'en'/'busy'/'ack' handshake is used, with 'ack' asserted combinationally
+# in the cycle after request in case of hit. On miss, whole line is refilled via 'mem_port'
+# with single (wrapping) burst, issuing one word per cycle without waiting for acks.
+# Refill starts from requested word (critical word first), that is acked as soon as it arrives
+# - 'busy' is held until refill ends.
+#
+# 'flush' (FENCE.I) invalidates all lines, before any pending request is served.
+class InstructionCache(Elaboratable, LoadStoreInterface):
+    def __init__(self, mem_port, nways=1, nlines=32, nwords=4, replacement="lru"):
+        super().__init__()
+
+        for name, val in [("nways", nways), ("nlines", nlines), ("nwords", nwords)]:
+            if val < 1 or val & (val - 1):
+                raise ValueError(f"Cache {name} must be a power of 2, not {val}!")
+        if replacement not in ["lru", "random"]:
+            raise ValueError(f"Unknown cache replacement policy '{replacement}', use 'lru' or 'random'.")
+
+        self.mem_port = mem_port
+        self.nways = nways
+        self.nlines = nlines
+        self.nwords = nwords
+        self.replacement = replacement
+
+        # Input signals.
+        self.flush = Signal(name="ICACHE_flush")
+
+        # Performance counters, and their single-cycle events (for 'CsrUnit').
+        self.hit_ctr = Signal(32, name="ICACHE_HIT_CTR")
+        self.miss_ctr = Signal(32, name="ICACHE_MISS_CTR")
+        self.hit = Signal(name="ICACHE_hit")
+        self.miss = Signal(name="ICACHE_miss")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        nways, nlines, nwords = self.nways, self.nlines, self.nwords
+        offset_bits = log2_int(nwords)
+        index_bits = log2_int(nlines)
+        tag_bits = 30 - offset_bits - index_bits
+
+        req_addr = Signal(32)
+        lookup_addr = Signal(32)
+
+        def split(addr):
+            word = addr[2:2 + offset_bits]
+            index = addr[2 + offset_bits:2 + offset_bits + index_bits]
+            tag = addr[2 + offset_bits + index_bits:]
+            return word, index, tag
+
+        req_word, req_index, req_tag = split(req_addr)
+        _, lookup_index, _ = split(lookup_addr)
+
+        refill_word = Signal(offset_bits)
+        issue_word = Signal(offset_bits)
+        issued = Signal(range(nwords + 1))
+        flush_pending = Signal()
+        flush_index = Signal(range(nlines))
+        refill_last = Signal(offset_bits)
+        victim = Signal(range(nways))
+        read_data = Signal(32)
+
+        # Per-way storage. Tag memory keeps 'valid' bit at LSB.
+        tag_rps, tag_wps, data_rps, data_wps = [], [], [], []
+        for i in range(nways):
+            tags = Memory(width=tag_bits + 1, depth=nlines)
+            data = Memory(width=32, depth=nlines * nwords)
+            tag_rp = m.submodules[f"tag_rp{i}"] = tags.read_port()
+            tag_wp = m.submodules[f"tag_wp{i}"] = tags.write_port()
+            data_rp = m.submodules[f"data_rp{i}"] = data.read_port()
+            data_wp = m.submodules[f"data_wp{i}"] = data.write_port()
+            comb += [
+                tag_rp.addr.eq(lookup_index),
+                data_rp.addr.eq(Cat(split(lookup_addr)[0], lookup_index)),
+            ]
+            tag_rps.append(tag_rp)
+            tag_wps.append(tag_wp)
+            data_rps.append(data_rp)
+            data_wps.append(data_wp)
+
+        valid = Cat(*[rp.data[0] for rp in tag_rps])
+        hits = Cat(*[rp.data[0] & (rp.data[1:] == req_tag) for rp in tag_rps])
+        hit_way = Signal(range(nways))
+        for i in reversed(range(nways)):
+            with m.If(hits[i]):
+                comb += hit_way.eq(i)
+        hit_data = Array([rp.data for rp in data_rps])[hit_way]
+
+        # Replacement state.
+        replace_way = Signal(range(nways))
+        update_way = Signal(range(nways))
+        update_repl = Signal()
+        if nways > 1:
+            if self.replacement == "lru":
+                plru = Memory(width=nways - 1, depth=nlines)
+                plru_rp = m.submodules.plru_rp = plru.read_port()
+                plru_wp = m.submodules.plru_wp = plru.write_port()
+                comb += [
+                    plru_rp.addr.eq(lookup_index),
+                    plru_wp.addr.eq(req_index),
+                    plru_wp.data.eq(plru_update(plru_rp.data, nways, update_way)),
+                    plru_wp.en.eq(update_repl),
+                    replace_way.eq(plru_victim(plru_rp.data, nways)),
+                ]
+            else:
+                lfsr = m.submodules.lfsr = LFSR()
+                comb += replace_way.eq(lfsr.o)
+
+        # prefer invalid way, if any.
+        with m.If(~valid.all()):
+            for i in reversed(range(nways)):
+                with m.If(~valid[i]):
+                    comb += victim.eq(i)
+        with m.Else():
+            comb += victim.eq(replace_way)
+
+        refill_way = Signal(range(nways))
+
+        with m.If(self.flush):
+            sync += flush_pending.eq(1)
+
+        comb += [
+            self.busy.eq(flush_pending),
+            self.read_data.eq(read_data),
+        ]
+
+        with m.FSM():
+            with m.State("IDLE"):
+                comb += lookup_addr.eq(self.addr)
+                with m.If(flush_pending):
+                    sync += flush_index.eq(0)
+                    m.next = "FLUSH"
+                with m.Elif(self.en):
+                    sync += req_addr.eq(self.addr)
+                    m.next = "LOOKUP"
+            with m.State("LOOKUP"):
+                comb += [
+                    lookup_addr.eq(req_addr),
+                    self.busy.eq(1),
+                ]
+                with m.If(hits.any()):
+                    comb += [
+                        self.ack.eq(1),
+                        self.read_data.eq(hit_data),
+                        update_way.eq(hit_way),
+                        update_repl.eq(1),
+                    ]
+                    sync += [
+                        read_data.eq(hit_data),
+                        self.hit_ctr.eq(self.hit_ctr + 1),
+                    ]
+                    comb += self.hit.eq(1)
+                    m.next = "IDLE"
+                with m.Else():
+                    comb += self.miss.eq(1)
+                    sync += [
+                        self.miss_ctr.eq(self.miss_ctr + 1),
+                        refill_way.eq(victim),
+                        refill_word.eq(req_word),
+                        refill_last.eq(req_word - 1),
+                        issue_word.eq(req_word),
+                        issued.eq(0),
+                    ]
+                    m.next = "REFILL"
+            with m.State("REFILL"):
+                comb += [
+                    lookup_addr.eq(req_addr),
+                    self.busy.eq(1),
+                    self.mem_port.cyc.eq(1),
+                    self.mem_port.stb.eq(issued != nwords),
+                    self.mem_port.adr.eq(Cat(Const(0, 2), issue_word, req_index, req_tag)),
+                    self.mem_port.sel.eq(0b1111),
+                    self.mem_port.we.eq(0),
+                    self.mem_port.cti.eq(Mux(issued == nwords - 1, CycleType.END_OF_BURST, CycleType.INCR_BURST)),
+                    self.mem_port.bte.eq(line_burst_type(nwords)),
+                ]
+                with m.If(self.mem_port.stb & ~self.mem_port.stall):
+                    sync += [
+                        issue_word.eq(issue_word + 1),
+                        issued.eq(issued + 1),
+                    ]
+                with m.If(self.mem_port.ack):
+                    for i in range(nways):
+                        with m.If(refill_way == i):
+                            comb += [
+                                data_wps[i].addr.eq(Cat(refill_word, req_index)),
+                                data_wps[i].data.eq(self.mem_port.dat_r),
+                                data_wps[i].en.eq(1),
+                            ]
+                    sync += refill_word.eq(refill_word + 1)
+                    with m.If(refill_word == req_word):
+                        comb += [
+                            self.ack.eq(1),
+                            self.read_data.eq(self.mem_port.dat_r),
+                        ]
+                        sync += read_data.eq(self.mem_port.dat_r)
+                    with m.If(refill_word == refill_last):
+                        for i in range(nways):
+                            with m.If(refill_way == i):
+                                comb += [
+                                    tag_wps[i].addr.eq(req_index),
+                                    tag_wps[i].data.eq(Cat(Const(1, 1), req_tag)),
+                                    tag_wps[i].en.eq(1),
+                                ]
+                        comb += [
+                            update_way.eq(refill_way),
+                            update_repl.eq(1),
+                        ]
+                        m.next = "IDLE"
+            with m.State("FLUSH"):
+                comb += self.busy.eq(1)
+                for wp in tag_wps:
+                    comb += [
+                        wp.addr.eq(flush_index),
+                        wp.data.eq(0),
+                        wp.en.eq(1),
+                    ]
+                sync += flush_index.eq(flush_index + 1)
+                with m.If(flush_index == nlines - 1):
+                    sync += flush_pending.eq(0)
+                    m.next = "IDLE"
+
+        return m
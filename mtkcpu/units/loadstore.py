@@ -1,23 +1,55 @@
 from nmigen import *
-from enum import Enum
+from enum import Enum, IntEnum
 
 MEM_WORDS = 10
 
 from nmigen import *
 from nmigen.hdl.rec import *
 from nmigen.lib.coding import *
+from functools import reduce
+from operator import or_
 
 
+# Wishbone B4 pipelined mode. Request is accepted in every cycle with (cyc & stb & ~stall),
+# master may issue next one right away, without waiting for 'ack' of previous one.
+# Exactly one 'ack' is returned for each accepted request, in the same order.
+# Master keeps 'cyc' asserted until all of it's requests are acked.
 bus_layout = [
     ("adr",   32, DIR_FANOUT), # addresses aligned to 4
     ("dat_w", 32, DIR_FANOUT),
     ("dat_r", 32, DIR_FANIN),
     ("sel",    4, DIR_FANOUT),
     ("cyc",    1, DIR_FANOUT),
+    ("stb",    1, DIR_FANOUT),
+    ("stall",  1, DIR_FANIN),
     ("ack",    1, DIR_FANIN),
     ("we",     1, DIR_FANOUT),
+    ("cti",    3, DIR_FANOUT),
+    ("bte",    2, DIR_FANOUT),
 ]
 
+# Cycle Type Identifier.
+class CycleType(IntEnum):
+    CLASSIC = 0b000
+    CONST_BURST = 0b001
+    INCR_BURST = 0b010
+    END_OF_BURST = 0b111
+
+# Burst Type Extension (address wrapping of 'INCR_BURST').
+class BurstType(IntEnum):
+    LINEAR = 0b00
+    WRAP_4 = 0b01
+    WRAP_8 = 0b10
+    WRAP_16 = 0b11
+
+# burst type for fetching whole line of 'nwords' words, starting from any word of it.
+def line_burst_type(nwords):
+    return {
+        4: BurstType.WRAP_4,
+        8: BurstType.WRAP_8,
+        16: BurstType.WRAP_16,
+    }.get(nwords, BurstType.LINEAR)
+
 # implements 'ready/valid' via '~busy' and 'en' signals. 
 class LoadStoreInterface():
 
@@ -56,45 +88,142 @@ class PriorityEncoder(Elaboratable):
 
         return m
 
+# Grants bus to one of 'ports' for whole tenure ('cyc' asserted), that is for all of it's outstanding requests.
+# When bus is idle, grant is decided combinationally, so that requesting port is served in the same cycle.
+# 'scheme' selects which port is granted, if there are more of them requesting:
+# * "priority" - the one with the lowest priority number,
+# * "round_robin" - the first one following the last granted port,
+# * "weighted" - as "round_robin", but the last granted port keeps the bus for up to 'weight' consecutive tenures.
 class MemoryArbiter(Elaboratable):
-    def __init__(self):
+    def __init__(self, scheme="priority"):
+        if scheme not in ["priority", "round_robin", "weighted"]:
+            raise ValueError(f"Unknown arbitration scheme '{scheme}', use 'priority', 'round_robin' or 'weighted'.")
+        self.scheme = scheme
         self.ports = {}
+        self.weights = {}
+        self.names = {}
         self.bus = Record(bus_layout, name="BUS")
 
+        # Performance counters (per port: tenures granted, cycles waited for grant, longest wait).
+        self.ctrs = {}
 
     def elaborate(self, platform):
         m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
 
-        # TODO without '= m.submodules.pe' warning: UnusedElaboratable 
-        pe = m.submodules.pe = PriorityEncoder(width=len(self.ports))
-        ports = [port for priority, port in sorted(self.ports.items())]
-        
-        # if no transacton in-progress..
-        with m.If(~self.bus.cyc):
-            for i, p in enumerate(ports):
-                m.d.sync += pe.i[i].eq(p.cyc)
+        priorities = sorted(self.ports)
+        ports = [self.ports[prio] for prio in priorities]
+        weights = [self.weights[prio] for prio in priorities]
+        n = len(ports)
+
+        req = Signal(n)
+        comb += req.eq(Cat(*[p.cyc for p in ports]))
 
-        # "winning" port idx is in 'pe.o'
-        source = Array(ports)[pe.o]
+        owner = Signal(range(n)) # port granted in previous cycle
+        locked = Signal() # ... and it's tenure is not over yet
+        pick = Signal(range(n)) # port to be granted, if bus is free
+        grant = Signal(range(n))
+        new_tenure = Signal()
 
-        m.d.comb += [
+        comb += new_tenure.eq(req.any() & ~(locked & req.bit_select(owner, 1)))
+
+        if self.scheme == "priority":
+            # TODO without '= m.submodules.pe' warning: UnusedElaboratable 
+            pe = m.submodules.pe = PriorityEncoder(width=n)
+            comb += [
+                pe.i.eq(req),
+                pick.eq(pe.o),
+            ]
+        else:
+            # search starts right after last owner ('reversed', as the last assignment wins).
+            def round_robin(after):
+                with m.Switch(after):
+                    for o in range(n):
+                        with m.Case(o):
+                            for k in reversed(range(1, n + 1)):
+                                idx = (o + k) % n
+                                with m.If(req[idx]):
+                                    m.d.comb += pick.eq(idx)
+
+            if self.scheme == "round_robin":
+                round_robin(owner)
+            else:
+                # tenures left for current owner, before it has to let others in.
+                credits = Signal(range(max(weights) + 1))
+                round_robin(owner)
+                with m.If(req.bit_select(owner, 1) & (credits != 0)):
+                    comb += pick.eq(owner)
+                with m.If(new_tenure):
+                    with m.If(pick == owner):
+                        with m.If(credits != 0):
+                            sync += credits.eq(credits - 1)
+                    with m.Else():
+                        sync += credits.eq(Array([w - 1 for w in weights])[pick])
+
+        comb += grant.eq(Mux(locked & req.bit_select(owner, 1), owner, pick))
+        sync += locked.eq(self.bus.cyc)
+        with m.If(self.bus.cyc):
+            sync += owner.eq(grant)
+
+        # "winning" port idx is in 'grant'
+        source = Array(ports)[grant]
+
+        comb += [
             self.bus.adr.eq(source.adr),
             self.bus.dat_w.eq(source.dat_w),
             self.bus.sel.eq(source.sel),
             self.bus.cyc.eq(source.cyc),
+            self.bus.stb.eq(source.stb),
             self.bus.we.eq(source.we),
-
-            source.dat_r.eq(self.bus.dat_r),
-            source.ack.eq(self.bus.ack),
+            self.bus.cti.eq(source.cti),
+            self.bus.bte.eq(source.bte),
         ]
+        # responses are for requests accepted in previous cycles, thus for 'owner' - when acked, it's still locked
+        # and granted. Unlike 'grant', 'owner' doesn't depend on 'cyc', so that master may drive 'cyc' from 'ack'.
+        sink = Array(ports)[owner]
+        comb += [
+            sink.dat_r.eq(self.bus.dat_r),
+            sink.ack.eq(self.bus.ack),
+        ]
+
+        # ports that are not granted see 'stall', so that none of their requests is accepted.
+        for i, p in enumerate(ports):
+            comb += p.stall.eq(Mux(grant == i, self.bus.stall, 1))
+
+        for i, prio in enumerate(priorities):
+            name = self.names[prio]
+            grant_ctr = self.ctrs[f"{name}_grant"]
+            wait_ctr = self.ctrs[f"{name}_wait"]
+            max_wait_ctr = self.ctrs[f"{name}_max_wait"]
+            waiting = Signal(32, name=f"ARB_{name}_waiting")
+            with m.If(req[i] & (grant != i)):
+                sync += [
+                    wait_ctr.eq(wait_ctr + 1),
+                    waiting.eq(waiting + 1),
+                ]
+                with m.If(waiting + 1 > max_wait_ctr):
+                    sync += max_wait_ctr.eq(waiting + 1)
+            with m.Else():
+                sync += waiting.eq(0)
+            with m.If(new_tenure & (grant == i)):
+                sync += grant_ctr.eq(grant_ctr + 1)
 
         return m
 
-    def port(self, priority):
+    # 'weight' is used only by "weighted" scheme, 'name' is prefix of port's performance counters.
+    def port(self, priority, weight=1, name=None):
         if priority < 0:
             raise ValueError(f"Negative priority passed! {priority} < 0.")
         if priority in self.ports:
             raise ValueError("Conflicting priority passed to MemoryArbiter.port()")
+        if weight < 1:
+            raise ValueError(f"Port weight must be positive, not {weight}!")
+        name = f"port{priority}" if name is None else name
+        self.weights[priority] = weight
+        self.names[priority] = name
+        for ctr in ["grant", "wait", "max_wait"]:
+            self.ctrs[f"{name}_{ctr}"] = Signal(32, name=f"ARB_{name.upper()}_{ctr.upper()}_CTR")
         port = self.ports[priority] = Record.like(self.bus, name=f"PORT{priority}")
         return port
 
@@ -151,11 +280,17 @@ def prefix_all_signals(obj, prefix):
             sig.name = prefix + sig.name
 
 
-# deasserts 'bus.cyc' if (bus.cyc & bus.ack) holds 
+# Request ('en' with 'addr', 'store', 'mask', 'write_data') is put on 'mem_port' combinationally
+# and accepted in the same cycle if '~busy'. Up to 'max_outstanding' requests may be in flight, each of them
+# is completed by one-cycle 'ack' pulse (in order), with 'read_data' valid since then until next 'ack'.
+# 'en' must be asserted only for one cycle per request (the one with '~busy').
 class LoadStoreUnit(Elaboratable, LoadStoreInterface):
-    def __init__(self, mem_port):
+    def __init__(self, mem_port, max_outstanding=2):
         super().__init__()
+        if max_outstanding < 1:
+            raise ValueError(f"Number of outstanding requests must be positive, not {max_outstanding}!")
         self.mem_port = mem_port
+        self.max_outstanding = max_outstanding
 
     def elaborate(self, platform):
         m = Module()
@@ -163,55 +298,106 @@ class LoadStoreUnit(Elaboratable, LoadStoreInterface):
         comb = m.d.comb
         sync = m.d.sync
 
+        pending = Signal(range(self.max_outstanding + 1))
+        full = Signal()
+        accepted = Signal()
+        read_data = Signal(32)
+
         comb += [
-            self.busy.eq(self.mem_port.cyc),
+            full.eq(pending == self.max_outstanding),
+            self.mem_port.adr.eq(self.addr),
+            self.mem_port.dat_w.eq(self.write_data),
+            self.mem_port.sel.eq(self.mask),
+            self.mem_port.we.eq(self.store),
+            self.mem_port.cti.eq(CycleType.CLASSIC),
+            self.mem_port.bte.eq(BurstType.LINEAR),
+            self.mem_port.stb.eq(self.en & ~full),
+            self.mem_port.cyc.eq(self.en | (pending != 0)),
+
+            accepted.eq(self.mem_port.stb & ~self.mem_port.stall),
+            self.busy.eq(~accepted),
+
+            self.ack.eq(self.mem_port.ack),
+            self.read_data.eq(Mux(self.mem_port.ack, self.mem_port.dat_r, read_data)),
         ]
 
-        # suppress ack signals (asserted during one cycle).
-        with m.If(self.ack):
-            sync += [
-                self.ack.eq(0)
-            ]
+        with m.If(self.mem_port.ack):
+            sync += read_data.eq(self.mem_port.dat_r)
 
-        with m.FSM() as fsm:
-            with m.State("IDLE"):
-                sync += [
-                    self.mem_port.adr.eq(self.addr),
-                    self.mem_port.dat_w.eq(self.write_data),
-                    self.mem_port.sel.eq(self.mask),
-                    self.mem_port.we.eq(self.store),
-                ]
-                with m.If(self.en):
-                    sync += self.mem_port.cyc.eq(1)
-                    m.next = "WAIT_MEM"
-                with m.Else():
-                    m.next = "IDLE"
-            with m.State("WAIT_MEM"):
-                with m.If(self.mem_port.ack):
-                    sync += [
-                        self.mem_port.cyc.eq(0),
-                        self.ack.eq(1),
-                        self.read_data.eq(self.mem_port.dat_r),
-                    ]
-                    m.next = "WAIT_ACK"
-                with m.Else():
-                    m.next = "WAIT_MEM"
-            with m.State("WAIT_ACK"):
-                # it should took one cycle.
-                with m.If(~self.en):
-                    m.next = "IDLE"
-                with m.Else():
-                    m.next = "WAIT_ACK"
+        sync += pending.eq(pending + accepted - self.mem_port.ack)
 
         return m
 
-class MemoryUnit(Elaboratable):
-    def __init__(self, mem_port):
+# Store buffer entry. Bytes of 'data' not selected by 'mask' are meaningless.
+store_buffer_layout = [
+    ("addr", 32),
+    ("data", 32),
+    ("mask",  4),
+]
+
+
+def byte_mask(sel):
+    return Cat(*[Repl(sel[i], 8) for i in range(4)])
+
+# Load queue entry - destination register, and load's 'funct3' and data (valid once acked by memory).
+load_queue_layout = [
+    ("rd",      5),
+    ("funct3",  3),
+    ("data",   32),
+]
+
+# Assigns 'data' loaded from memory, extended according to load's 'funct3', to 'res'.
+def extend_load(m, funct3, data, res):
+    word = Signal(signed(32))
+    half_word = Signal(signed(16))
+    byte = Signal(8)
+    m.d.comb += [
+        word.eq(data),
+        half_word.eq(data[0:16]),
+        byte.eq(data[0:8]),
+    ]
+    with m.Switch(funct3):
+        with m.Case(Funct3.W):
+            m.d.comb += res.eq(word)
+        with m.Case(Funct3.H):
+            m.d.comb += res.eq(half_word)
+        with m.Case(Funct3.B):
+            m.d.comb += res.eq(byte)
+        with m.Case(Funct3.HU):
+            m.d.comb += res.eq(Cat(half_word, 0))
+        with m.Case(Funct3.BU):
+            m.d.comb += res.eq(Cat(byte, 0))
 
-        self.loadstore = LoadStoreUnit(mem_port)
+
+class MemoryUnit(Elaboratable):
+    # 'dcache' - optional 'DataCache' instance (connected to the same 'mem_port'), used instead of plain 'LoadStoreUnit'.
+    # 'store_buffer_depth' - when non-zero, stores are acked as soon as they are put in buffer of given depth,
+    # which is drained in background (see 'elaborate_store_buffer').
+    # 'pending_loads' - when non-zero, loads are acked as soon as they are issued, and up to 'pending_loads'
+    # of them complete in background (see 'elaborate_load_queue').
+    def __init__(self, mem_port, dcache=None, store_buffer_depth=0, pending_loads=0):
+        if store_buffer_depth and pending_loads:
+            raise ValueError("Store buffer cannot be used together with non-blocking loads.")
+
+        self.dcache = dcache
+        self.loadstore = LoadStoreUnit(mem_port, max_outstanding=max(2, pending_loads)) if dcache is None else dcache
+        self.store_buffer_depth = store_buffer_depth
+        self.pending_loads = pending_loads
+        if pending_loads:
+            self.load_queue = [Record(load_queue_layout, name=f"LQ_entry{i}") for i in range(pending_loads)]
+            self.load_queue_level = Signal(range(pending_loads + 1), name="LQ_level")
+        if store_buffer_depth:
+            self.store_buffer = [Record(store_buffer_layout, name=f"SB_entry{i}") for i in range(store_buffer_depth)]
+            self.store_buffer_level = Signal(range(store_buffer_depth + 1), name="SB_level")
+
+            # stores combined with already buffered one, loads served from buffer, and cycles stores waited for free entry.
+            self.merge_ctr = Signal(32, name="SB_MERGE_CTR")
+            self.forward_ctr = Signal(32, name="SB_FORWARD_CTR")
+            self.full_ctr = Signal(32, name="SB_FULL_CTR")
         
         # Input signals.
         self.store = Signal() # assume 'load' if deasserted.
+        self.fence = Signal(name="LD_ST_fence") # write back all dirty data (no-op if there is no data cache).
         self.funct3 = Signal(Funct3)
         self.src1 = Signal(32, name="LD_ST_src1")
 
@@ -224,6 +410,23 @@ class MemoryUnit(Elaboratable):
 
         # Output signals.
         self.ack = Signal(name="LD_ST_ack")
+
+        # Non-blocking loads only - destination register of issued load, and the oldest completed load,
+        # written back to 'load_rd' when 'load_pop' is asserted.
+        self.rd = Signal(5, name="LD_ST_rd")
+        self.load_valid = Signal(name="LD_ST_load_valid")
+        self.load_rd = Signal(5, name="LD_ST_load_rd")
+        self.load_res = Signal(32, name="LD_ST_load_res")
+        self.load_pop = Signal(name="LD_ST_load_pop")
+
+    # Simulation only - returns list of (address, data, mask) of buffered stores (not yet acked by memory), oldest first.
+    def sim_buffered_stores(self):
+        res = []
+        if self.store_buffer_depth:
+            level = yield self.store_buffer_level
+            for entry in self.store_buffer[:level]:
+                res.append(((yield entry.addr), (yield entry.data), (yield entry.mask)))
+        return res
         
 
     def elaborate(self, platform):
@@ -257,31 +460,16 @@ class MemoryUnit(Elaboratable):
 
         load_res = Signal(signed(32))
 
-        with m.If(store):
-            comb += [
-                word.eq(self.src2),
-                half_word.eq(self.src2[0:16]),
-                byte.eq(self.src2[0:8]),
-            ]
-        with m.Else():
-            comb += [
-                word.eq(loadstore.read_data),
-                half_word.eq(loadstore.read_data[0:16]),
-                byte.eq(loadstore.read_data[0:8]),
-            ]
+        # data of load served from store buffer.
+        forward = Signal()
+        forward_data = Signal(32)
 
-        with m.If(~store):
-            with m.Switch(self.funct3):
-                with m.Case(Funct3.W):
-                    comb += load_res.eq(word)
-                with m.Case(Funct3.H):
-                    comb += load_res.eq(half_word)
-                with m.Case(Funct3.B):
-                    comb += load_res.eq(byte)
-                with m.Case(Funct3.HU):
-                    comb += load_res.eq(Cat(half_word, 0))
-                with m.Case(Funct3.BU):
-                    comb += load_res.eq(Cat(byte, 0))
+        comb += [
+            word.eq(self.src2),
+            half_word.eq(self.src2[0:16]),
+            byte.eq(self.src2[0:8]),
+        ]
+        extend_load(m, self.funct3, Mux(forward, forward_data, loadstore.read_data), load_res)
 
 
         with m.If(store):
@@ -305,28 +493,231 @@ class MemoryUnit(Elaboratable):
         
 
 
+        if self.store_buffer_depth:
+            # loads and fences have to wait for stores in buffer.
+            hold, drain = self.elaborate_store_buffer(m, addr, sel.mask, write_data, load_res, forward, forward_data)
+        elif self.pending_loads:
+            # stores and fences have to wait for loads in flight.
+            hold, issue_load = self.elaborate_load_queue(m)
+            drain = Const(0)
+        else:
+            hold, drain = Const(0), Const(0)
+
         with m.FSM() as fsm:
             with m.State("IDLE"):
-                with m.If(self.en):
-                    sync += [
+                if self.dcache is None:
+                    # nothing to write back, ack immediately.
+                    with m.If(self.en & self.fence & ~hold):
+                        comb += self.ack.eq(1)
+                    start = self.en & ~self.fence & ~hold
+                else:
+                    comb += loadstore.fence.eq(self.fence & ~hold)
+                    start = self.en & ~hold
+                with m.If(start):
+                    comb += [
                         loadstore.en.eq(1),
                         loadstore.store.eq(store),
                         loadstore.addr.eq(addr),
                         loadstore.mask.eq(sel.mask),
                         loadstore.write_data.eq(write_data), 
                     ]
-                    m.next = "WAIT"
-                with m.Else():
-                    m.next = "IDLE"
+                    with m.If(~loadstore.busy):
+                        if self.pending_loads:
+                            with m.If(~store & ~self.fence):
+                                comb += [
+                                    self.ack.eq(1),
+                                    issue_load.eq(1),
+                                ]
+                            with m.Else():
+                                m.next = "WAIT"
+                        else:
+                            m.next = "WAIT"
             with m.State("WAIT"):
-                with m.If(loadstore.ack):
+                # acks of drained stores (issued earlier) come first.
+                with m.If(loadstore.ack & ~drain):
                     comb += [
                         self.ack.eq(1),
                         self.res.eq(load_res),
                     ]
-                    sync += [
-                        loadstore.en.eq(0)
-                    ]
                     m.next = "IDLE"
 
         return m
+
+    # Load queue (FIFO) - load is acked as soon as it's request is accepted by 'loadstore', and put into queue
+    # together with it's destination register. Data returned by memory (in order) is stored in the oldest entry
+    # not acked yet, the oldest entry is written back by CPU ('load_valid', 'load_pop') once it's data is there.
+    # Stores and fences wait until all loads are acked, loads wait for free entry.
+    # Returns signals: 'hold' - request cannot go through 'loadstore' now, and 'issue_load' - to be asserted
+    # when load request is accepted.
+    def elaborate_load_queue(self, m):
+        comb = m.d.comb
+        sync = m.d.sync
+        loadstore = self.loadstore
+
+        depth = self.pending_loads
+        entries = self.load_queue
+        level = self.load_queue_level
+
+        hold = Signal(name="LQ_hold")
+        issue_load = Signal(name="LQ_issue")
+        inflight = Signal(range(depth + 1), name="LQ_inflight") # entries not acked yet (the newest ones).
+        push = Signal()
+        pop = Signal()
+        ack = Signal()
+        ack_idx = Signal(range(depth + 1))
+
+        comb += [
+            hold.eq(self.en & Mux(self.store | self.fence, inflight != 0, level == depth)),
+            push.eq(issue_load),
+            ack.eq(loadstore.ack & (inflight != 0)),
+            ack_idx.eq(level - inflight),
+
+            self.load_valid.eq(level != inflight),
+            self.load_rd.eq(entries[0].rd),
+            pop.eq(self.load_valid & self.load_pop),
+        ]
+        extend_load(m, entries[0].funct3, entries[0].data, self.load_res)
+
+        sync += [
+            inflight.eq(inflight + push - ack),
+            level.eq(level + push - pop),
+        ]
+        for i, entry in enumerate(entries):
+            if i + 1 < depth:
+                with m.If(pop):
+                    sync += entry.eq(entries[i + 1])
+            with m.If(push & Mux(pop, level == i + 1, level == i)):
+                sync += [
+                    entry.rd.eq(self.rd),
+                    entry.funct3.eq(self.funct3),
+                ]
+            with m.If(ack & Mux(pop, ack_idx == i + 1, ack_idx == i)):
+                sync += entry.data.eq(loadstore.read_data)
+
+        return hold, issue_load
+
+    # Store buffer - stores are acked as soon as they are put into buffer (FIFO), or combined with buffered store
+    # to the same address. Buffer is drained (oldest first, many stores may be in flight) whenever 'loadstore'
+    # is not used by load, entries already issued (or being issued) are never combined.
+    # Load from address of buffered store is served from buffer, if that store covers all of load's bytes,
+    # otherwise (or when there are more stores to the same word) load waits until they are drained.
+    # Returns signals: 'hold' - request cannot go through 'loadstore' now, and 'drain' - drained stores are in flight.
+    def elaborate_store_buffer(self, m, addr, mask, write_data, load_res, forward, forward_data):
+        comb = m.d.comb
+        sync = m.d.sync
+        loadstore = self.loadstore
+
+        depth = self.store_buffer_depth
+        entries = self.store_buffer
+        level = self.store_buffer_level
+
+        hold = Signal(name="SB_hold")
+        drain = Signal(name="SB_drain")
+        issued = Signal(range(depth + 1), name="SB_issued") # entries drained, but not acked yet.
+        drain_req = Signal() # drain request was not accepted yet, it has to be kept.
+        pop = Signal()
+        push = Signal()
+        merge = Signal()
+        merge_idx = Signal(range(depth))
+        fwd_idx = Signal(range(depth))
+        conflict = Signal()
+
+        word_match = [Signal(name=f"SB_word_match{i}") for i in range(depth)]
+        exact_match = [Signal(name=f"SB_exact_match{i}") for i in range(depth)]
+        for i, entry in enumerate(entries):
+            comb += [
+                word_match[i].eq((i < level) & (entry.addr[2:] == addr[2:])),
+                exact_match[i].eq(word_match[i] & (entry.addr == addr)),
+            ]
+        # ('reversed', as the last assignment wins)
+        mergeable = [exact_match[i] & (issued < i) for i in range(depth)]
+        for i in reversed(range(depth)):
+            with m.If(exact_match[i]):
+                comb += fwd_idx.eq(i)
+            with m.If(mergeable[i]):
+                comb += merge_idx.eq(i)
+
+        n_matches = sum(word_match)
+        can_merge = reduce(or_, mergeable)
+        fwd_entry = Array(entries)[fwd_idx]
+        merge_entry = Array(entries)[merge_idx]
+
+        comb += [
+            conflict.eq(n_matches != 0),
+            forward_data.eq(fwd_entry.data),
+        ]
+
+        request = self.en & ~self.fence
+        load = request & ~self.store
+        with m.If(request & self.store):
+            with m.If(can_merge):
+                comb += [
+                    merge.eq(1),
+                    self.ack.eq(1),
+                ]
+                sync += self.merge_ctr.eq(self.merge_ctr + 1)
+            with m.Elif((level != depth) | pop):
+                comb += [
+                    push.eq(1),
+                    self.ack.eq(1),
+                ]
+            with m.Else():
+                sync += self.full_ctr.eq(self.full_ctr + 1)
+        with m.Elif(load & conflict):
+            with m.If((n_matches == 1) & reduce(or_, exact_match) & ((fwd_entry.mask & mask) == mask)):
+                comb += [
+                    forward.eq(1),
+                    self.ack.eq(1),
+                    self.res.eq(load_res),
+                ]
+                sync += self.forward_ctr.eq(self.forward_ctr + 1)
+
+        # stores never go directly through 'loadstore'.
+        comb += hold.eq(
+            drain_req
+            | (self.en & self.store)
+            | (self.en & self.fence & (level != 0))
+            | (load & conflict)
+        )
+
+        # issue oldest entry not issued yet (pending load always goes first).
+        next_entry = Array(entries)[issued]
+        drain_start = Signal()
+        with m.If((issued != level) & (drain_req | ~(load & ~hold))):
+            comb += [
+                loadstore.en.eq(1),
+                loadstore.store.eq(1),
+                loadstore.addr.eq(next_entry.addr),
+                loadstore.mask.eq(next_entry.mask),
+                loadstore.write_data.eq(next_entry.data),
+                drain_start.eq(~loadstore.busy),
+            ]
+            sync += drain_req.eq(loadstore.busy)
+        with m.Else():
+            sync += drain_req.eq(0)
+
+        comb += [
+            drain.eq(issued != 0),
+            pop.eq(drain & loadstore.ack),
+        ]
+        sync += [
+            issued.eq(issued + drain_start - pop),
+            level.eq(level + push - pop),
+        ]
+        for i, entry in enumerate(entries):
+            if i + 1 < depth:
+                with m.If(pop):
+                    sync += entry.eq(entries[i + 1])
+            with m.If(push & Mux(pop, level == i + 1, level == i)):
+                sync += [
+                    entry.addr.eq(addr),
+                    entry.data.eq(write_data),
+                    entry.mask.eq(mask),
+                ]
+            with m.If(merge & Mux(pop, merge_idx == i + 1, merge_idx == i)):
+                sync += [
+                    entry.data.eq((merge_entry.data & ~byte_mask(mask)) | (write_data & byte_mask(mask))),
+                    entry.mask.eq(merge_entry.mask | mask),
+                ]
+
+        return hold, drain
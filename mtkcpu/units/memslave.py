@@ -0,0 +1,164 @@
+from nmigen import *
+from nmigen.hdl.rec import *
+
+from units.icache import LFSR
+
+
+# Pipelined Wishbone slave model of external memory, used by testbench instead of Python process.
+# Memory is sparse, looked up by whole address, so that (as in 'mem_dict' of the testbench) sub-word
+# addresses are distinct words, and address never written nor initialized reads as zero:
+# * 'init' - dict (address -> 4 byte word), is a constant lookup table,
+# * stored words take 'nslots' (address, word) slots, in order of first store to given address,
+#   that shadow 'init' (if there is no slot left, store is lost and 'error' is set).
+# 'sel' are byte enables (unselected bytes read as zero).
+#
+# Accepted requests are completed in order, up to 'max_pending' of them wait ('stall' is asserted when full):
+# * 'latency' given - each one is acked 'latency' cycles after it was accepted, 'stall' is never asserted otherwise,
+# * 'latency' is None - oldest request is acked in each cycle with probability 'p', and new requests are stalled
+#   with probability 'p_stall', both drawn from LFSR (seeded with 'seed').
+#
+# 'error' is sticky, it's also set when 'cyc' gets deasserted with requests pending.
+class MemorySlave(Elaboratable):
+    def __init__(self, bus, init={}, nslots=16, latency=None, p=.4, p_stall=.2, seed=1, max_pending=4):
+        if nslots < 1:
+            raise ValueError(f"Memory needs at least one slot for stores, not {nslots}!")
+        if latency is not None and latency < 1:
+            raise ValueError(f"Memory latency must be positive, not {latency}!")
+        for name, val in [("p", p), ("p_stall", p_stall)]:
+            if not 0 <= val <= 1:
+                raise ValueError(f"Probability '{name}' must be in range 0..1, not {val}!")
+        if not p and latency is None:
+            raise ValueError("Requests would never complete with 'p' = 0!")
+
+        self.bus = bus
+        self.init = { addr: data & 0xFFFF_FFFF for addr, data in init.items() }
+        self.nslots = nslots
+        self.latency = latency
+        # thresholds for 8 bits of LFSR.
+        self.p = min(round(p * 256), 256)
+        self.p_stall = min(round(p_stall * 256), 256)
+        self.seed = seed
+        self.max_pending = max_pending
+
+        self.slots = [
+            Record([("addr", 32), ("data", 32)], name=f"MEM_slot{i}")
+            for i in range(nslots)
+        ]
+        self.used = Signal(range(nslots + 1), name="MEM_used")
+
+        # Output signals.
+        self.error = Signal(name="MEM_error")
+
+    # Simulation only - returns dict of (address, value) of all words, that were either initialized or written.
+    def sim_words(self):
+        res = dict(self.init)
+        used = yield self.used
+        for slot in self.slots[:used]:
+            res[(yield slot.addr)] = (yield slot.data)
+        return res
+
+    # Simulation only - loads 'words' (dict address -> 4 byte word) into slots, as if they were stored
+    # (in addition to 'init'). Meant to be called at the beginning of simulation (after reset), so that
+    # the same elaborated memory can be reused with other content.
+    def sim_load(self, words):
+        if len(words) > self.nslots:
+            raise ValueError(f"{len(words)} words don't fit in {self.nslots} slots!")
+        for slot, (addr, data) in zip(self.slots, words.items()):
+            yield slot.addr.eq(addr)
+            yield slot.data.eq(data & 0xFFFF_FFFF)
+        yield self.used.eq(len(words))
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+        bus = self.bus
+
+        # pending requests are kept in shift register, oldest one at the head.
+        depth = self.max_pending
+        pending_layout = [("adr", 32), ("we", 1), ("dat_w", 32), ("sel", 4), ("stamp", 16)]
+        pending = [Record(pending_layout, name=f"MEM_pending{i}") for i in range(depth)]
+        head = pending[0]
+        level = Signal(range(depth + 1))
+        kept = Signal(range(depth + 1))
+
+        accept = Signal()
+        complete = Signal()
+        req = Record(pending_layout)
+
+        if self.latency is None:
+            lfsr = m.submodules.lfsr = LFSR()
+            lfsr.o.reset = self.seed
+            comb += [
+                complete.eq((level != 0) & (lfsr.o[0:8] < self.p)),
+                bus.stall.eq((level == depth) | (lfsr.o[8:16] < self.p_stall)),
+            ]
+        else:
+            # cycles since reset, requests are stamped with it.
+            now = Signal(16)
+            sync += now.eq(now + 1)
+            comb += [
+                req.stamp.eq(now),
+                complete.eq((level != 0) & ((now - head.stamp)[0:16] >= self.latency)),
+                bus.stall.eq(level == depth),
+            ]
+        comb += [
+            accept.eq(bus.cyc & bus.stb & ~bus.stall),
+            kept.eq(level - complete),
+            req.adr.eq(bus.adr),
+            req.we.eq(bus.we),
+            req.dat_w.eq(bus.dat_w),
+            req.sel.eq(bus.sel),
+        ]
+
+        for i, entry in enumerate(pending):
+            with m.If(accept & (kept == i)):
+                sync += entry.eq(req)
+            if i + 1 < depth:
+                with m.Elif(complete):
+                    sync += entry.eq(pending[i + 1])
+        sync += level.eq(kept + accept)
+
+        with m.If(~bus.cyc & (level != 0)):
+            sync += self.error.eq(1)
+
+        # completes oldest request.
+        mask = Cat(*[Repl(head.sel[i], 8) for i in range(4)])
+        hits = Signal(self.nslots)
+        word = Signal(32)
+        comb += [
+            hits.eq(Cat(*[(i < self.used) & (slot.addr == head.adr) for i, slot in enumerate(self.slots)])),
+            bus.ack.eq(complete),
+            bus.dat_r.eq(word & mask),
+        ]
+        with m.If(hits.any()):
+            for slot, hit in zip(self.slots, hits):
+                with m.If(hit):
+                    comb += word.eq(slot.data)
+        with m.Else():
+            with m.Switch(head.adr):
+                for addr, data in self.init.items():
+                    with m.Case(addr):
+                        comb += word.eq(data)
+
+        # store goes to the hit slot, or if there is none, to the next unused one.
+        merged = Signal(32)
+        comb += merged.eq((word & ~mask) | (head.dat_w & mask))
+        with m.If(complete & head.we):
+            with m.If(hits.any()):
+                for slot, hit in zip(self.slots, hits):
+                    with m.If(hit):
+                        sync += slot.data.eq(merged)
+            with m.Elif(self.used == self.nslots):
+                sync += self.error.eq(1)
+            with m.Else():
+                sync += self.used.eq(self.used + 1)
+                with m.Switch(self.used):
+                    for i, slot in enumerate(self.slots):
+                        with m.Case(i):
+                            sync += [
+                                slot.addr.eq(head.adr),
+                                slot.data.eq(merged),
+                            ]
+
+        return m
@@ -0,0 +1,162 @@
+from nmigen import *
+
+from isa import Funct3, Funct7, InstrType
+
+
+# RV32M unit. Operation takes one or more cycles - 'en' is held until 'ack' (same as for 'MemoryUnit'),
+# result is valid in 'res' while 'ack' is asserted. If 'ready' is deasserted (e.g. by stalled pipeline),
+# 'ack' and 'res' are held, until result gets consumed.
+#
+# 'multiplier':
+#   "single_cycle" - 33x33 multiplier, result acked in the same cycle (maps to DSP blocks).
+#   "two_cycle" - product of 16-bit halves is registered first, then summed, result acked in the next cycle
+#   (it's not pipelined, next operation is accepted only after result gets consumed).
+# 'divider_radix':
+#   2 or 4 - restoring divider, that produces one or two quotient bits per cycle (32 or 16 cycles),
+#   signs are fixed in one more cycle.
+class MulDivUnit(Elaboratable):
+    def __init__(self, multiplier="single_cycle", divider_radix=2):
+        if multiplier not in ["single_cycle", "two_cycle"]:
+            raise ValueError(f"Unknown multiplier '{multiplier}', use 'single_cycle' or 'two_cycle'.")
+        if divider_radix not in [2, 4]:
+            raise ValueError(f"Divider radix must be 2 or 4, not {divider_radix}!")
+        self.multiplier = multiplier
+        self.divider_radix = divider_radix
+
+        # Input signals.
+        self.en = Signal(name="muldiv_en")
+        self.ready = Signal(name="muldiv_ready", reset=1)
+        self.funct3 = Signal(Funct3)
+        self.src1 = Signal(32, name="muldiv_src1")
+        self.src2 = Signal(32, name="muldiv_src2")
+
+        # Output signals.
+        self.res = Signal(32, name="muldiv_res")
+        self.ack = Signal(name="muldiv_ack")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        funct3 = self.funct3
+        src1, src2 = self.src1, self.src2
+
+        is_div = funct3[2]
+
+        # Multiplication - operands are extended to 33 bits, so that signed and unsigned ones are handled the same way.
+        src1_signed = (funct3 == Funct3.MULH) | (funct3 == Funct3.MULHSU)
+        src2_signed = funct3 == Funct3.MULH
+        a = Cat(src1, src1[31] & src1_signed).as_signed()
+        b = Cat(src2, src2[31] & src2_signed).as_signed()
+        product = Signal(signed(66))
+        mul_res = Signal(32)
+        comb += mul_res.eq(Mux(funct3 == Funct3.MUL, product[0:32], product[32:64]))
+        # partial products of 16-bit halves (signed upper ones), for "two_cycle" multiplier.
+        mul_ll = Signal(32)
+        mul_lh = Signal(signed(34))
+        mul_hl = Signal(signed(34))
+        mul_hh = Signal(signed(34))
+
+        # Division - unsigned restoring algorithm on absolute values, signs are fixed at the end.
+        div_signed = ~funct3[0] # DIV, REM
+        rem_op = funct3[1]      # REM, REMU
+        steps = { 2: 1, 4: 2 }[self.divider_radix]
+        dividend = Signal(32) # shifted out as quotient is shifted in
+        divisor = Signal(32)
+        remainder = Signal(32)
+        neg_quotient = Signal()
+        neg_remainder = Signal()
+        div_ctr = Signal(range(32 // steps + 1))
+
+        quotient, rem = dividend, remainder
+        for _ in range(steps):
+            shifted = Cat(quotient[31], rem)
+            diff = Signal(34)
+            ge = Signal()
+            comb += [
+                diff.eq(shifted - divisor),
+                ge.eq(~diff[33]),
+            ]
+            rem = Mux(ge, diff[0:32], shifted[0:32])
+            quotient = Cat(ge, quotient[0:31])
+
+        div_res = Mux(
+            rem_op,
+            Mux(neg_remainder, -remainder, remainder),
+            Mux(neg_quotient, -dividend, dividend),
+        )
+
+        with m.FSM():
+            with m.State("IDLE"):
+                with m.If(self.en & is_div):
+                    abs1 = Mux(div_signed & src1[31], -src1, src1)
+                    abs2 = Mux(div_signed & src2[31], -src2, src2)
+                    sync += [
+                        dividend.eq(abs1),
+                        divisor.eq(abs2),
+                        remainder.eq(0),
+                        # division by zero gives all ones quotient (-1) and dividend as remainder.
+                        neg_quotient.eq(div_signed & (src1[31] ^ src2[31]) & (src2 != 0)),
+                        neg_remainder.eq(div_signed & src1[31]),
+                        div_ctr.eq(32 // steps),
+                    ]
+                    m.next = "DIV"
+                with m.Elif(self.en):
+                    if self.multiplier == "single_cycle":
+                        # operands are held until result is consumed, so is 'res'.
+                        comb += [
+                            product.eq(a * b),
+                            self.res.eq(mul_res),
+                            self.ack.eq(1),
+                        ]
+                    else:
+                        sync += [
+                            mul_ll.eq(a[0:16] * b[0:16]),
+                            mul_lh.eq(a[0:16] * b[16:33].as_signed()),
+                            mul_hl.eq(a[16:33].as_signed() * b[0:16]),
+                            mul_hh.eq(a[16:33].as_signed() * b[16:33].as_signed()),
+                        ]
+                        m.next = "MUL"
+            if self.multiplier == "two_cycle":
+                with m.State("MUL"):
+                    comb += [
+                        product.eq(mul_ll + ((mul_lh + mul_hl) << 16) + (mul_hh << 32)),
+                        self.res.eq(mul_res),
+                        self.ack.eq(1),
+                    ]
+                    with m.If(~self.en | self.ready):
+                        m.next = "IDLE"
+            with m.State("DIV"):
+                sync += [
+                    dividend.eq(quotient),
+                    remainder.eq(rem),
+                    div_ctr.eq(div_ctr - 1),
+                ]
+                with m.If(div_ctr == 1):
+                    m.next = "DIV_DONE"
+                with m.If(~self.en):
+                    m.next = "IDLE"
+            with m.State("DIV_DONE"):
+                comb += [
+                    self.res.eq(div_res),
+                    self.ack.eq(1),
+                ]
+                with m.If(~self.en | self.ready):
+                    m.next = "IDLE"
+
+        return m
+
+
+from common import matcher
+
+match_muldiv_unit = matcher([
+    (InstrType.ALU, Funct3.MUL,     Funct7.MULDIV),
+    (InstrType.ALU, Funct3.MULH,    Funct7.MULDIV),
+    (InstrType.ALU, Funct3.MULHSU,  Funct7.MULDIV),
+    (InstrType.ALU, Funct3.MULHU,   Funct7.MULDIV),
+    (InstrType.ALU, Funct3.DIV,     Funct7.MULDIV),
+    (InstrType.ALU, Funct3.DIVU,    Funct7.MULDIV),
+    (InstrType.ALU, Funct3.REM,     Funct7.MULDIV),
+    (InstrType.ALU, Funct3.REMU,    Funct7.MULDIV),
+])
@@ -0,0 +1,165 @@
+from nmigen import *
+
+from common import START_ADDR
+from isa import InstrType
+
+
+# Instruction prefetch queue for multi-cycle core. Fetches sequential instructions via 'ibus'
+# ('LoadStoreUnit' or 'InstructionCache') as long as there is free space in queue,
+# so that instruction fetch overlaps with EXECUTE.
+#
+# Queue head is always the instruction at core's 'pc' - on any control transfer
+# 'flush' has to be asserted, that discards queued (and in-flight) instructions and restarts fetching from 'flush_pc'.
+# If branch predictor 'bp' is given, fetching follows predicted control transfers. Otherwise
+# branches are assumed not taken, and fetching stops after 'jal'/'jalr', as they always transfer control.
+# Address of instruction fetched after each one ('pred_next') is kept in queue, for detecting mispredictions.
+# Entry following the head is visible too ('valid2', 'instr2', ...), so that pair of instructions can be popped
+# at once ('pop2', together with 'pop'), e.g. for macro-op fusion.
+class PrefetchUnit(Elaboratable):
+    def __init__(self, ibus, depth=2, bp=None):
+        if depth < 1:
+            raise ValueError(f"Prefetch queue depth must be positive, not {depth}!")
+
+        self.ibus = ibus
+        self.depth = depth
+        self.bp = bp
+        self.index_bits = 0 if bp is None else bp.pht_bits
+
+        # Input signals.
+        self.pop = Signal(name="PREFETCH_pop")
+        self.pop2 = Signal(name="PREFETCH_pop2")
+        self.flush = Signal(name="PREFETCH_flush")
+        self.flush_pc = Signal(32, name="PREFETCH_flush_pc")
+        self.hold = Signal(name="PREFETCH_hold") # don't issue new requests
+
+        # Output signals.
+        self.valid = Signal(name="PREFETCH_valid")
+        self.instr = Signal(32, name="PREFETCH_instr")
+        self.pred_next = Signal(32, name="PREFETCH_pred_next")
+        self.pred_index = Signal(self.index_bits, name="PREFETCH_pred_index") # to be passed to 'bp' on update
+        self.valid2 = Signal(name="PREFETCH_valid2")
+        self.instr2 = Signal(32, name="PREFETCH_instr2")
+        self.pred_next2 = Signal(32, name="PREFETCH_pred_next2")
+        self.pred_index2 = Signal(self.index_bits, name="PREFETCH_pred_index2")
+
+        # Performance counters.
+        self.occupancy_ctr = Signal(32, name="PREFETCH_OCCUPANCY_CTR") # sum of queue level over all cycles
+        self.flush_ctr = Signal(32, name="PREFETCH_FLUSH_CTR")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+        ibus = self.ibus
+        depth = self.depth
+        bp = self.bp
+
+        fetch_pc = Signal(32, reset=START_ADDR)
+        kill = Signal() # in-flight fetch was issued before flush, drop it's result
+        stop = Signal() # unconditional jump was fetched, wait for flush
+
+        # prediction made for in-flight fetch.
+        f_taken = Signal()
+        f_next = Signal(32)
+        f_index = Signal(self.index_bits)
+
+        entry_layout = [("instr", 32), ("pred_next", 32), ("pred_index", self.index_bits)]
+        queue = Array([Record(entry_layout, name=f"queue{i}") for i in range(depth)])
+        rd_ptr = Signal(range(depth))
+        wr_ptr = Signal(range(depth))
+        level = Signal(range(depth + 1))
+        push = Signal()
+
+        next_ptr = lambda ptr: Mux(ptr == depth - 1, 0, ptr + 1)
+
+        comb += [
+            self.valid.eq(level != 0),
+            self.instr.eq(queue[rd_ptr].instr),
+            self.pred_next.eq(queue[rd_ptr].pred_next),
+            self.pred_index.eq(queue[rd_ptr].pred_index),
+            self.valid2.eq(level >= 2),
+            self.instr2.eq(queue[next_ptr(rd_ptr)].instr),
+            self.pred_next2.eq(queue[next_ptr(rd_ptr)].pred_next),
+            self.pred_index2.eq(queue[next_ptr(rd_ptr)].pred_index),
+        ]
+
+        taken = Signal()
+        target = Signal(32)
+        if bp is not None:
+            comb += [
+                bp.pc.eq(fetch_pc),
+                taken.eq(bp.taken),
+                target.eq(bp.target),
+            ]
+
+        # unconditional jump arrives (and will be pushed) in that cycle.
+        jump = Signal()
+        opcode = ibus.read_data[0:7]
+        comb += jump.eq(((opcode == InstrType.JAL) | (opcode == InstrType.JALR)) & ~f_taken)
+
+        def issue(cond):
+            with m.If(~self.flush & ~self.hold & cond):
+                m.d.comb += [
+                    ibus.en.eq(1),
+                    ibus.store.eq(0),
+                    ibus.addr.eq(fetch_pc),
+                    ibus.mask.eq(0b1111),
+                ]
+                with m.If(~ibus.busy):
+                    next_pc = Mux(taken, target, fetch_pc + 4)
+                    m.d.sync += [
+                        fetch_pc.eq(next_pc),
+                        f_taken.eq(taken),
+                        f_next.eq(next_pc),
+                    ]
+                    if bp is not None:
+                        m.d.comb += bp.fetch.eq(1)
+                        m.d.sync += f_index.eq(bp.index)
+                    m.next = "WAIT_FETCH"
+
+        with m.FSM():
+            with m.State("FETCH"):
+                issue(~stop & (level < depth))
+            with m.State("WAIT_FETCH"):
+                with m.If(self.flush):
+                    sync += kill.eq(1)
+                with m.If(ibus.ack):
+                    sync += kill.eq(0)
+                    comb += push.eq(~kill & ~self.flush)
+                    m.next = "FETCH"
+                    # next request goes in the same cycle, if there will be space for it.
+                    issue(~kill & ~stop & ~jump & (level + 1 - self.pop - self.pop2 < depth))
+
+        with m.If(self.flush):
+            sync += [
+                fetch_pc.eq(self.flush_pc),
+                stop.eq(0),
+                rd_ptr.eq(0),
+                wr_ptr.eq(0),
+                level.eq(0),
+                self.flush_ctr.eq(self.flush_ctr + 1),
+            ]
+        with m.Else():
+            with m.If(push):
+                sync += [
+                    queue[wr_ptr].instr.eq(ibus.read_data),
+                    queue[wr_ptr].pred_next.eq(f_next),
+                    queue[wr_ptr].pred_index.eq(f_index),
+                    wr_ptr.eq(next_ptr(wr_ptr)),
+                ]
+                with m.If(jump):
+                    sync += [
+                        stop.eq(1),
+                        # nothing was fetched after it - odd address never matches jump target, forcing flush
+                        # (even if it jumps to the next instruction).
+                        queue[wr_ptr].pred_next.eq(f_next | 1),
+                    ]
+            with m.If(self.pop2):
+                sync += rd_ptr.eq(next_ptr(next_ptr(rd_ptr)))
+            with m.Elif(self.pop):
+                sync += rd_ptr.eq(next_ptr(rd_ptr))
+            sync += level.eq(level + push - self.pop - self.pop2)
+
+        sync += self.occupancy_ctr.eq(self.occupancy_ctr + level)
+
+        return m
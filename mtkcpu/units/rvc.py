@@ -0,0 +1,180 @@
+from nmigen import *
+
+from isa import Funct3, Funct7, InstrType
+
+# Builders of 32-bit instruction formats - register and immediate fields are nMigen values.
+def r_type(opcode, rd, funct3, rs1, rs2, funct7):
+    return Cat(Const(opcode.value, 7), rd, Const(funct3.value, 3), rs1, rs2, Const(funct7.value, 7))
+
+def i_type(opcode, rd, funct3, rs1, imm):
+    return Cat(Const(opcode.value, 7), rd, Const(funct3.value, 3), rs1, imm[0:12])
+
+def s_type(opcode, funct3, rs1, rs2, imm):
+    return Cat(Const(opcode.value, 7), imm[0:5], Const(funct3.value, 3), rs1, rs2, imm[5:12])
+
+def b_type(funct3, rs1, rs2, imm):
+    return Cat(Const(InstrType.BRANCH.value, 7), imm[11], imm[1:5], Const(funct3.value, 3), rs1, rs2, imm[5:11], imm[12])
+
+def u_type(opcode, rd, imm):
+    return Cat(Const(opcode.value, 7), rd, imm[0:20])
+
+def j_type(rd, imm):
+    return Cat(Const(InstrType.JAL.value, 7), rd, imm[12:20], imm[11], imm[1:11], imm[20])
+
+def reg(num):
+    return Const(num, 5)
+
+
+# Expands 16-bit instruction of RV32C extension to it's 32-bit equivalent, so that rest of the CPU
+# (decoder and units) doesn't know about compressed encoding. Purely combinational.
+# 'illegal' is set for reserved encodings, instructions of RV64C and floating-point loads/stores,
+# and for 32-bit instructions (lowest two bits set) - those are not meant to be passed here.
+class CompressedExpander(Elaboratable):
+    def __init__(self):
+        # Input signals.
+        self.instr = Signal(16, name="rvc_instr")
+
+        # Output signals.
+        self.res = Signal(32, name="rvc_res")
+        self.illegal = Signal(name="rvc_illegal")
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+
+        i = self.instr
+        rd = i[7:12]  # also 'rs1' of CI and CR formats
+        rs2 = i[2:7]
+        # 3-bit fields address registers x8..x15.
+        rd_ = Cat(i[7:10], Const(0b01, 2))  # 'rs1'' or 'rd'' at [9:7]
+        rs2_ = Cat(i[2:5], Const(0b01, 2))  # 'rs2'' or 'rd'' at [4:2]
+
+        imm6 = Signal(12)       # c.addi, c.li, c.andi - sign extended
+        shamt = Signal(12)      # c.slli, c.srli - 'funct7' bits are zero
+        lui_imm = Signal(20)    # c.lui - sign extended nzimm[17:12]
+        addi16sp_imm = Signal(12)
+        addi4spn_imm = Signal(12)
+        lw_imm = Signal(12)     # c.lw, c.sw
+        lwsp_imm = Signal(12)
+        swsp_imm = Signal(12)
+        j_imm = Signal(21)      # c.j, c.jal
+        b_imm = Signal(13)      # c.beqz, c.bnez
+        comb += [
+            imm6.eq(Cat(i[2:7], Repl(i[12], 7))),
+            shamt.eq(i[2:7]),
+            lui_imm.eq(Cat(i[2:7], Repl(i[12], 15))),
+            addi16sp_imm.eq(Cat(Const(0, 4), i[6], i[2], i[5], i[3:5], Repl(i[12], 3))),
+            addi4spn_imm.eq(Cat(Const(0, 2), i[6], i[5], i[11:13], i[7:11])),
+            lw_imm.eq(Cat(Const(0, 2), i[6], i[10:13], i[5])),
+            lwsp_imm.eq(Cat(Const(0, 2), i[4:7], i[12], i[2:4])),
+            swsp_imm.eq(Cat(Const(0, 2), i[9:13], i[7:9])),
+            j_imm.eq(Cat(Const(0, 1), i[3:6], i[11], i[2], i[7], i[6], i[9:11], i[8], Repl(i[12], 10))),
+            b_imm.eq(Cat(Const(0, 1), i[3:5], i[10:12], i[2], i[5:7], Repl(i[12], 5))),
+        ]
+
+        res = self.res
+        illegal = self.illegal
+        # quadrant, then 'funct3' at [15:13].
+        with m.Switch(i[0:2]):
+            with m.Case(0b00):
+                with m.Switch(i[13:16]):
+                    with m.Case(0b000): # c.addi4spn
+                        comb += [
+                            res.eq(i_type(InstrType.OP_IMM, rs2_, Funct3.ADDI, reg(2), addi4spn_imm)),
+                            illegal.eq(addi4spn_imm == 0),
+                        ]
+                    with m.Case(0b010): # c.lw
+                        comb += res.eq(i_type(InstrType.LOAD, rs2_, Funct3.W, rd_, lw_imm))
+                    with m.Case(0b110): # c.sw
+                        comb += res.eq(s_type(InstrType.STORE, Funct3.W, rd_, rs2_, lw_imm))
+                    with m.Default():
+                        comb += illegal.eq(1)
+            with m.Case(0b01):
+                with m.Switch(i[13:16]):
+                    with m.Case(0b000): # c.addi, c.nop
+                        comb += res.eq(i_type(InstrType.OP_IMM, rd, Funct3.ADDI, rd, imm6))
+                    with m.Case(0b001): # c.jal
+                        comb += res.eq(j_type(reg(1), j_imm))
+                    with m.Case(0b010): # c.li
+                        comb += res.eq(i_type(InstrType.OP_IMM, rd, Funct3.ADDI, reg(0), imm6))
+                    with m.Case(0b011):
+                        with m.If(rd == 2): # c.addi16sp
+                            comb += [
+                                res.eq(i_type(InstrType.OP_IMM, reg(2), Funct3.ADDI, reg(2), addi16sp_imm)),
+                                illegal.eq(addi16sp_imm == 0),
+                            ]
+                        with m.Else(): # c.lui
+                            comb += [
+                                res.eq(u_type(InstrType.LUI, rd, lui_imm)),
+                                illegal.eq(lui_imm == 0),
+                            ]
+                    with m.Case(0b100):
+                        with m.Switch(i[10:12]):
+                            with m.Case(0b00): # c.srli
+                                comb += [
+                                    res.eq(i_type(InstrType.OP_IMM, rd_, Funct3.SRLI, rd_, shamt)),
+                                    illegal.eq(i[12]),
+                                ]
+                            with m.Case(0b01): # c.srai
+                                comb += [
+                                    res.eq(i_type(InstrType.OP_IMM, rd_, Funct3.SRAI, rd_,
+                                        Cat(shamt[0:5], Const(Funct7.SRAI.value, 7)))),
+                                    illegal.eq(i[12]),
+                                ]
+                            with m.Case(0b10): # c.andi
+                                comb += res.eq(i_type(InstrType.OP_IMM, rd_, Funct3.AND, rd_, imm6))
+                            with m.Case(0b11):
+                                with m.Switch(i[5:7]):
+                                    with m.Case(0b00): # c.sub
+                                        comb += res.eq(r_type(InstrType.ALU, rd_, Funct3.SUB, rd_, rs2_, Funct7.SUB))
+                                    with m.Case(0b01): # c.xor
+                                        comb += res.eq(r_type(InstrType.ALU, rd_, Funct3.XOR, rd_, rs2_, Funct7.ADD))
+                                    with m.Case(0b10): # c.or
+                                        comb += res.eq(r_type(InstrType.ALU, rd_, Funct3.OR, rd_, rs2_, Funct7.ADD))
+                                    with m.Case(0b11): # c.and
+                                        comb += res.eq(r_type(InstrType.ALU, rd_, Funct3.AND, rd_, rs2_, Funct7.ADD))
+                                # c.subw and c.addw are RV64C only.
+                                with m.If(i[12]):
+                                    comb += illegal.eq(1)
+                    with m.Case(0b101): # c.j
+                        comb += res.eq(j_type(reg(0), j_imm))
+                    with m.Case(0b110): # c.beqz
+                        comb += res.eq(b_type(Funct3.BEQ, rd_, reg(0), b_imm))
+                    with m.Case(0b111): # c.bnez
+                        comb += res.eq(b_type(Funct3.BNE, rd_, reg(0), b_imm))
+            with m.Case(0b10):
+                with m.Switch(i[13:16]):
+                    with m.Case(0b000): # c.slli
+                        comb += [
+                            res.eq(i_type(InstrType.OP_IMM, rd, Funct3.SLLI, rd, shamt)),
+                            illegal.eq(i[12]),
+                        ]
+                    with m.Case(0b010): # c.lwsp
+                        comb += [
+                            res.eq(i_type(InstrType.LOAD, rd, Funct3.W, reg(2), lwsp_imm)),
+                            illegal.eq(rd == 0),
+                        ]
+                    with m.Case(0b100):
+                        with m.If(~i[12]):
+                            with m.If(rs2 == 0): # c.jr
+                                comb += [
+                                    res.eq(i_type(InstrType.JALR, reg(0), Funct3.JALR, rd, Const(0, 12))),
+                                    illegal.eq(rd == 0),
+                                ]
+                            with m.Else(): # c.mv
+                                comb += res.eq(r_type(InstrType.ALU, rd, Funct3.ADD, reg(0), rs2, Funct7.ADD))
+                        with m.Else():
+                            with m.If((rs2 == 0) & (rd == 0)): # c.ebreak
+                                comb += res.eq(i_type(InstrType.SYSTEM, reg(0), Funct3.ADD, reg(0), Const(1, 12)))
+                            with m.Elif(rs2 == 0): # c.jalr
+                                comb += res.eq(i_type(InstrType.JALR, reg(1), Funct3.JALR, rd, Const(0, 12)))
+                            with m.Else(): # c.add
+                                comb += res.eq(r_type(InstrType.ALU, rd, Funct3.ADD, rd, rs2, Funct7.ADD))
+                    with m.Case(0b110): # c.swsp
+                        comb += res.eq(s_type(InstrType.STORE, Funct3.W, reg(2), rs2, swsp_imm))
+                    with m.Default():
+                        comb += illegal.eq(1)
+            with m.Default():
+                comb += illegal.eq(1)
+
+        return m
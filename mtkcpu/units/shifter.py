@@ -4,28 +4,109 @@ from isa import Funct3, Funct7, InstrType
 from functools import reduce
 from operator import or_
 
+# Shift takes one or more cycles, depending on implementation - 'en' is held until 'ack'
+# (same handshake as for 'MulDivUnit', result is held while 'ready' is deasserted).
+#
+# 'implementation':
+#   "barrel" - fully combinational 32-bit barrel shifter, acked in the same cycle.
+#   "pipelined" - barrel shifter split into two stages (shift by multiple of 4 is registered first),
+#       acked in the next cycle.
+#   "iterative" - shifts by up to 'bits_per_cycle' positions per cycle, shift by 'n' takes
+#       ceil(n / bits_per_cycle) - 1 additional cycles.
 class ShifterUnit(Elaboratable):
-    def __init__(self):
+    def __init__(self, implementation="barrel", bits_per_cycle=1):
+        if implementation not in ["barrel", "pipelined", "iterative"]:
+            raise ValueError(f"Unknown shifter implementation '{implementation}', use 'barrel', 'pipelined' or 'iterative'.")
+        if bits_per_cycle not in [1, 4]:
+            raise ValueError(f"Iterative shifter shifts by 1 or 4 bits per cycle, not {bits_per_cycle}!")
+        self.implementation = implementation
+        self.bits_per_cycle = bits_per_cycle
+
+        self.en = Signal(name="shifter_en")
+        self.ready = Signal(name="shifter_ready", reset=1)
         self.src1 = Signal(32, name="shifter_src1")
-        self.src1signed = Signal(signed(32))
         self.shift = Signal(5, name="shifter_shift") # 5 lowest imm bits
-        self.res = Signal(32, name="shifter_res")
         self.funct3 = Signal(Funct3)
-        
+        self.arithmetic = Signal(name="shifter_arithmetic") # SRA/SRAI, bit 30 of instruction
+
+        self.res = Signal(32, name="shifter_res")
+        self.ack = Signal(name="shifter_ack")
+
+    # shifts 'value' by 'amount' in direction given by 'funct3' and 'arithmetic'.
+    def barrel(self, value, amount):
+        return Mux(
+            self.funct3 == Funct3.SLL,
+            (value << amount)[0:32],
+            Mux(self.arithmetic, value.as_signed() >> amount, value >> amount),
+        )
 
     def elaborate(self, platform):
-        # TODO get rid of S{L/R/A}I (because they are the same as S{L/R/A})
         m = Module()
-        with m.Switch(self.funct3):
-            with m.Case(Funct3.SLL): # | Funct3.SLLI
-                m.d.comb += self.res.eq(self.src1 << self.shift)
-            with m.Case(Funct3.SRL): # | Funct3.SRLI
-                m.d.comb += self.res.eq(self.src1 >> self.shift)
-            with m.Case(Funct3.SRA): # | Funct3.SRAI
-                m.d.comb += [
-                    self.src1signed.eq(self.src1),
-                    self.res.eq(self.src1signed >> self.shift),
-                ]
+        comb = m.d.comb
+        sync = m.d.sync
+
+        if self.implementation == "barrel":
+            comb += [
+                self.res.eq(self.barrel(self.src1, self.shift)),
+                self.ack.eq(self.en),
+            ]
+
+        elif self.implementation == "pipelined":
+            coarse = Signal(32)
+            fine = Signal(2)
+            with m.FSM():
+                with m.State("IDLE"):
+                    with m.If(self.en):
+                        sync += [
+                            coarse.eq(self.barrel(self.src1, Cat(Const(0, 2), self.shift[2:5]))),
+                            fine.eq(self.shift[0:2]),
+                        ]
+                        m.next = "SHIFT"
+                with m.State("SHIFT"):
+                    comb += [
+                        self.res.eq(self.barrel(coarse, fine)),
+                        self.ack.eq(1),
+                    ]
+                    with m.If(~self.en | self.ready):
+                        m.next = "IDLE"
+
+        else:
+            k = self.bits_per_cycle
+            value = Signal(32)
+            remaining = Signal(5)
+            # shifts by 'min(k, amount)'.
+            def step(val, amount):
+                return self.barrel(val, Mux(amount > k, k, amount)[0:3])
+            with m.FSM():
+                with m.State("IDLE"):
+                    with m.If(self.en):
+                        with m.If(self.shift <= k):
+                            comb += [
+                                self.res.eq(step(self.src1, self.shift)),
+                                self.ack.eq(1),
+                            ]
+                        with m.Else():
+                            sync += [
+                                value.eq(step(self.src1, self.shift)),
+                                remaining.eq(self.shift - k),
+                            ]
+                            m.next = "SHIFT"
+                with m.State("SHIFT"):
+                    with m.If(remaining <= k):
+                        comb += [
+                            self.res.eq(step(value, remaining)),
+                            self.ack.eq(1),
+                        ]
+                        with m.If(~self.en | self.ready):
+                            m.next = "IDLE"
+                    with m.Else():
+                        sync += [
+                            value.eq(step(value, remaining)),
+                            remaining.eq(remaining - k),
+                        ]
+                    with m.If(~self.en):
+                        m.next = "IDLE"
+
         return m
 
 
@@ -38,4 +119,4 @@ match_shifter_unit = matcher([
     (InstrType.ALU,     Funct3.SRA,    Funct7.SRA),
     (InstrType.ALU,     Funct3.SRL,    Funct7.SRL),
     (InstrType.ALU,     Funct3.SLL,    Funct7.SLL),
-])
\ No newline at end of file
+])
@@ -0,0 +1,131 @@
+from nmigen import *
+from nmigen.hdl.rec import *
+
+from common import START_ADDR
+from units.loadstore import bus_layout
+
+
+def bytes_to_words(raw):
+    raw = raw + bytes(-len(raw) % 4)
+    return [int.from_bytes(raw[i:i + 4], 'little') for i in range(0, len(raw), 4)]
+
+
+# returns memory (all PT_LOAD type segments) as dictionary (address -> 4 byte word).
+def read_elf_segments(elf_path):
+    from elftools.elf.elffile import ELFFile
+    mem = {}
+    with open(elf_path, 'rb') as handle:
+        elf = ELFFile(handle)
+        # for each segment that is being loaded into memory
+        # retrieve it's data and put in 'mem' dict (both code and program data).
+        for s in elf.iter_segments():
+            if s.header.p_type != 'PT_LOAD':
+                continue
+            file_offset, data_len = s.header.p_offset, s.header.p_memsz
+            load_addr = s.header.p_vaddr
+            handle.seek(file_offset)
+            raw = handle.read(data_len)
+            mem.update((load_addr + 4 * i, word) for i, word in enumerate(bytes_to_words(raw)))
+    return mem
+
+
+# Reads hex image ($readmemh format): one 32-bit word per line, '@<hex>' sets word index
+# (relative to 'base') of next word, '//' starts a comment.
+def read_hex(hex_path, base=START_ADDR):
+    mem = {}
+    idx = 0
+    with open(hex_path) as f:
+        for line in f:
+            for tok in line.split("//")[0].split():
+                if tok.startswith("@"):
+                    idx = int(tok[1:], 16)
+                else:
+                    mem[base + 4 * idx] = int(tok, 16)
+                    idx += 1
+    return mem
+
+
+# Tightly-coupled memory - on-chip 'Memory' of 'size' bytes, mapped at 'base'.
+# 'image' is either dict (address -> 4 byte word, words outside of TCM are skipped),
+# or path of ELF ('.elf') or hex image, that is read at elaboration time.
+#
+# Each 'port()' is a pipelined Wishbone slave bus, that never stalls and acks each request in the next cycle.
+# Ports have separate read ports, thus instruction fetch and data access don't interfere.
+# 'sel' are byte enables of word-aligned address. Request to address, that is not word-aligned (which memory
+# on the bus takes as distinct word), is rejected - it's acked, but doesn't write and reads zero, and sets 'error'.
+#
+# 'error' is sticky.
+class TightlyCoupledMemory(Elaboratable):
+    def __init__(self, base=START_ADDR, size=0x1000, image=None):
+        if size <= 0 or size % 4:
+            raise ValueError(f"TCM size must be positive multiple of 4, not {size}!")
+        if base % 4:
+            raise ValueError(f"TCM base address must be aligned to 4, not {hex(base)}!")
+
+        if image is None:
+            image = {}
+        elif isinstance(image, str):
+            image = read_elf_segments(image) if image.endswith(".elf") else read_hex(image, base=base)
+
+        self.base = base
+        self.size = size
+        self.init = [image.get(base + 4 * i, 0) for i in range(size // 4)]
+        self.mem = Memory(width=32, depth=size // 4, init=self.init)
+        self.ports = []
+
+        # Output signals.
+        self.error = Signal(name="TCM_error")
+
+    # Simulation only - returns dict of (address, value) of all words, that are either non-zero or initialized.
+    def sim_words(self):
+        res = {}
+        for i, init in enumerate(self.init):
+            val = yield self.mem[i]
+            if val or init:
+                res[self.base + 4 * i] = val
+        return res
+
+    # Simulation only - writes words of 'image' (dict address -> 4 byte word), that fall into TCM.
+    def sim_load(self, image):
+        for addr, val in image.items():
+            idx = (addr - self.base) // 4
+            if addr % 4 == 0 and 0 <= idx < len(self.init):
+                yield self.mem[idx].eq(val)
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+        sync = m.d.sync
+
+        for i, (bus, writable) in enumerate(self.ports):
+            rp = m.submodules[f"rp{i}"] = self.mem.read_port()
+            addr = (bus.adr - self.base)[2:]
+            request = bus.cyc & bus.stb
+            misaligned = bus.adr[:2] != 0
+            rejected = Signal(name=f"TCM_rejected{i}") # request acked in this cycle
+            comb += [
+                rp.addr.eq(addr),
+                bus.dat_r.eq(Mux(rejected, 0, rp.data)),
+                bus.stall.eq(0),
+            ]
+            sync += [
+                bus.ack.eq(request),
+                rejected.eq(request & misaligned),
+            ]
+            with m.If(request & misaligned):
+                sync += self.error.eq(1)
+
+            if writable:
+                wp = m.submodules[f"wp{i}"] = self.mem.write_port(granularity=8)
+                comb += [
+                    wp.addr.eq(addr),
+                    wp.data.eq(bus.dat_w),
+                    wp.en.eq(Mux(request & bus.we & ~misaligned, bus.sel, 0)),
+                ]
+
+        return m
+
+    def port(self, writable=True):
+        bus = Record(bus_layout, name=f"TCM_PORT{len(self.ports)}")
+        self.ports.append((bus, writable))
+        return bus
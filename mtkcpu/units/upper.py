@@ -1,3 +1,5 @@
+from nmigen import *
+
 from common import matcher
 from isa import Funct3, InstrType
 
@@ -7,4 +9,58 @@ match_lui = matcher([
 
 match_auipc = matcher([
     (InstrType.AUIPC, ),
-])
\ No newline at end of file
+])
+
+match_addi = matcher([
+    (InstrType.OP_IMM, Funct3.ADDI),
+])
+
+match_jalr = matcher([
+    (InstrType.JALR, Funct3.JALR),
+])
+
+match_lw = matcher([
+    (InstrType.LOAD, Funct3.W),
+])
+
+
+# Detects pair of consecutive instructions, that can be executed as single macro-op:
+# 'lui'+'addi' (32-bit constant), 'auipc'+'jalr' (far call) and 'auipc'+'lw' (PC-relative load).
+# Second instruction has to take it's 'rs1' from 'rd' of the first one, and overwrite it, so that temporary
+# value is never visible - executing the second one with 'base' (value 'rd' would get from the first one)
+# in place of 'rs1' gives the same architectural state. Purely combinational.
+class FusionDetector(Elaboratable):
+    def __init__(self):
+        # Input signals.
+        self.first = Signal(32, name="FUSE_first")
+        self.second = Signal(32, name="FUSE_second")
+
+        # Output signals.
+        self.fuse = Signal(name="FUSE_fuse")
+        self.lui = Signal(name="FUSE_lui")      # first is 'lui' (otherwise 'auipc')
+        self.imm = Signal(32, name="FUSE_imm")  # U-immediate of the first one
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+
+        def fields(instr):
+            return instr[0:7], instr[12:15], instr[25:32]
+
+        first, second = self.first, self.second
+        lui = match_lui(*fields(first))
+        auipc = match_auipc(*fields(first))
+        rd = first[7:12]
+
+        comb += [
+            self.lui.eq(lui),
+            self.imm.eq(Cat(Const(0, 12), first[12:32])),
+            self.fuse.eq(
+                ((lui & match_addi(*fields(second)))
+                    | (auipc & match_jalr(*fields(second)))
+                    | (auipc & match_lw(*fields(second))))
+                & (second[15:20] == rd) & (second[7:12] == rd) & (rd != 0)
+            ),
+        ]
+
+        return m
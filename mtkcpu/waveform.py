@@ -0,0 +1,142 @@
+from collections import deque
+from fnmatch import fnmatchcase
+
+from nmigen.hdl.ast import SignalSet, SignalDict
+from nmigen.hdl.ir import Fragment
+from vcd import VCDWriter
+
+
+# returns dict signal -> dotted hierarchical name (e.g. "cpu.arbiter.bus__cyc") of each signal used by 'fragment',
+# as 'pysim' names them in VCD (without "top" scope). Clock and reset of domains are left out.
+def signal_names(fragment):
+    fragment = Fragment.get(fragment, platform=None).prepare()
+    clocks = SignalSet()
+    names = SignalDict()
+
+    def walk(fragment, hierarchy):
+        for domain in fragment.domains.values():
+            clocks.add(domain.clk)
+            if domain.rst is not None:
+                clocks.add(domain.rst)
+        signals = SignalSet()
+        for domain_signals in fragment.drivers.values():
+            signals |= domain_signals
+        for stmt in fragment.statements:
+            signals |= stmt._lhs_signals() | stmt._rhs_signals()
+        for signal in signals:
+            names.setdefault(signal, ".".join((*hierarchy, signal.name or "$signal")))
+        for i, (subfragment, subfragment_name) in enumerate(fragment.subfragments):
+            walk(subfragment, (*hierarchy, subfragment_name or f"U${i}"))
+
+    walk(fragment, ())
+    return SignalDict((signal, name) for signal, name in names.items() if signal not in clocks)
+
+
+# Opt-in waveform capture of single simulation run, sampled once per cycle (see 'SimHarness.run'),
+# written to 'vcd_file' by 'write' - so that long runs can be traced without dumping every signal of every cycle:
+# * 'signals' - allowlist of name patterns (None - all signals). Pattern matches hierarchical name (see 'signal_names')
+#   or any of it's trailing parts (e.g. "arbiter.bus" matches "cpu.arbiter.bus__cyc", "fsm_state" matches state of
+#   each FSM), as case-insensitive prefix - it may contain wildcards ('fnmatch' ones).
+# * 'cycles' - (start, stop) range of cycles captured,
+# * 'start_pc' - capture starts in the first cycle CPU executes instruction at given address ('MtkCpu.pc'),
+#   'stop_pc' - ends after such a cycle,
+# * 'last' - ring buffer mode, only the last 'last' cycles of captured ones are kept,
+# * 'on_failure' - 'write' is meant to be called only when test fails (see 'reg_test'), together with 'last'
+#   it gives the last cycles before failed check.
+class WaveformCapture:
+    def __init__(self, vcd_file, signals=None, cycles=None, start_pc=None, stop_pc=None, last=None, on_failure=False):
+        if last is not None and last < 1:
+            raise ValueError(f"Ring buffer must keep at least one cycle, not {last}!")
+        if cycles is not None and not 0 <= cycles[0] <= cycles[1]:
+            raise ValueError(f"Invalid range of cycles {cycles}!")
+        self.vcd_file = vcd_file
+        self.patterns = signals
+        self.cycles = cycles
+        self.start_pc = start_pc
+        self.stop_pc = stop_pc
+        self.last = last
+        self.on_failure = on_failure
+
+    def selected(self, name):
+        if self.patterns is None:
+            return True
+        parts = name.lower().split(".")
+        tails = [".".join(parts[i:]) for i in range(len(parts))]
+        return any(fnmatchcase(tail, pattern.lower() + "*") for tail in tails for pattern in self.patterns)
+
+    # Called by testbench before simulation starts, with 'names' of all signals of design (see 'signal_names').
+    # Returns list of signals, that are to be passed to 'sample' in each cycle.
+    def start(self, names):
+        self.signals = [signal for signal, name in names.items() if self.selected(name)]
+        self.names = [names[signal] for signal in self.signals]
+        if not self.signals:
+            raise ValueError(f"No signal matches any of {self.patterns}!")
+        self.started = self.start_pc is None
+        self.stopped = False
+        # values at the beginning of the window, and changes in each cycle of it.
+        self.base = [signal.reset for signal in self.signals]
+        self.prev = list(self.base)
+        self.window = deque()
+        return self.signals
+
+    # Called by testbench once per cycle, with 'values' of signals returned by 'start' and 'pc'.
+    def sample(self, cycle, pc, values):
+        if self.stopped:
+            return
+        if self.cycles is not None and not self.cycles[0] <= cycle < self.cycles[1]:
+            return
+        if not self.started:
+            if pc != self.start_pc:
+                return
+            self.started = True
+        if pc == self.stop_pc:
+            self.stopped = True
+
+        changes = [(i, v) for i, (v, prev) in enumerate(zip(values, self.prev)) if v != prev]
+        self.prev = list(values)
+        self.window.append((cycle, changes))
+        if self.last is not None and len(self.window) > self.last:
+            _, dropped = self.window.popleft()
+            for i, v in dropped:
+                self.base[i] = v
+
+    def write(self):
+        # values in the first captured cycle are the initial ones.
+        window = list(self.window)
+        values = list(self.base)
+        first_cycle = 0
+        if window:
+            first_cycle, changes = window.pop(0)
+            for i, v in changes:
+                values[i] = v
+
+        with open(self.vcd_file, "wt") as f:
+            with VCDWriter(f, timescale="1 us", comment="Generated by mtkcpu testbench",
+                    init_timestamp=first_cycle) as writer:
+                vcd_vars = []
+                for signal, name, init in zip(self.signals, self.names, values):
+                    *scope, var_name = ["top", *name.split(".")]
+                    if signal.decoder:
+                        var_type, var_size, var_init = "string", 1, self.decode(signal, init)
+                    else:
+                        var_type, var_size, var_init = "wire", len(signal), init
+                    # names aren't unique, same as 'pysim' does, suffix is added to the repeated ones.
+                    suffix = 0
+                    while True:
+                        try:
+                            var = writer.register_var(scope, var_name if not suffix else f"{var_name}${suffix}",
+                                var_type, size=var_size, init=var_init)
+                            break
+                        except KeyError:
+                            suffix += 1
+                    vcd_vars.append(var)
+                cycle = first_cycle
+                for cycle, changes in window:
+                    for i, v in changes:
+                        signal = self.signals[i]
+                        writer.change(vcd_vars[i], cycle, self.decode(signal, v) if signal.decoder else v)
+                writer.close(cycle + 1)
+
+    @staticmethod
+    def decode(signal, value):
+        return signal.decoder(value).expandtabs().replace(" ", "_")